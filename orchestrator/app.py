@@ -1,15 +1,22 @@
 import os
+import re
 import json
+import asyncio
 import logging
 from datetime import datetime, timezone
+from typing import Optional
 from quart import Quart, request, jsonify
-from prometheus_client import Counter, Histogram, Gauge
-import psycopg2
+from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
 from auth_middleware import require_auth
 import discord_service
 from websocket_handler import ws_bp, setup_broadcast
-from services import llm_router, agent_manager, obsidian_service, pm_agent
+from services import (llm_router, agent_manager, obsidian_service, pm_agent,
+                      link_graph, vector_index, vault_bulk, task_dispatcher,
+                      worker_reaper, model_residency, progress_relay, db,
+                      complexity_scorer, prompt_builder, llm_batch, routing_policy,
+                      model_catalog)
 from services.agent_manager import AgentRole, AgentStatus
+from services.db import get_db_connection
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -48,15 +55,6 @@ DEFAULT_TEMPLATES = [
 ]
 
 
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.environ.get('DB_HOST', 'database'),
-        database=os.environ.get('DB_NAME', 'postgres'),
-        user=os.environ.get('DB_USER', 'postgres'),
-        password=os.environ.get('DB_PASSWORD', 'postgres'),
-    )
-
-
 # ---------------------------------------------------------------------------
 # App startup
 # ---------------------------------------------------------------------------
@@ -64,11 +62,50 @@ def get_db_connection():
 @app.before_serving
 async def startup():
     setup_broadcast(app)
+    # Keep vault indexes current with writes made through the service
+    obsidian_service.add_change_listener(link_graph.on_vault_changes)
+    obsidian_service.add_change_listener(vector_index.on_vault_changes)
+    asyncio.ensure_future(link_graph.ensure_built())
+    asyncio.ensure_future(vector_index.sync_with_vault())
+    # Load the default and pinned models so the first request isn't a cold load
+    asyncio.ensure_future(llm_router.warm_up())
+    # Publish pending DB tasks to the worker queues
+    task_dispatcher.start()
+    # Mark silent workers offline and reclaim their tasks
+    worker_reaper.start()
+    # Relay workers' streaming progress to /ws clients
+    progress_relay.start()
+    # Pick up polling of Claude batch jobs submitted before a restart
+    llm_batch.resume()
     # Ensure the PM agent exists at boot
     await agent_manager.ensure_pm_agent()
     logger.info("Orchestrator started — PM agent ready.")
 
 
+@app.after_serving
+async def shutdown():
+    llm_batch.stop()
+    model_catalog.flush()
+    progress_relay.stop()
+    worker_reaper.stop()
+    await task_dispatcher.stop()
+
+
+def _int_arg(name: str, default: int, maximum: Optional[int] = None) -> int:
+    """Integer query parameter (capped at maximum); ValueError if malformed."""
+    raw = request.args.get(name)
+    if raw is None or raw == '':
+        value = default
+    else:
+        try:
+            value = int(raw)
+        except ValueError:
+            raise ValueError(f"{name} must be an integer") from None
+    if value < 0:
+        raise ValueError(f"{name} must not be negative")
+    return min(value, maximum) if maximum is not None else value
+
+
 # ---------------------------------------------------------------------------
 # Health / Metrics
 # ---------------------------------------------------------------------------
@@ -115,6 +152,12 @@ async def metrics():
         if 'conn' in locals(): conn.close()
 
 
+@app.route('/metrics/prometheus')
+async def prometheus_metrics():
+    """Prometheus exposition format (scraped by config/prometheus.yml)."""
+    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
 # ---------------------------------------------------------------------------
 # Auth
 # ---------------------------------------------------------------------------
@@ -167,6 +210,7 @@ async def handle_projects():
                              datetime.now(timezone.utc))
                         )
             conn.commit()
+            task_dispatcher.notify()
             cur.execute(
                 'SELECT id, name, description, status, created_at, updated_at, metadata '
                 'FROM projects WHERE id = %s', (project_id,)
@@ -211,29 +255,122 @@ async def handle_projects():
         if conn: conn.close()
 
 
+@app.route('/api/tasks/dispatch', methods=['GET'])
+@require_auth
+async def dispatch_status():
+    """Task dispatcher counters and in-flight lease totals."""
+    try:
+        return await jsonify(await task_dispatcher.status())
+    except Exception as e:
+        logger.error(f"Error fetching dispatch status: {e}")
+        return await jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/workers/health', methods=['GET'])
+@require_auth
+async def worker_health():
+    """Fleet capacity and the outcome of the last reaper pass."""
+    return await jsonify(worker_reaper.status())
+
+
+def _task_result(task_id: int):
+    with db.transaction() as cur:
+        cur.execute(
+            "SELECT t.status, t.metadata->'result', r.result "
+            "FROM tasks t LEFT JOIN task_results r ON r.task_id = t.id WHERE t.id = %s",
+            (task_id,)
+        )
+        return cur.fetchone()
+
+
+@app.route('/api/tasks/<int:task_id>/result', methods=['GET'])
+@require_auth
+async def task_result(task_id):
+    """Full task result, including results too large to keep in tasks.metadata."""
+    try:
+        row = await asyncio.to_thread(_task_result, task_id)
+    except Exception as e:
+        logger.error(f"Error fetching result of task {task_id}: {e}")
+        return await jsonify({"error": str(e)}), 500
+    if row is None:
+        return await jsonify({"error": "Task not found"}), 404
+    status, inline, stored = row
+    return await jsonify({
+        "task_id": task_id,
+        "status": status,
+        "result": stored if stored is not None else inline,
+    })
+
+
+@app.route('/api/tasks/dispatch', methods=['POST'])
+@require_auth
+async def dispatch_now():
+    """Wake the dispatcher immediately instead of waiting for its next poll."""
+    task_dispatcher.notify()
+    return await jsonify({"status": "scheduled"}), 202
+
+
 # ---------------------------------------------------------------------------
 # Chat with PM Agent
 # ---------------------------------------------------------------------------
 
+# In-flight chat requests by client-chosen request id, for cancellation
+_chat_requests: dict[str, asyncio.Task] = {}
+
+
 @app.route('/api/chat', methods=['POST'])
 @require_auth
 async def chat():
-    """Send a message to the Project Manager agent."""
+    """Send a message to the Project Manager agent.
+
+    With a request_id (body field or X-Request-ID header) the request can
+    be aborted through POST /api/chat/<request_id>/cancel.  Either way, a
+    client disconnect cancels it, down to the backend generation.
+    """
     try:
         data = await request.get_json()
         if not data or 'message' not in data:
             return await jsonify({"error": "message is required"}), 400
-        result = await pm_agent.handle_message(data['message'])
+        request_id = data.get('request_id') or request.headers.get('X-Request-ID')
+        if request_id in _chat_requests:
+            return await jsonify({"error": f"Request {request_id} is already in flight"}), 409
+        task = asyncio.ensure_future(pm_agent.handle_message(data['message']))
+        if request_id:
+            _chat_requests[request_id] = task
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if request_id and _chat_requests.get(request_id) is not task:
+                # Cancelled through the cancel endpoint, not by a disconnect
+                return await jsonify({"error": "Request cancelled", "request_id": request_id}), 499
+            raise
+        finally:
+            if request_id and _chat_requests.get(request_id) is task:
+                del _chat_requests[request_id]
         return await jsonify(result)
     except Exception as e:
         logger.error(f"Chat error: {e}")
         return await jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/chat/<request_id>/cancel', methods=['POST'])
+@require_auth
+async def cancel_chat(request_id):
+    """Abort an in-flight chat request and the LLM calls it is waiting on."""
+    task = _chat_requests.pop(request_id, None)
+    if task is None:
+        return await jsonify({"error": "No such request in flight"}), 404
+    task.cancel()
+    return await jsonify({"request_id": request_id, "status": "cancelled"}), 202
+
+
 @app.route('/api/chat/history', methods=['GET'])
 @require_auth
 async def chat_history():
-    limit = int(request.args.get('limit', 50))
+    try:
+        limit = _int_arg('limit', 50)
+    except ValueError as e:
+        return await jsonify({"error": str(e)}), 400
     return await jsonify(pm_agent.get_chat_history(limit))
 
 
@@ -264,11 +401,15 @@ async def spawn_agent():
             role = AgentRole(role_str)
         except ValueError:
             return await jsonify({"error": f"Unknown role: {role_str}"}), 400
-        agent = await agent_manager.spawn_agent(
-            role,
-            name=data.get('name'),
-            prefer_remote_gpu=data.get('prefer_remote_gpu', False),
-        )
+        try:
+            agent = await agent_manager.spawn_agent(
+                role,
+                name=data.get('name'),
+                prefer_remote_gpu=data.get('prefer_remote_gpu', False),
+                routing=data.get('routing'),
+            )
+        except ValueError as e:
+            return await jsonify({"error": str(e)}), 400
         return await jsonify(agent.to_dict()), 201
     except Exception as e:
         return await jsonify({"error": str(e)}), 500
@@ -332,6 +473,169 @@ async def vault_search():
     return await jsonify(results)
 
 
+@app.route('/api/vault/scan', methods=['GET'])
+@require_auth
+async def vault_scan():
+    """Raw regex/substring scan, streamed back as NDJSON hits."""
+    q = request.args.get('q', '')
+    if not q:
+        return await jsonify({"error": "q parameter required"}), 400
+    try:
+        pattern = obsidian_service.compile_scan_pattern(
+            q,
+            regex=request.args.get('regex', 'false').lower() in ('1', 'true', 'yes'),
+            ignore_case=request.args.get('case', 'false').lower() not in ('1', 'true', 'yes'),
+        )
+    except re.error as e:
+        return await jsonify({"error": f"Invalid pattern: {e}"}), 400
+    try:
+        limit = _int_arg('limit', 100, maximum=10000)
+        per_note = _int_arg('per_note', 5, maximum=1000)
+    except ValueError as e:
+        return await jsonify({"error": str(e)}), 400
+    folder = request.args.get('folder', '')
+
+    async def stream():
+        async for hit in obsidian_service.scan_vault(
+                pattern, folder=folder, limit=limit, per_note=per_note):
+            yield (json.dumps(hit) + "\n").encode("utf-8")
+
+    return stream(), 200, {'Content-Type': 'application/x-ndjson'}
+
+
+@app.route('/api/vault/import', methods=['POST'])
+@require_auth
+async def vault_import():
+    """Bulk import: NDJSON lines of notes, or a tar / tar.gz of .md files."""
+    content_type = (request.content_type or '').split(';')[0].strip()
+    overwrite = request.args.get('overwrite', 'true').lower() in ('1', 'true', 'yes')
+    try:
+        if content_type in ('application/x-tar', 'application/gzip',
+                            'application/x-gzip', 'application/x-gtar'):
+            summary = await vault_bulk.import_tar(request.body, overwrite=overwrite)
+        elif content_type in ('application/x-ndjson', 'application/jsonl',
+                              'application/json-lines', 'text/plain'):
+            summary = await vault_bulk.import_ndjson(request.body, overwrite=overwrite)
+        else:
+            return await jsonify({"error": f"Unsupported Content-Type: {content_type}"}), 415
+        return await jsonify(summary), 201
+    except vault_bulk.BulkFormatError as e:
+        return await jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Vault import failed: {e}")
+        return await jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/vault/export', methods=['GET'])
+@require_auth
+async def vault_export():
+    """Bulk export of a folder as a streamed tar, tar.gz or zip archive."""
+    fmt = request.args.get('format', 'tar')
+    folder = request.args.get('folder', '')
+    if fmt not in vault_bulk.EXPORT_FORMATS:
+        return await jsonify({"error": f"format must be one of {list(vault_bulk.EXPORT_FORMATS)}"}), 400
+    ext = {'tar': 'tar', 'tgz': 'tar.gz', 'zip': 'zip'}[fmt]
+    name = (folder.strip('/').replace('/', '_') or 'vault') + '.' + ext
+    try:
+        chunks = await vault_bulk.export_stream(folder, fmt)
+    except ValueError as e:
+        return await jsonify({"error": str(e)}), 400
+    return chunks, 200, {
+        'Content-Type': vault_bulk.EXPORT_FORMATS[fmt],
+        'Content-Disposition': f'attachment; filename="{name}"',
+    }
+
+
+@app.route('/api/vault/links/<path:note_path>', methods=['GET'])
+@require_auth
+async def vault_links(note_path):
+    await link_graph.ensure_built()
+    return await jsonify({
+        "path": note_path,
+        "outgoing": link_graph.outgoing_links(note_path),
+        "backlinks": link_graph.backlinks(note_path),
+    })
+
+
+@app.route('/api/vault/backlinks/<path:note_path>', methods=['GET'])
+@require_auth
+async def vault_backlinks(note_path):
+    await link_graph.ensure_built()
+    return await jsonify(link_graph.backlinks(note_path))
+
+
+@app.route('/api/vault/graph/<path:note_path>', methods=['GET'])
+@require_auth
+async def vault_graph(note_path):
+    try:
+        depth = _int_arg('depth', 1, maximum=5)
+        limit = _int_arg('limit', 100, maximum=1000)
+    except ValueError as e:
+        return await jsonify({"error": str(e)}), 400
+    await link_graph.ensure_built()
+    return await jsonify(link_graph.neighbourhood(note_path, depth=depth, limit=limit))
+
+
+@app.route('/api/vault/tags', methods=['GET'])
+@require_auth
+async def vault_tags():
+    await link_graph.ensure_built()
+    return await jsonify(link_graph.list_tags())
+
+
+@app.route('/api/vault/tags/<path:tag>', methods=['GET'])
+@require_auth
+async def vault_tag_notes(tag):
+    await link_graph.ensure_built()
+    return await jsonify(link_graph.notes_with_tag(tag))
+
+
+@app.route('/api/vault/meta/<key>', methods=['GET'])
+@require_auth
+async def vault_meta_key_notes(key):
+    await link_graph.ensure_built()
+    return await jsonify(link_graph.notes_with_key(key))
+
+
+@app.route('/api/vault/retrieve', methods=['GET'])
+@require_auth
+async def vault_retrieve():
+    q = request.args.get('q', '')
+    if not q:
+        return await jsonify({"error": "q parameter required"}), 400
+    try:
+        k = _int_arg('k', 5, maximum=50)
+        budget = _int_arg('budget', 1500)
+    except ValueError as e:
+        return await jsonify({"error": str(e)}), 400
+    try:
+        chunks = await vector_index.retrieve(
+            q,
+            k=k,
+            token_budget=budget,
+            folder=request.args.get('folder', ''),
+        )
+        return await jsonify(chunks)
+    except Exception as e:
+        logger.error(f"Vault retrieval failed: {e}")
+        return await jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/vault/index', methods=['GET'])
+@require_auth
+async def vault_index_stats():
+    return await jsonify({
+        "links": link_graph.stats(),
+        "vectors": vector_index.stats(),
+    })
+
+
+@app.route('/api/vault/cache', methods=['GET'])
+@require_auth
+async def vault_cache_stats():
+    return await jsonify(obsidian_service.cache_stats())
+
+
 # ---------------------------------------------------------------------------
 # LLM Backend Status
 # ---------------------------------------------------------------------------
@@ -340,8 +644,187 @@ async def vault_search():
 @require_auth
 async def llm_status():
     status = await llm_router.health_check()
+    status["singleflight"] = llm_router.singleflight_stats()
+    status["latency"] = llm_router.latency_stats()
+    status["circuit_breakers"] = llm_router.breaker_status()
+    status["complexity"] = complexity_scorer.status()
+    status["prompt_budget"] = prompt_builder.describe(llm_router.LOCAL_MODEL)
+    status["routing_policy"] = {k: v for k, v in routing_policy.status().items() if k != "policy"}
     return await jsonify(status)
 
 
+@app.route('/api/llm/models', methods=['GET'])
+@require_auth
+async def llm_models():
+    """Models loaded (per /api/ps) and pinned on each Ollama backend."""
+    return await jsonify(await llm_router.model_status())
+
+
+@app.route('/api/llm/catalog', methods=['GET'])
+@require_auth
+async def llm_catalog():
+    """Installed models, measured speeds and the model chosen per tier on each backend."""
+    refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+    return await jsonify(await llm_router.catalog_status(refresh=refresh))
+
+
+@app.route('/api/llm/models/preload', methods=['POST'])
+@require_auth
+async def llm_preload():
+    """Load a model on a backend: {"model", "backend": "local"|"remote", "keep_alive"?}."""
+    data = await request.get_json() or {}
+    model = data.get('model')
+    backend = data.get('backend', 'local')
+    backends = llm_router.ollama_backends()
+    if not model:
+        return await jsonify({"error": "model is required"}), 400
+    if backend not in backends:
+        return await jsonify({"error": f"Unknown backend: {backend}"}), 400
+    ok = await model_residency.preload(backend, backends[backend], model, data.get('keep_alive'))
+    return await jsonify({"model": model, "backend": backend, "loaded": ok}), 200 if ok else 502
+
+
+@app.route('/api/llm/routing/feedback', methods=['POST'])
+@require_auth
+async def llm_routing_feedback():
+    """Label a routing decision for training: {"decision_id", "needs_claude": bool}."""
+    data = await request.get_json() or {}
+    decision_id = data.get('decision_id')
+    if not decision_id or not isinstance(data.get('needs_claude'), bool):
+        return await jsonify({"error": "decision_id and boolean needs_claude are required"}), 400
+    complexity_scorer.record_feedback(decision_id, data['needs_claude'])
+    return await jsonify({"decision_id": decision_id, "recorded": True})
+
+
+@app.route('/api/llm/routing/policy', methods=['GET'])
+@require_auth
+async def llm_routing_policy():
+    """The routing policy in force; with ?role=&agent=&task_type= also the rule they resolve to."""
+    status = routing_policy.status()
+    args = {k: request.args.get(k) for k in ('role', 'agent', 'task_type')}
+    if any(args.values()):
+        status["decision"] = routing_policy.resolve(**args).to_dict()
+    return await jsonify(status)
+
+
+
+# ---------------------------------------------------------------------------
+# LLM Batch Jobs
+# ---------------------------------------------------------------------------
+
+@app.route('/api/llm/batches', methods=['POST'])
+@require_auth
+async def llm_batch_submit():
+    """Start a batch job: {"requests": [{"id"?, "prompt", "system"?}], "backend"?, "model"?, "max_tokens"?}."""
+    data = await request.get_json() or {}
+    requests = data.get('requests')
+    if not isinstance(requests, list) or not requests:
+        return await jsonify({"error": "requests must be a non-empty list"}), 400
+    try:
+        job = llm_batch.submit(requests, data.get('backend', 'auto'), data.get('model'),
+                               data.get('max_tokens', 4096))
+    except ValueError as e:
+        return await jsonify({"error": str(e)}), 400
+    return await jsonify(job.summary()), 202
+
+
+@app.route('/api/llm/batches', methods=['GET'])
+@require_auth
+async def llm_batch_list():
+    return await jsonify(llm_batch.jobs())
+
+
+@app.route('/api/llm/batches/<job_id>', methods=['GET'])
+@require_auth
+async def llm_batch_status(job_id):
+    job = llm_batch.get(job_id)
+    if job is None:
+        return await jsonify({"error": "Batch job not found"}), 404
+    return await jsonify(job.summary())
+
+
+@app.route('/api/llm/batches/<job_id>/results', methods=['GET'])
+@require_auth
+async def llm_batch_results(job_id):
+    results = llm_batch.results(job_id)
+    if results is None:
+        return await jsonify({"error": "Batch job not found"}), 404
+    return await jsonify({"id": job_id, "results": results})
+
+
+@app.route('/api/llm/batches/<job_id>/cancel', methods=['POST'])
+@require_auth
+async def llm_batch_cancel(job_id):
+    cancelled = await llm_batch.cancel(job_id)
+    if not cancelled:
+        return await jsonify({"error": "Batch job not found or already finished"}), 404
+    return await jsonify({"id": job_id, "status": "canceling"}), 202
+
+
+def _completed_task_results(project_id: int):
+    with db.transaction() as cur:
+        cur.execute("SELECT name FROM projects WHERE id = %s", (project_id,))
+        project = cur.fetchone()
+        if project is None:
+            return None, []
+        cur.execute(
+            "SELECT t.id, t.description, COALESCE(r.result, t.metadata->'result') "
+            "FROM tasks t LEFT JOIN task_results r ON r.task_id = t.id "
+            "WHERE t.project_id = %s AND t.status = 'completed' ORDER BY t.id",
+            (project_id,)
+        )
+        return project[0], cur.fetchall()
+
+
+async def _write_task_summaries(job, name, descriptions):
+    lines = [f"# Task summaries: {name}\n"]
+    for task_id, result in job.results.items():
+        summary = result.get("text") or f"_not summarised: {result.get('error')}_"
+        lines.append(f"## {descriptions[task_id]} (task {task_id})\n\n{summary.strip()}\n")
+    await obsidian_service.write_note(f"Projects/{name}/task_summaries", "\n".join(lines),
+                                      {"batch_job": job.id})
+
+
+# Registered by name so a job resumed after a restart still writes its note
+llm_batch.register_callback("project_summaries", _write_task_summaries)
+
+
+@app.route('/api/projects/<int:project_id>/summaries', methods=['POST'])
+@require_auth
+async def summarize_project_tasks(project_id):
+    """Summarise every completed task of a project as one batch job; the
+    summaries are written to Projects/<name>/task_summaries when it ends."""
+    data = await request.get_json(silent=True) or {}
+    try:
+        name, rows = await asyncio.to_thread(_completed_task_results, project_id)
+    except Exception as e:
+        logger.error(f"Error loading tasks of project {project_id}: {e}")
+        return await jsonify({"error": str(e)}), 500
+    if name is None:
+        return await jsonify({"error": "Project not found"}), 404
+    descriptions, requests = {}, []
+    for task_id, description, result in rows:
+        if result is None:
+            continue
+        text = result if isinstance(result, str) else json.dumps(result)
+        descriptions[str(task_id)] = description
+        requests.append({
+            "id": str(task_id),
+            "system": "Summarise the outcome of a completed task in 2-3 sentences.",
+            "prompt": f"Task: {description}\n\nResult:\n"
+                      + prompt_builder.truncate(text, 4000, llm_router.LOCAL_MODEL, "extractive"),
+        })
+    if not requests:
+        return await jsonify({"error": "No completed tasks with results"}), 404
+
+    try:
+        job = llm_batch.submit(requests, data.get('backend', 'auto'),
+                               on_complete="project_summaries",
+                               on_complete_args={"name": name, "descriptions": descriptions})
+    except ValueError as e:
+        return await jsonify({"error": str(e)}), 400
+    return await jsonify(job.summary()), 202
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,18 @@
+-- Migration 05: Task dispatch leases
+-- The orchestrator's task dispatcher claims pending tasks, publishes them
+-- to RabbitMQ and records a lease; tasks whose lease runs out without a
+-- result are reclaimed.
+
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS dispatched_at    TIMESTAMPTZ;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS dispatch_count   INTEGER NOT NULL DEFAULT 0;
+
+-- Claim order for the dispatcher (pending only, highest priority first)
+CREATE INDEX IF NOT EXISTS idx_tasks_pending_priority
+    ON tasks (priority DESC, created_at)
+    WHERE status = 'pending';
+
+-- In-flight tasks by lease expiry
+CREATE INDEX IF NOT EXISTS idx_tasks_lease_expires
+    ON tasks (lease_expires_at)
+    WHERE status IN ('dispatched', 'processing');
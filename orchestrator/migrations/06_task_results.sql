@@ -0,0 +1,11 @@
+-- Migration 06: Large task results
+-- Workers store results over RESULT_INLINE_MAX_BYTES here; the task's
+-- metadata.result then only holds {"stored_in": "task_results", "bytes",
+-- "preview"}, keeping the tasks rows (and every query over them) small.
+
+CREATE TABLE IF NOT EXISTS task_results (
+    task_id     INTEGER      PRIMARY KEY REFERENCES tasks(id) ON DELETE CASCADE,
+    result      TEXT         NOT NULL,
+    bytes       INTEGER      NOT NULL DEFAULT 0,
+    created_at  TIMESTAMPTZ  NOT NULL DEFAULT NOW()
+);
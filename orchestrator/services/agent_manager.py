@@ -4,7 +4,8 @@ Agent Manager - Spawns, tracks, and manages specialized sub-agents.
 Each agent has:
   - A unique ID and human-readable name
   - A specialization (role)
-  - An assigned LLM backend preference
+  - An assigned LLM backend preference, and optionally its own
+    routing_policy rule (backends, model, ...) applied over the policy
   - A current task and status
   - A desk position in the pixel-art office UI
 
@@ -21,8 +22,13 @@ from dataclasses import dataclass, field, asdict
 from typing import Optional
 from enum import Enum
 
+from . import obsidian_service, routing_policy
+
 logger = logging.getLogger(__name__)
 
+# Vault folder holding per-role instructions: instructions/{role}.md
+INSTRUCTIONS_FOLDER = os.environ.get("AGENT_INSTRUCTIONS_FOLDER", "instructions")
+
 
 class AgentStatus(str, Enum):
     IDLE      = "idle"
@@ -122,6 +128,7 @@ class Agent:
     color: str = "#FFFFFF"
     system_prompt: str = ""
     prefer_remote_gpu: bool = False
+    routing: dict = field(default_factory=dict)   # routing_policy rule overrides
     created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     task_history: list = field(default_factory=list)
 
@@ -156,6 +163,30 @@ async def _broadcast(event: str, data: dict):
             logger.warning(f"Broadcast failed: {e}")
 
 
+# ---------------------------------------------------------------------------
+# System prompt layers
+# ---------------------------------------------------------------------------
+
+async def role_instructions(role: AgentRole) -> str:
+    """Body of the vault note instructions/{role}.md, or "" if there is none."""
+    try:
+        note = await obsidian_service.read_note(f"{INSTRUCTIONS_FOLDER}/{role.value}.md")
+    except Exception as e:
+        logger.warning(f"Could not read instructions for {role.value}: {e}")
+        return ""
+    return note["body"].strip() if note else ""
+
+
+async def system_layers(role: AgentRole, *extra: str) -> list[str]:
+    """
+    System prompt for role as layers: identity (ROLE_SYSTEM_PROMPTS), the
+    role's vault instructions, then any extra fixed text.  Every layer is
+    stable across requests, so the router can send them as a cached prefix.
+    """
+    layers = [ROLE_SYSTEM_PROMPTS.get(role, ""), await role_instructions(role), *extra]
+    return [layer for layer in layers if layer]
+
+
 # ---------------------------------------------------------------------------
 # Public API
 # ---------------------------------------------------------------------------
@@ -164,8 +195,14 @@ async def spawn_agent(
     role: AgentRole,
     name: Optional[str] = None,
     prefer_remote_gpu: bool = False,
+    routing: Optional[dict] = None,
 ) -> Agent:
-    """Create and register a new agent of the given role."""
+    """Create and register a new agent of the given role.
+
+    routing: routing_policy rule fields for this agent's LLM calls;
+    raises ValueError if they are invalid.
+    """
+    routing = routing_policy.validate_rule(routing or {}, "routing")
     async with _agent_lock:
         agent_id = str(uuid.uuid4())
         if name is None:
@@ -182,6 +219,7 @@ async def spawn_agent(
             color=ROLE_COLORS.get(role, "#FFFFFF"),
             system_prompt=ROLE_SYSTEM_PROMPTS.get(role, ""),
             prefer_remote_gpu=prefer_remote_gpu,
+            routing=routing,
         )
         _agents[agent_id] = agent
         logger.info(f"Spawned agent {name} ({role.value}) id={agent_id}")
@@ -0,0 +1,128 @@
+"""
+Backend Latency Stats
+
+Rolling per-backend latency and error windows for the LLM router.
+
+  - Every backend call records its time to first token (first streamed
+    chunk; the whole call for non-streaming backends), its total time and
+    whether it succeeded.  Calls that report their output length also
+    record it and, when streamed, the time per output token after the
+    first.  Cancelled calls are not recorded.
+  - Windows hold the last BACKEND_STATS_WINDOW samples and ignore samples
+    older than BACKEND_STATS_MAX_AGE seconds, so the numbers describe how
+    a backend is behaving now rather than since startup.
+  - percentile() returns None until a backend has BACKEND_STATS_MIN_SAMPLES
+    fresh samples; callers fall back to their own defaults.
+
+Backends are keyed by the router's LLMBackend values ("local_ollama",
+"remote_ollama", "claude_api"); this module has no routing logic of its own.
+"""
+
+import os
+import time
+from collections import deque
+from typing import Optional
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+STATS_WINDOW      = int(os.environ.get("BACKEND_STATS_WINDOW", "200"))
+STATS_MAX_AGE     = float(os.environ.get("BACKEND_STATS_MAX_AGE", "600"))
+STATS_MIN_SAMPLES = int(os.environ.get("BACKEND_STATS_MIN_SAMPLES", "20"))
+# A backend failing more than this share of recent calls is not healthy
+UNHEALTHY_ERROR_RATE = float(os.environ.get("BACKEND_UNHEALTHY_ERROR_RATE", "0.5"))
+_MIN_OUTCOMES = 5
+
+METRICS = ("first_token", "total", "per_token", "output_tokens")
+
+
+class _Window:
+    """Last STATS_WINDOW (monotonic time, value) samples."""
+
+    def __init__(self):
+        self._samples: deque = deque(maxlen=STATS_WINDOW)
+
+    def add(self, value: float) -> None:
+        self._samples.append((time.monotonic(), value))
+
+    def values(self) -> list:
+        cutoff = time.monotonic() - STATS_MAX_AGE
+        return [v for t, v in self._samples if t >= cutoff]
+
+
+_latency: dict[str, dict[str, _Window]] = {}
+_outcomes: dict[str, _Window] = {}     # 1.0 = error, 0.0 = success
+
+
+def _windows(backend: str) -> dict[str, _Window]:
+    return _latency.setdefault(backend, {m: _Window() for m in METRICS})
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+def record(backend: str, first_token: Optional[float], total: float,
+           output_tokens: Optional[int] = None) -> None:
+    """Record a successful call (seconds)."""
+    windows = _windows(backend)
+    windows["first_token"].add(first_token if first_token is not None else total)
+    windows["total"].add(total)
+    if output_tokens:
+        windows["output_tokens"].add(output_tokens)
+        if first_token is not None and output_tokens > 1:
+            windows["per_token"].add((total - first_token) / (output_tokens - 1))
+    _outcomes.setdefault(backend, _Window()).add(0.0)
+
+
+def record_error(backend: str) -> None:
+    """Record a failed call (timeouts included)."""
+    _outcomes.setdefault(backend, _Window()).add(1.0)
+
+
+# ---------------------------------------------------------------------------
+# Queries
+# ---------------------------------------------------------------------------
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def percentile(backend: str, q: float, metric: str = "first_token") -> Optional[float]:
+    """q-th percentile (0-100) of a backend's recent latency, or None if too few samples."""
+    values = _windows(backend)[metric].values()
+    if len(values) < STATS_MIN_SAMPLES:
+        return None
+    return _percentile(values, q)
+
+
+def error_rate(backend: str) -> Optional[float]:
+    """Share of recent calls that failed, or None with too few calls to tell."""
+    outcomes = _outcomes.get(backend)
+    values = outcomes.values() if outcomes else []
+    if len(values) < _MIN_OUTCOMES:
+        return None
+    return sum(values) / len(values)
+
+
+def is_healthy(backend: str) -> bool:
+    rate = error_rate(backend)
+    return rate is None or rate <= UNHEALTHY_ERROR_RATE
+
+
+def snapshot() -> dict:
+    """Recent sample counts, p50/p95/p99 latencies and error rate per backend."""
+    result = {}
+    for backend in sorted(set(_latency) | set(_outcomes)):
+        entry = {"error_rate": error_rate(backend), "healthy": is_healthy(backend)}
+        for metric, window in _windows(backend).items():
+            values = window.values()
+            entry[metric] = {
+                "samples": len(values),
+                **{f"p{q}": round(_percentile(values, q), 3) if values else None
+                   for q in (50, 95, 99)},
+            }
+        result[backend] = entry
+    return result
@@ -0,0 +1,207 @@
+"""
+Circuit Breakers
+
+One breaker per LLM backend, so a backend that is failing (Claude 429/5xx,
+a flapping Ollama host) or has become very slow stops costing every
+request a timeout before the router falls back.
+
+  closed     Calls go through.  The last BREAKER_WINDOW outcomes (newer
+             than BREAKER_WINDOW_SECONDS) are kept; once there are at least
+             BREAKER_MIN_CALLS, the breaker opens when the failure rate
+             reaches BREAKER_ERROR_RATE or the share of slow calls (time to
+             first token over BREAKER_SLOW_SECONDS) reaches
+             BREAKER_SLOW_RATE.
+  open       Calls are rejected immediately with CircuitOpenError.  After
+             the cooldown (BREAKER_OPEN_SECONDS, doubling on every re-open
+             up to BREAKER_MAX_OPEN_SECONDS) the breaker goes half-open.
+  half_open  At most BREAKER_HALF_OPEN_PROBES trial calls at a time.
+             BREAKER_HALF_OPEN_SUCCESSES successful trials close it again
+             (and reset the cooldown); a failed or slow trial re-opens it.
+
+Caller errors (4xx other than 408/429) say nothing about backend health
+and are not counted.  Breakers are keyed by the router's LLMBackend
+values and only live in this process.
+"""
+
+import os
+import time
+import logging
+from collections import deque
+from typing import Optional
+
+import aiohttp
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+BREAKER_WINDOW              = int(os.environ.get("BREAKER_WINDOW", "20"))
+BREAKER_WINDOW_SECONDS      = float(os.environ.get("BREAKER_WINDOW_SECONDS", "120"))
+BREAKER_MIN_CALLS           = int(os.environ.get("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE          = float(os.environ.get("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_SECONDS        = float(os.environ.get("BREAKER_SLOW_SECONDS", "30"))
+BREAKER_SLOW_RATE           = float(os.environ.get("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_OPEN_SECONDS        = float(os.environ.get("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_MAX_OPEN_SECONDS    = float(os.environ.get("BREAKER_MAX_OPEN_SECONDS", "300"))
+BREAKER_HALF_OPEN_PROBES    = int(os.environ.get("BREAKER_HALF_OPEN_PROBES", "1"))
+BREAKER_HALF_OPEN_SUCCESSES = int(os.environ.get("BREAKER_HALF_OPEN_SUCCESSES", "2"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE       = Gauge("llm_circuit_state",
+                            "LLM backend circuit breaker state (0 closed, 1 half-open, 2 open)",
+                            ["backend"])
+BREAKER_TRANSITIONS = Counter("llm_circuit_transitions_total",
+                              "LLM backend circuit breaker state changes", ["backend", "state"])
+BREAKER_REJECTED    = Counter("llm_circuit_rejected_total",
+                              "Calls skipped because the backend's breaker was open", ["backend"])
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose breaker is open."""
+
+
+def counts_as_failure(exc: BaseException) -> bool:
+    """Whether exc reflects on the backend (as opposed to the request)."""
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status >= 500 or exc.status in (408, 429)
+    return True
+
+
+class CircuitBreaker:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self._outcomes: deque = deque(maxlen=BREAKER_WINDOW)   # (time, failed, slow)
+        self._opened_at = 0.0
+        self._cooldown = BREAKER_OPEN_SECONDS
+        self._probes = 0
+        self._probe_successes = 0
+        BREAKER_STATE.labels(backend=name).set(0)
+
+    # --- state -------------------------------------------------------------
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        BREAKER_STATE.labels(backend=self.name).set(_STATE_VALUE[state])
+        BREAKER_TRANSITIONS.labels(backend=self.name, state=state).inc()
+
+    def _open(self) -> None:
+        if self.state == HALF_OPEN:
+            self._cooldown = min(self._cooldown * 2, BREAKER_MAX_OPEN_SECONDS)
+        self._opened_at = time.monotonic()
+        self._probes = self._probe_successes = 0
+        self._set_state(OPEN)
+
+    def _close(self) -> None:
+        self._outcomes.clear()
+        self._cooldown = BREAKER_OPEN_SECONDS
+        self._probes = self._probe_successes = 0
+        self._set_state(CLOSED)
+
+    def _cooled_down(self) -> bool:
+        return time.monotonic() - self._opened_at >= self._cooldown
+
+    # --- calls -------------------------------------------------------------
+
+    def available(self) -> bool:
+        """Whether a call would be let through right now (does not reserve it)."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return self._cooled_down()
+        return self._probes < BREAKER_HALF_OPEN_PROBES
+
+    def acquire(self) -> None:
+        """Reserve a call; raises CircuitOpenError if the breaker rejects it.
+
+        Every successful acquire() must be followed by record_success(),
+        record_failure() or release().
+        """
+        if self.state == OPEN and self._cooled_down():
+            self._set_state(HALF_OPEN)
+        if self.state == OPEN or (self.state == HALF_OPEN
+                                  and self._probes >= BREAKER_HALF_OPEN_PROBES):
+            BREAKER_REJECTED.labels(backend=self.name).inc()
+            raise CircuitOpenError(f"{self.name} circuit is {self.state}")
+        if self.state == HALF_OPEN:
+            self._probes += 1
+
+    def release(self) -> None:
+        """Give back a reserved call that produced no verdict (e.g. cancelled)."""
+        if self.state == HALF_OPEN and self._probes:
+            self._probes -= 1
+
+    def record_success(self, latency: Optional[float] = None) -> None:
+        slow = latency is not None and latency > BREAKER_SLOW_SECONDS
+        if self.state == HALF_OPEN:
+            self.release()
+            if slow:
+                self._open()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= BREAKER_HALF_OPEN_SUCCESSES:
+                self._close()
+            return
+        self._add(failed=False, slow=slow)
+
+    def record_failure(self) -> None:
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        self._add(failed=True, slow=False)
+
+    def _add(self, failed: bool, slow: bool) -> None:
+        self._outcomes.append((time.monotonic(), failed, slow))
+        if self.state != CLOSED:
+            return
+        recent = self._recent()
+        if len(recent) < BREAKER_MIN_CALLS:
+            return
+        error_rate = sum(f for _, f, _ in recent) / len(recent)
+        slow_rate = sum(s for _, _, s in recent) / len(recent)
+        if error_rate >= BREAKER_ERROR_RATE or slow_rate >= BREAKER_SLOW_RATE:
+            logger.warning(f"Opening {self.name} circuit: error rate {error_rate:.0%}, "
+                           f"slow rate {slow_rate:.0%} over {len(recent)} calls")
+            self._open()
+
+    def _recent(self) -> list:
+        cutoff = time.monotonic() - BREAKER_WINDOW_SECONDS
+        return [o for o in self._outcomes if o[0] >= cutoff]
+
+    def snapshot(self) -> dict:
+        recent = self._recent()
+        info = {
+            "state": self.state,
+            "calls": len(recent),
+            "error_rate": round(sum(f for _, f, _ in recent) / len(recent), 3) if recent else None,
+            "slow_rate": round(sum(s for _, _, s in recent) / len(recent), 3) if recent else None,
+        }
+        if self.state == OPEN:
+            info["retry_in"] = round(max(0.0, self._cooldown - (time.monotonic() - self._opened_at)), 1)
+        if self.state == HALF_OPEN:
+            info["probes_in_flight"] = self._probes
+            info["probe_successes"] = self._probe_successes
+        return info
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get(name: str) -> CircuitBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def snapshot() -> dict:
+    """State and recent error/slow rates of every breaker used so far."""
+    return {name: b.snapshot() for name, b in sorted(_breakers.items())}
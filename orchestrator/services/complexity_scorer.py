@@ -0,0 +1,407 @@
+"""
+Complexity Scorer
+
+Decides how hard a prompt is, for the LLM router's tiers (see the design
+spec, "LLM Routing"):
+
+    LOW   → local Ollama
+    MED   → best available Ollama backend
+    HIGH  → Claude API
+
+  - Features: estimated token count, whole-word complexity keywords,
+    code blocks, line / question / conversation-turn counts and the
+    calling agent's role.  They are a sparse {name: value} dict, so a
+    model only needs weights for the features it knows.
+  - Scorer: logistic regression over those features (COMPLEXITY_SCORER=
+    logistic, the default).  Weights come from COMPLEXITY_MODEL_PATH
+    when that file exists (reloaded when it changes), else from the
+    hand-set DEFAULT_WEIGHTS; the file's mtime is checked at most every
+    COMPLEXITY_MODEL_CHECK seconds.  COMPLEXITY_SCORER=keywords restores the
+    old rule: any keyword substring or more than 3000 characters is HIGH.
+  - Decision log: every routed request appends one JSON line (features,
+    score, tier, backend used, latency) to COMPLEXITY_LOG_PATH.  Under an
+    event loop records are queued and written by a background task in a
+    worker thread, so routing never waits on the vault mount.
+    record_feedback() appends {"id", "needs_claude"} labels for earlier
+    decisions (POST /api/llm/routing/feedback).
+  - Training is offline:
+
+        python -m services.complexity_scorer train [--log PATH] [--out PATH]
+
+    fits the weights on every decision that has a feedback label and
+    writes a model the running router picks up within MODEL_CHECK seconds.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+from enum import Enum
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+_DATA_DIR = Path(os.environ.get("VAULT_MOUNT", "/vault")) / ".agent-routing"
+
+SCORER_KIND    = os.environ.get("COMPLEXITY_SCORER", "logistic")     # logistic | keywords
+MODEL_PATH     = Path(os.environ.get("COMPLEXITY_MODEL_PATH", str(_DATA_DIR / "complexity_model.json")))
+LOG_PATH       = Path(os.environ.get("COMPLEXITY_LOG_PATH", str(_DATA_DIR / "decisions.jsonl")))
+LOG_DECISIONS  = os.environ.get("COMPLEXITY_LOG", "on").lower() not in ("off", "0", "false")
+LOG_MAX_BYTES  = int(os.environ.get("COMPLEXITY_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+MODEL_CHECK    = float(os.environ.get("COMPLEXITY_MODEL_CHECK", "30"))  # seconds between mtime checks
+LOW_MAX        = float(os.environ.get("COMPLEXITY_LOW_MAX", "0.35"))    # score below → LOW
+HIGH_MIN       = float(os.environ.get("COMPLEXITY_HIGH_MIN", "0.65"))   # score from → HIGH
+
+
+class ComplexityTier(str, Enum):
+    LOW  = "low"
+    MED  = "med"
+    HIGH = "high"
+
+
+# ---------------------------------------------------------------------------
+# Features
+# ---------------------------------------------------------------------------
+
+# Whole words (with their usual inflections) that mark reasoning-heavy
+# work.  A substring scan sent "explained", "designer" and "plant" to the
+# paid API.
+KEYWORDS = {
+    "reason":        r"reason(?:s|ing|ed)?",
+    "analyze":       r"analy[sz](?:e|es|ed|ing|is)",
+    "architecture":  r"architect(?:ure|ural|ing)?",
+    "design":        r"design(?:s|ed|ing)?",
+    "refactor":      r"refactor(?:s|ed|ing)?",
+    "security":      r"security|secure",
+    "vulnerability": r"vulnerab(?:le|ility|ilities)",
+    "optimize":      r"optimi[sz](?:e|es|ed|ing|ation)",
+    "explain":       r"explain(?:s|ed|ing)?",
+    "compare":       r"compar(?:e|es|ed|ing|ison)",
+    "evaluate":      r"evaluat(?:e|es|ed|ing|ion)",
+    "critique":      r"critique|critici[sz]e",
+    "plan":          r"plan(?:s|ned|ning)?",
+    "decompose":     r"decompos(?:e|es|ed|ing|ition)",
+}
+_KEYWORD_RES = {name: re.compile(rf"\b(?:{pattern})\b", re.IGNORECASE)
+                for name, pattern in KEYWORDS.items()}
+_TURN_RE = re.compile(r"^(?:User|PM|Assistant):", re.MULTILINE)
+
+
+def features(prompt: str, role: Optional[str] = None) -> dict:
+    """Sparse feature dict for one request."""
+    f = {
+        "log_tokens": math.log1p(len(prompt) / 4),
+        "log_lines": math.log1p(prompt.count("\n")),
+        "questions": min(prompt.count("?"), 5) / 5,
+        "log_turns": math.log1p(len(_TURN_RE.findall(prompt))),
+    }
+    if "```" in prompt:
+        f["code"] = 1.0
+    for name, regex in _KEYWORD_RES.items():
+        if regex.search(prompt):
+            f[f"kw:{name}"] = 1.0
+    if role:
+        f[f"role:{role}"] = 1.0
+    return f
+
+
+# ---------------------------------------------------------------------------
+# Scorers
+# ---------------------------------------------------------------------------
+
+DEFAULT_BIAS = -3.5
+DEFAULT_WEIGHTS = {
+    "log_tokens": 0.45,
+    "code": 0.5,
+    "log_turns": 0.2,
+    **{f"kw:{name}": 1.5 for name in KEYWORDS},
+    "kw:explain": 0.75,
+    "kw:plan": 0.75,
+    # Spec: reviewers lean on Claude, the archivist does bulk vault work locally
+    "role:reviewer": 1.0,
+    "role:archivist": -2.0,
+}
+
+
+class LogisticScorer:
+    """P(needs Claude) = sigmoid(bias + Σ weight·feature)."""
+
+    kind = "logistic"
+
+    def __init__(self, weights: dict, bias: float, meta: Optional[dict] = None):
+        self.weights = dict(weights)
+        self.bias = bias
+        self.meta = meta or {}
+
+    def score(self, feats: dict) -> float:
+        z = self.bias + sum(self.weights.get(k, 0.0) * v for k, v in feats.items())
+        return 1 / (1 + math.exp(-max(-50.0, min(50.0, z))))
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "bias": self.bias, "weights": self.weights, **self.meta}
+
+    @classmethod
+    def load(cls, path: Path) -> "LogisticScorer":
+        data = json.loads(path.read_text())
+        meta = {k: v for k, v in data.items() if k not in ("kind", "bias", "weights")}
+        return cls(data["weights"], float(data["bias"]), meta)
+
+
+class KeywordScorer:
+    """The original rule: any keyword substring or > 3000 chars is HIGH, else LOW."""
+
+    kind = "keywords"
+    _LEGACY = ("reason", "analyze", "architecture", "design", "refactor",
+               "security", "vulnerability", "optimize", "explain",
+               "compare", "evaluate", "critique", "summarize long")
+
+    def score_prompt(self, prompt: str) -> float:
+        lower = prompt.lower()
+        return 1.0 if any(kw in lower for kw in self._LEGACY) or len(prompt) > 3000 else 0.0
+
+
+_default = LogisticScorer(DEFAULT_WEIGHTS, DEFAULT_BIAS, {"source": "default"})
+_loaded: Optional[LogisticScorer] = None
+_loaded_mtime: Optional[float] = None
+_checked_at = float("-inf")
+
+
+def _model() -> LogisticScorer:
+    """
+    The trained model if MODEL_PATH exists, else the defaults.  The file
+    is stat()ed at most every MODEL_CHECK seconds and reloaded on change.
+    """
+    global _loaded, _loaded_mtime, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < MODEL_CHECK:
+        return _loaded or _default
+    _checked_at = now
+    try:
+        mtime = MODEL_PATH.stat().st_mtime
+    except OSError:
+        _loaded, _loaded_mtime = None, None
+        return _default
+    if mtime != _loaded_mtime:
+        _loaded_mtime = mtime
+        try:
+            _loaded = LogisticScorer.load(MODEL_PATH)
+            logger.info(f"Loaded complexity model from {MODEL_PATH} "
+                        f"({_loaded.meta.get('samples', '?')} samples)")
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable complexity model {MODEL_PATH}: {e}")
+            _loaded = None
+    return _loaded or _default
+
+
+def tier_for(score: float) -> ComplexityTier:
+    if score < LOW_MAX:
+        return ComplexityTier.LOW
+    if score < HIGH_MIN:
+        return ComplexityTier.MED
+    return ComplexityTier.HIGH
+
+
+# ---------------------------------------------------------------------------
+# Decisions
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Decision:
+    id: str
+    tier: ComplexityTier
+    score: float
+    features: dict = field(default_factory=dict)
+    scorer: str = "logistic"
+
+
+def classify(prompt: str, role: Optional[str] = None) -> Decision:
+    """Score a request and map it to a tier."""
+    feats = features(prompt, role)
+    if SCORER_KIND == "keywords":
+        score = KeywordScorer().score_prompt(prompt)
+        scorer = KeywordScorer.kind
+    else:
+        score = _model().score(feats)
+        scorer = LogisticScorer.kind
+    return Decision(id=uuid.uuid4().hex, tier=tier_for(score), score=score,
+                    features=feats, scorer=scorer)
+
+
+_pending: list[dict] = []          # records waiting for the writer task
+_MAX_PENDING = 10000               # dropped beyond this if the mount stalls
+_flush_task: Optional[asyncio.Task] = None
+
+
+def _write(records: list[dict]) -> None:
+    try:
+        LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+        if LOG_PATH.exists() and LOG_PATH.stat().st_size > LOG_MAX_BYTES:
+            LOG_PATH.replace(LOG_PATH.with_suffix(LOG_PATH.suffix + ".1"))
+        with LOG_PATH.open("a") as fh:
+            fh.write("".join(json.dumps(r) + "\n" for r in records))
+    except OSError as e:
+        logger.debug(f"Complexity decision log write failed: {e}")
+
+
+async def _flush() -> None:
+    global _flush_task
+    try:
+        while _pending:
+            batch = _pending[:]
+            _pending.clear()
+            await asyncio.to_thread(_write, batch)
+    finally:
+        _flush_task = None
+
+
+def _append(record: dict) -> None:
+    """Queue a log record for the writer task (written inline outside a loop)."""
+    global _flush_task
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _write([record])
+        return
+    if len(_pending) >= _MAX_PENDING:
+        logger.debug("Complexity decision log backlog full, dropping a record")
+        return
+    _pending.append(record)
+    if _flush_task is None:
+        _flush_task = loop.create_task(_flush())
+
+
+def log_decision(decision: Decision, backend: Optional[str], latency: float) -> None:
+    """Append a routed request (backend None = every backend failed)."""
+    if not LOG_DECISIONS:
+        return
+    _append({
+        "id": decision.id,
+        "ts": time.time(),
+        "tier": decision.tier.value,
+        "score": round(decision.score, 4),
+        "scorer": decision.scorer,
+        "features": {k: round(v, 4) for k, v in decision.features.items()},
+        "backend": backend,
+        "ok": backend is not None,
+        "latency": round(latency, 3),
+    })
+
+
+def record_feedback(decision_id: str, needs_claude: bool) -> None:
+    """Label an earlier decision for training (True = local answer was not good enough)."""
+    _append({"id": decision_id, "ts": time.time(), "needs_claude": bool(needs_claude)})
+
+
+def status() -> dict:
+    model = _model()
+    return {
+        "scorer": SCORER_KIND,
+        "model": str(MODEL_PATH) if model is not _default else "default",
+        "trained_at": model.meta.get("trained_at"),
+        "samples": model.meta.get("samples"),
+        "thresholds": {"low_max": LOW_MAX, "high_min": HIGH_MIN},
+        "log": str(LOG_PATH) if LOG_DECISIONS else None,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Offline training
+# ---------------------------------------------------------------------------
+
+def load_examples(paths: list) -> list[tuple[dict, int]]:
+    """(features, label) for every logged decision with a feedback label."""
+    decisions: dict[str, dict] = {}
+    labels: dict[str, bool] = {}
+    for path in paths:
+        with open(path) as fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "needs_claude" in record:
+                    labels[record["id"]] = record["needs_claude"]
+                elif "features" in record:
+                    decisions[record["id"]] = record["features"]
+    return [(decisions[i], int(label)) for i, label in labels.items() if i in decisions]
+
+
+def train(examples: list[tuple[dict, int]], epochs: int = 2000, lr: float = 0.1,
+          l2: float = 0.01) -> LogisticScorer:
+    """Fit logistic regression by full-batch gradient descent (L2-regularised)."""
+    import numpy as np
+
+    names = sorted({k for feats, _ in examples for k in feats})
+    x = np.array([[feats.get(k, 0.0) for k in names] for feats, _ in examples])
+    y = np.array([label for _, label in examples], dtype=float)
+    w = np.zeros(len(names))
+    b = 0.0
+    for _ in range(epochs):
+        p = 1 / (1 + np.exp(-np.clip(x @ w + b, -50, 50)))
+        err = p - y
+        w -= lr * (x.T @ err / len(y) + l2 * w)
+        b -= lr * err.mean()
+    weights = {k: round(float(v), 6) for k, v in zip(names, w) if abs(v) > 1e-6}
+    return LogisticScorer(weights, round(float(b), 6), {
+        "trained_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "samples": len(examples),
+        "positives": int(y.sum()),
+    })
+
+
+def _evaluate(model: LogisticScorer, examples: list[tuple[dict, int]]) -> dict:
+    tiers = {t.value: [0, 0] for t in ComplexityTier}    # tier -> [requests, needed Claude]
+    correct = 0
+    for feats, label in examples:
+        score = model.score(feats)
+        correct += int((score >= 0.5) == bool(label))
+        counts = tiers[tier_for(score).value]
+        counts[0] += 1
+        counts[1] += label
+    return {"accuracy": round(correct / len(examples), 3) if examples else None,
+            "tiers": {t: {"requests": n, "needed_claude": k} for t, (n, k) in tiers.items()}}
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m services.complexity_scorer",
+                                     description="Train the routing complexity model offline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_train = sub.add_parser("train", help="fit weights on labelled decisions")
+    p_train.add_argument("--log", nargs="+", default=[str(LOG_PATH)])
+    p_train.add_argument("--out", default=str(MODEL_PATH))
+    p_train.add_argument("--min-samples", type=int, default=50)
+    p_eval = sub.add_parser("eval", help="score the current model on labelled decisions")
+    p_eval.add_argument("--log", nargs="+", default=[str(LOG_PATH)])
+    args = parser.parse_args(argv)
+
+    examples = load_examples(args.log)
+    if args.command == "eval":
+        print(json.dumps(_evaluate(_model(), examples), indent=2))
+        return 0
+    if len(examples) < args.min_samples:
+        print(f"Only {len(examples)} labelled decisions (need {args.min_samples})", file=sys.stderr)
+        return 1
+    model = train(examples)
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_suffix(".tmp")
+    tmp.write_text(json.dumps(model.to_dict(), indent=2))
+    tmp.replace(out)
+    print(json.dumps({"out": str(out), "default": _evaluate(_default, examples),
+                      "trained": _evaluate(model, examples)}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
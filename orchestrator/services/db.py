@@ -0,0 +1,32 @@
+"""
+Database Access
+
+Connection helpers shared by app.py and the background services
+(task dispatcher, worker reaper) that talk to PostgreSQL directly.
+psycopg2 is blocking, so async callers run these in a thread.
+"""
+
+import os
+from contextlib import contextmanager
+
+import psycopg2
+
+
+def get_db_connection():
+    return psycopg2.connect(
+        host=os.environ.get('DB_HOST', 'database'),
+        database=os.environ.get('DB_NAME', 'postgres'),
+        user=os.environ.get('DB_USER', 'postgres'),
+        password=os.environ.get('DB_PASSWORD', 'postgres'),
+    )
+
+
+@contextmanager
+def transaction():
+    """Yield a cursor inside one transaction; commit on success, roll back on error."""
+    conn = get_db_connection()
+    try:
+        with conn, conn.cursor() as cur:
+            yield cur
+    finally:
+        conn.close()
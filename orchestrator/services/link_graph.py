@@ -0,0 +1,281 @@
+"""
+Vault Link Graph
+
+In-memory index of the Obsidian vault's structure:
+  - outgoing [[wikilinks]] per note
+  - backlinks ("what links here")
+  - #tags (inline and from the `tags:` front-matter key)
+  - front-matter key -> notes
+
+The index is built once from a full vault scan and then kept current
+incrementally: obsidian_service notifies us of every write/delete it
+performs (see add_change_listener), so a single changed note is
+re-parsed instead of re-scanning the vault.
+"""
+
+import re
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+from . import obsidian_service
+
+logger = logging.getLogger(__name__)
+
+# [[target]], [[target|alias]], [[target#heading]], ![[embed]]
+_WIKILINK_RE = re.compile(r"\[\[([^\[\]\n]+?)\]\]")
+# #tag / #nested/tag — must start a word so headings ("# Title"), URL
+# fragments and hex colours inside words are not picked up.
+_TAG_RE = re.compile(r"(?:(?<=\s)|^)#([A-Za-z_][\w/-]*)", re.MULTILINE)
+_FENCED_CODE_RE = re.compile(r"```.*?```", re.DOTALL)
+_INLINE_CODE_RE = re.compile(r"`[^`\n]*`")
+
+
+# ---------------------------------------------------------------------------
+# Index state
+# ---------------------------------------------------------------------------
+
+_outgoing: dict[str, set[str]] = {}     # note path -> link keys it points at
+_incoming: dict[str, set[str]] = {}     # link key  -> note paths linking to it
+_note_tags: dict[str, set[str]] = {}    # note path -> tags
+_tags: dict[str, set[str]] = {}         # tag       -> note paths
+_note_keys: dict[str, set[str]] = {}    # note path -> front-matter keys
+_meta_keys: dict[str, set[str]] = {}    # key       -> note paths
+_names: dict[str, set[str]] = {}        # lower-case stem -> note paths
+_lower_paths: dict[str, str] = {}       # lower-case path (no .md) -> note path
+
+_built = False
+_building = False
+_pending: list = []
+_build_lock = asyncio.Lock()
+
+
+# ---------------------------------------------------------------------------
+# Parsing helpers
+# ---------------------------------------------------------------------------
+
+def _link_key(target: str) -> str:
+    """Normalise a wikilink target to the key used for lookups."""
+    target = target.split("|", 1)[0].split("#", 1)[0].split("^", 1)[0]
+    target = target.strip().replace("\\", "/").lstrip("/")
+    if target.lower().endswith(".md"):
+        target = target[:-3]
+    return target.lower()
+
+
+def _keys_for_note(path: str) -> set[str]:
+    """All link keys that can refer to the note at path."""
+    stem_path = path[:-3] if path.lower().endswith(".md") else path
+    return {stem_path.lower(), stem_path.rsplit("/", 1)[-1].lower()}
+
+
+def _parse_tags(meta: dict, body: str) -> set[str]:
+    tags = {t.lower().rstrip("/") for t in _TAG_RE.findall(body)}
+    raw = meta.get("tags") or meta.get("tag") or ""
+    for t in re.split(r"[,\s]+", raw.strip("[]")):
+        t = t.strip().strip("'\"").lstrip("#")
+        if t:
+            tags.add(t.lower())
+    return tags
+
+
+def _parse_note(meta: dict, body: str) -> tuple[set[str], set[str], set[str]]:
+    """Return (link keys, tags, front-matter keys) for one note."""
+    text = _INLINE_CODE_RE.sub("", _FENCED_CODE_RE.sub("", body))
+    links = {_link_key(m) for m in _WIKILINK_RE.findall(text)}
+    links.discard("")
+    return links, _parse_tags(meta, text), set(meta.keys())
+
+
+# ---------------------------------------------------------------------------
+# Incremental maintenance
+# ---------------------------------------------------------------------------
+
+def _add_to(index: dict[str, set[str]], key: str, path: str) -> None:
+    index.setdefault(key, set()).add(path)
+
+
+def _remove_from(index: dict[str, set[str]], key: str, path: str) -> None:
+    members = index.get(key)
+    if members is not None:
+        members.discard(path)
+        if not members:
+            del index[key]
+
+
+def _remove_note(path: str) -> None:
+    for key in _outgoing.pop(path, ()):
+        _remove_from(_incoming, key, path)
+    for tag in _note_tags.pop(path, ()):
+        _remove_from(_tags, tag, path)
+    for key in _note_keys.pop(path, ()):
+        _remove_from(_meta_keys, key, path)
+    stem_path = path[:-3] if path.lower().endswith(".md") else path
+    _remove_from(_names, stem_path.rsplit("/", 1)[-1].lower(), path)
+    _lower_paths.pop(stem_path.lower(), None)
+
+
+def _index_note(path: str, meta: dict, body: str) -> None:
+    _remove_note(path)
+    links, tags, keys = _parse_note(meta, body)
+    _outgoing[path] = links
+    for key in links:
+        _add_to(_incoming, key, path)
+    _note_tags[path] = tags
+    for tag in tags:
+        _add_to(_tags, tag, path)
+    _note_keys[path] = keys
+    for key in keys:
+        _add_to(_meta_keys, key, path)
+    stem_path = path[:-3] if path.lower().endswith(".md") else path
+    _add_to(_names, stem_path.rsplit("/", 1)[-1].lower(), path)
+    _lower_paths[stem_path.lower()] = path
+
+
+def _apply(changes: list[tuple[str, Optional[dict]]]) -> None:
+    for path, note in changes:
+        if note is None:
+            _remove_note(path)
+        else:
+            _index_note(path, note.get("meta", {}), note.get("body", ""))
+
+
+def on_vault_changes(changes: list[tuple[str, Optional[dict]]]) -> None:
+    """obsidian_service change listener — keeps the index current."""
+    if _building:
+        _pending.extend(changes)
+    elif _built:
+        _apply(changes)
+    # Not built yet: the first build will read the new state from disk.
+
+
+async def ensure_built() -> None:
+    """Build the index from a full vault scan if it hasn't been built yet."""
+    global _built, _building
+    if _built:
+        return
+    async with _build_lock:
+        if _built:
+            return
+        _building = True
+        try:
+            count = 0
+            for note_meta in await obsidian_service.list_notes():
+                try:
+                    note = await obsidian_service.read_note(note_meta["path"])
+                except Exception as e:
+                    logger.warning(f"Link graph skipped {note_meta['path']}: {e}")
+                    continue
+                if note:
+                    _index_note(note_meta["path"], note["meta"], note["body"])
+                    count += 1
+            # Writes that landed while we were scanning
+            _apply(_pending)
+            _pending.clear()
+            _built = True
+            logger.info(f"Link graph built: {count} notes, {len(_tags)} tags")
+        finally:
+            _building = False
+
+
+# ---------------------------------------------------------------------------
+# Queries
+# ---------------------------------------------------------------------------
+
+def _normalise_path(path: str) -> str:
+    path = path.replace("\\", "/").lstrip("/")
+    return path if path.endswith(".md") else path + ".md"
+
+
+def resolve_link(key: str) -> list[str]:
+    """Resolve a link key to the note path(s) it refers to."""
+    key = _link_key(key)
+    if "/" in key:
+        hit = _lower_paths.get(key)
+        return [hit] if hit else []
+    return sorted(_names.get(key, ()))
+
+
+def outgoing_links(path: str) -> list[dict]:
+    """Links from a note: [{target, resolved: [paths]}]."""
+    path = _normalise_path(path)
+    return [
+        {"target": key, "resolved": resolve_link(key)}
+        for key in sorted(_outgoing.get(path, ()))
+    ]
+
+
+def backlinks(path: str) -> list[str]:
+    """Notes linking to path ("what links here")."""
+    path = _normalise_path(path)
+    sources: set[str] = set()
+    for key in _keys_for_note(path):
+        sources |= _incoming.get(key, set())
+    sources.discard(path)
+    return sorted(sources)
+
+
+def neighbourhood(path: str, depth: int = 1, limit: int = 100) -> dict:
+    """
+    Breadth-first walk over links in both directions starting at path.
+    Returns {"nodes": [{path, distance}], "edges": [{source, target}]}.
+    """
+    start = _normalise_path(path)
+    distances = {start: 0}
+    edges: set[tuple[str, str]] = set()
+    queue = deque([start])
+    while queue and len(distances) < limit:
+        current = queue.popleft()
+        if distances[current] >= depth:
+            continue
+        neighbours: list[tuple[str, str]] = []
+        for key in _outgoing.get(current, ()):
+            for target in resolve_link(key):
+                neighbours.append((current, target))
+        for source in backlinks(current):
+            neighbours.append((source, current))
+        for src, dst in neighbours:
+            other = dst if src == current else src
+            if other not in distances:
+                if len(distances) >= limit:
+                    break
+                distances[other] = distances[current] + 1
+                queue.append(other)
+            edges.add((src, dst))
+    edges = {(s, d) for s, d in edges if s in distances and d in distances}
+    return {
+        "nodes": [{"path": p, "distance": d}
+                  for p, d in sorted(distances.items(), key=lambda kv: (kv[1], kv[0]))],
+        "edges": [{"source": s, "target": d} for s, d in sorted(edges)],
+    }
+
+
+def list_tags() -> dict[str, int]:
+    """Return {tag: note_count}."""
+    return {tag: len(paths) for tag, paths in sorted(_tags.items())}
+
+
+def notes_with_tag(tag: str) -> list[str]:
+    """Notes carrying tag or any nested tag beneath it (tag/child)."""
+    tag = tag.lower().lstrip("#").rstrip("/")
+    found: set[str] = set()
+    for t, paths in _tags.items():
+        if t == tag or t.startswith(tag + "/"):
+            found |= paths
+    return sorted(found)
+
+
+def notes_with_key(key: str) -> list[str]:
+    """Notes whose front-matter defines key."""
+    return sorted(_meta_keys.get(key, ()))
+
+
+def stats() -> dict:
+    return {
+        "built": _built,
+        "notes": len(_outgoing),
+        "links": sum(len(v) for v in _outgoing.values()),
+        "tags": len(_tags),
+        "meta_keys": len(_meta_keys),
+    }
@@ -0,0 +1,430 @@
+"""
+LLM Batch Jobs
+
+Offline bulk generation (nightly archival, summarising every task of a
+project, ...) that does not go through the interactive route() path.
+
+  - claude: requests are submitted through the Anthropic Message Batches
+    API (up to BATCH_MAX_REQUESTS per provider batch; larger jobs are
+    split) and polled every BATCH_POLL_INTERVAL seconds until they end,
+    then the JSONL results are downloaded.  Batches are billed at a
+    discount and never compete with chat for rate limits.
+  - ollama: a local runner with at most BATCH_OLLAMA_CONCURRENCY
+    requests in flight across all batch jobs, sent to BATCH_OLLAMA_URL
+    (the remote GPU if one is configured), so interactive requests keep
+    the remaining slots.
+  - Results are kept in memory per job and written to
+    BATCH_DIR/<job>.results.jsonl; the job itself (including provider
+    batch ids and how many requests were submitted) to
+    BATCH_DIR/<job>.json.  stop() at shutdown leaves jobs unfinished on
+    disk, and resume() picks them up after the restart: Claude jobs
+    submit whatever was not yet submitted and poll the batches not yet
+    collected, Ollama jobs run the requests that have no result yet.  Only cancel() marks a job canceled.
+  - on_complete names a callback registered with register_callback();
+    callback(job, **on_complete_args) (plain or async) runs when a job
+    ends.  It is stored by name so a resumed job still runs it.
+
+Each request is {"id", "prompt", "system"?}; system may be a list of
+layers, sent as a cached prefix exactly as route() does.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import inspect
+import logging
+from pathlib import Path
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Optional
+
+import aiohttp
+
+from . import llm_router
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+BATCH_DIR                = Path(os.environ.get(
+    "BATCH_DIR", str(Path(os.environ.get("VAULT_MOUNT", "/vault")) / ".agent-batches")))
+BATCH_POLL_INTERVAL      = float(os.environ.get("BATCH_POLL_INTERVAL", "30"))
+BATCH_MAX_REQUESTS       = int(os.environ.get("BATCH_MAX_REQUESTS", "10000"))
+BATCH_OLLAMA_CONCURRENCY = int(os.environ.get("BATCH_OLLAMA_CONCURRENCY", "2"))
+BATCH_OLLAMA_URL         = (os.environ.get("BATCH_OLLAMA_URL")
+                            or llm_router.OLLAMA_REMOTE_URL or llm_router.OLLAMA_LOCAL_URL)
+BATCH_KEEP_JOBS          = int(os.environ.get("BATCH_KEEP_JOBS", "50"))
+
+BACKENDS = ("claude", "ollama")
+FINISHED = ("ended", "canceled", "failed")
+
+
+@dataclass
+class BatchJob:
+    id: str
+    backend: str
+    model: str
+    requests: list = field(default_factory=list)       # [{"id", "prompt", "system"}]
+    max_tokens: int = 4096
+    status: str = "submitted"     # submitted | in_progress | ended | canceled | failed
+    created_at: float = field(default_factory=time.time)
+    ended_at: Optional[float] = None
+    provider_batches: list = field(default_factory=list)
+    submitted: int = 0            # requests already sent to the provider (claude)
+    on_complete: Optional[str] = None
+    on_complete_args: dict = field(default_factory=dict)
+    results: dict = field(default_factory=dict)        # id -> {"text"|"error", "usage"?}
+    error: Optional[str] = None
+
+    def summary(self) -> dict:
+        counts = {"total": len(self.requests), "succeeded": 0, "errored": 0}
+        for result in self.results.values():
+            counts["succeeded" if "text" in result else "errored"] += 1
+        counts["pending"] = counts["total"] - counts["succeeded"] - counts["errored"]
+        return {
+            "id": self.id,
+            "backend": self.backend,
+            "model": self.model,
+            "status": self.status,
+            "created_at": self.created_at,
+            "ended_at": self.ended_at,
+            "provider_batches": self.provider_batches,
+            "counts": counts,
+            "error": self.error,
+        }
+
+
+_jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+_runners: dict[str, asyncio.Task] = {}
+_callbacks: dict[str, Callable] = {}      # name -> callback(job, **args)
+_cancel_requested: set[str] = set()
+_ollama_slots: Optional[asyncio.Semaphore] = None
+
+
+# ---------------------------------------------------------------------------
+# Persistence
+# ---------------------------------------------------------------------------
+
+def _job_path(job_id: str) -> Path:
+    return BATCH_DIR / f"{job_id}.json"
+
+
+def _results_path(job_id: str) -> Path:
+    return BATCH_DIR / f"{job_id}.results.jsonl"
+
+
+def _save(job: BatchJob) -> None:
+    try:
+        BATCH_DIR.mkdir(parents=True, exist_ok=True)
+        state = asdict(job)
+        state.pop("results")
+        tmp = _job_path(job.id).with_suffix(".tmp")
+        tmp.write_text(json.dumps(state))
+        tmp.replace(_job_path(job.id))
+        if job.results:
+            with _results_path(job.id).open("w") as fh:
+                for custom_id, result in job.results.items():
+                    fh.write(json.dumps({"id": custom_id, **result}) + "\n")
+    except OSError as e:
+        logger.warning(f"Could not persist batch job {job.id}: {e}")
+
+
+def _remember(job: BatchJob) -> None:
+    _jobs[job.id] = job
+    while len(_jobs) > BATCH_KEEP_JOBS:
+        oldest = next((j for j in _jobs.values() if j.status in FINISHED), None)
+        if oldest is None:
+            break
+        del _jobs[oldest.id]
+
+
+# ---------------------------------------------------------------------------
+# Claude: Message Batches API
+# ---------------------------------------------------------------------------
+
+async def _iter_lines(resp: aiohttp.ClientResponse):
+    """JSONL lines of a response, without aiohttp's per-line size limit."""
+    buffer = b""
+    async for chunk in resp.content.iter_chunked(64 * 1024):
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+async def _claude_submit(session: aiohttp.ClientSession, job: BatchJob) -> None:
+    """Submit the requests not yet submitted (all of them, or the rest after a restart)."""
+    for start in range(job.submitted, len(job.requests), BATCH_MAX_REQUESTS):
+        chunk = job.requests[start:start + BATCH_MAX_REQUESTS]
+        body = {"requests": [
+            {"custom_id": r["id"],
+             "params": llm_router.claude_params(r["prompt"], r.get("system", ""),
+                                                job.model, job.max_tokens)}
+            for r in chunk
+        ]}
+        async with session.post(f"{llm_router.ANTHROPIC_BASE_URL}/v1/messages/batches",
+                                headers=llm_router.claude_headers(), json=body,
+                                timeout=aiohttp.ClientTimeout(total=300)) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        job.provider_batches.append({"id": data["id"], "status": data.get("processing_status")})
+        job.submitted = start + len(chunk)
+        _save(job)
+        logger.info(f"Batch job {job.id}: submitted {len(chunk)} request(s) as {data['id']}")
+
+
+async def _claude_collect(session: aiohttp.ClientSession, job: BatchJob, batch: dict) -> None:
+    base = f"{llm_router.ANTHROPIC_BASE_URL}/v1/messages/batches/{batch['id']}"
+    while True:
+        async with session.get(base, headers=llm_router.claude_headers(),
+                               timeout=aiohttp.ClientTimeout(total=60)) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        batch["status"] = data.get("processing_status")
+        batch["request_counts"] = data.get("request_counts")
+        if batch["status"] == "ended":
+            break
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+
+    results_url = data.get("results_url") or f"{base}/results"
+    async with session.get(results_url, headers=llm_router.claude_headers(),
+                           timeout=aiohttp.ClientTimeout(total=None, sock_read=300)) as resp:
+        resp.raise_for_status()
+        async for line in _iter_lines(resp):
+            item = json.loads(line)
+            result = item.get("result", {})
+            if result.get("type") == "succeeded":
+                message = result["message"]
+                text = "".join(b.get("text", "") for b in message.get("content", [])
+                               if b.get("type") == "text")
+                job.results[item["custom_id"]] = {"text": text, "usage": message.get("usage", {})}
+            else:
+                # errored: {"error": {"type": "error", "error": {"type", "message"}}};
+                # canceled / expired carry no error body
+                error = (result.get("error") or {}).get("error") or {}
+                job.results[item["custom_id"]] = {
+                    "error": error.get("message") or result.get("type", "unknown"),
+                    "type": result.get("type"),
+                }
+
+
+async def _run_claude(job: BatchJob) -> None:
+    async with aiohttp.ClientSession() as session:
+        if job.submitted < len(job.requests):
+            await _claude_submit(session, job)
+        job.status = "in_progress"
+        _save(job)
+        for batch in job.provider_batches:
+            if batch.get("collected"):
+                continue
+            await _claude_collect(session, job, batch)
+            batch["collected"] = True
+
+
+async def _claude_cancel(job: BatchJob) -> None:
+    async with aiohttp.ClientSession() as session:
+        for batch in job.provider_batches:
+            if batch.get("status") == "ended":
+                continue
+            try:
+                async with session.post(
+                        f"{llm_router.ANTHROPIC_BASE_URL}/v1/messages/batches/{batch['id']}/cancel",
+                        headers=llm_router.claude_headers(),
+                        timeout=aiohttp.ClientTimeout(total=30)) as resp:
+                    resp.raise_for_status()
+            except Exception as e:
+                logger.warning(f"Cancelling provider batch {batch['id']} failed: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Ollama: bounded local runner
+# ---------------------------------------------------------------------------
+
+def _slots() -> asyncio.Semaphore:
+    # Created lazily: the semaphore must belong to the serving event loop
+    global _ollama_slots
+    if _ollama_slots is None:
+        _ollama_slots = asyncio.Semaphore(BATCH_OLLAMA_CONCURRENCY)
+    return _ollama_slots
+
+
+async def _run_ollama(job: BatchJob) -> None:
+    job.status = "in_progress"
+    slots = _slots()
+
+    async def one(request: dict) -> None:
+        async with slots:
+            try:
+                text = await llm_router.ollama_generate(
+                    BATCH_OLLAMA_URL, job.model, request["prompt"], request.get("system", ""),
+                    max_tokens=job.max_tokens)
+                job.results[request["id"]] = {"text": text}
+            except Exception as e:
+                job.results[request["id"]] = {"error": str(e)}
+
+    await asyncio.gather(*(one(r) for r in job.requests if r["id"] not in job.results))
+
+
+# ---------------------------------------------------------------------------
+# Jobs
+# ---------------------------------------------------------------------------
+
+async def _run(job: BatchJob) -> None:
+    try:
+        if job.backend == "claude":
+            await _run_claude(job)
+        else:
+            await _run_ollama(job)
+        job.status = "ended"
+    except asyncio.CancelledError:
+        if job.id in _cancel_requested:
+            job.status = "canceled"
+        # else stopped at shutdown: left unfinished for resume()
+        raise
+    except Exception as e:
+        job.status, job.error = "failed", str(e)
+        logger.error(f"Batch job {job.id} failed: {e}")
+    finally:
+        _runners.pop(job.id, None)
+        _cancel_requested.discard(job.id)
+        if job.status in FINISHED:
+            job.ended_at = time.time()
+        _save(job)
+        if job.status in ("ended", "failed") and job.on_complete:
+            await _complete(job)
+    if job.status in FINISHED:
+        logger.info(f"Batch job {job.id} {job.status}: {job.summary()['counts']}")
+
+
+async def _complete(job: BatchJob) -> None:
+    callback = _callbacks.get(job.on_complete)
+    if callback is None:
+        logger.error(f"Batch job {job.id}: no callback registered as {job.on_complete!r}")
+        return
+    try:
+        outcome = callback(job, **job.on_complete_args)
+        if inspect.isawaitable(outcome):
+            await outcome
+    except Exception as e:
+        logger.error(f"Batch job {job.id} callback failed: {e}")
+
+
+def _start(job: BatchJob) -> None:
+    _remember(job)
+    _runners[job.id] = asyncio.ensure_future(_run(job))
+
+
+def register_callback(name: str, callback: Callable) -> None:
+    """Make callback(job, **args) available as a job's on_complete (register at import)."""
+    _callbacks[name] = callback
+
+
+def submit(requests: list[dict], backend: str = "auto", model: Optional[str] = None,
+           max_tokens: int = 4096, on_complete: Optional[str] = None,
+           on_complete_args: Optional[dict] = None) -> BatchJob:
+    """
+    Start a batch job and return it immediately (status "submitted").
+
+    requests: [{"id"?, "prompt", "system"?}]; ids default to the list
+    index and must be unique.  backend "auto" is claude when an API key
+    is configured, else ollama.  on_complete is a register_callback()
+    name; on_complete_args (JSON-serialisable) are passed to it.
+    """
+    if on_complete is not None and on_complete not in _callbacks:
+        raise ValueError(f"Unknown batch callback: {on_complete}")
+    if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens <= 0:
+        raise ValueError("max_tokens must be a positive integer")
+    if backend == "auto":
+        backend = "claude" if llm_router.ANTHROPIC_API_KEY else "ollama"
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown batch backend: {backend}")
+    if backend == "claude" and not llm_router.ANTHROPIC_API_KEY:
+        raise ValueError("ANTHROPIC_API_KEY is not set")
+    items = []
+    for i, r in enumerate(requests):
+        if not r.get("prompt"):
+            raise ValueError(f"Request {i} has no prompt")
+        items.append({"id": str(r.get("id", i)), "prompt": r["prompt"], "system": r.get("system", "")})
+    if len({r["id"] for r in items}) != len(items):
+        raise ValueError("Request ids must be unique")
+    job = BatchJob(
+        id=uuid.uuid4().hex[:12],
+        backend=backend,
+        model=model or (llm_router.CLAUDE_MODEL if backend == "claude" else llm_router.LOCAL_MODEL),
+        requests=items,
+        max_tokens=max_tokens,
+        on_complete=on_complete,
+        on_complete_args=on_complete_args or {},
+    )
+    _save(job)
+    _start(job)
+    return job
+
+
+def get(job_id: str) -> Optional[BatchJob]:
+    return _jobs.get(job_id)
+
+
+def results(job_id: str) -> Optional[dict]:
+    """Results of a job by request id, from memory or its results file."""
+    job = _jobs.get(job_id)
+    if job is not None:
+        return dict(job.results)
+    path = _results_path(job_id)
+    if not path.exists():
+        return None
+    out = {}
+    with path.open() as fh:
+        for line in fh:
+            item = json.loads(line)
+            out[item.pop("id")] = item
+    return out
+
+
+async def cancel(job_id: str) -> bool:
+    job = _jobs.get(job_id)
+    if job is None or job.status in FINISHED:
+        return False
+    if job.backend == "claude":
+        await _claude_cancel(job)
+    runner = _runners.get(job_id)
+    if runner is not None:
+        _cancel_requested.add(job_id)
+        runner.cancel()
+    else:
+        job.status, job.ended_at = "canceled", time.time()
+        _save(job)
+    return True
+
+
+def jobs() -> list[dict]:
+    return [job.summary() for job in reversed(_jobs.values())]
+
+
+def resume() -> None:
+    """Restart the jobs a previous run left unfinished (see the module docstring)."""
+    if not BATCH_DIR.exists():
+        return
+    for path in sorted(BATCH_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime):
+        try:
+            job = BatchJob(**json.loads(path.read_text()))
+            job.results = results(job.id) or {}
+        except Exception as e:
+            logger.warning(f"Skipping unreadable batch job {path.name}: {e}")
+            continue
+        if job.status in FINISHED or job.id in _jobs:
+            continue
+        logger.info(f"Resuming batch job {job.id} ({job.backend})")
+        _start(job)
+
+
+def stop() -> None:
+    """Stop runners and pollers at shutdown; the jobs stay unfinished for resume()."""
+    for runner in list(_runners.values()):
+        runner.cancel()
@@ -11,12 +11,21 @@ understanding, or when local inference is unavailable.
 """
 
 import os
+import json
+import time
+import hashlib
 import logging
 import asyncio
+import dataclasses
 import aiohttp
 from enum import Enum
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Union
+
+from prometheus_client import Counter
+
+from . import (backend_stats, circuit_breaker, complexity_scorer, model_catalog, model_residency,
+               prompt_builder, routing_policy)
 
 logger = logging.getLogger(__name__)
 
@@ -26,11 +35,40 @@ logger = logging.getLogger(__name__)
 OLLAMA_LOCAL_URL  = os.environ.get("OLLAMA_LOCAL_URL",  "http://host.docker.internal:11434")
 OLLAMA_REMOTE_URL = os.environ.get("OLLAMA_REMOTE_URL", "")           # LAN GPU server
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
+ANTHROPIC_BASE_URL = os.environ.get("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/")
+# Mark the system prompt as a cacheable prefix (Anthropic prompt caching)
+PROMPT_CACHE      = os.environ.get("ANTHROPIC_PROMPT_CACHE", "on").lower() not in ("off", "0", "false")
 CLAUDE_MODEL      = os.environ.get("CLAUDE_MODEL", "claude-sonnet-4-6")
 
-# Default local model served by Ollama
+# Default local model served by Ollama (used when model_catalog has
+# nothing to choose from, or with MODEL_SELECTION=fixed)
 LOCAL_MODEL       = os.environ.get("LOCAL_MODEL", "llama3")
 
+# Hedging (route(hedge=True)): a second backend gets the request when the
+# first has not streamed a token by this percentile of its recent
+# time-to-first-token, clamped to [min, max]; the default applies until
+# enough samples exist.
+HEDGE_PERCENTILE    = float(os.environ.get("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_DEFAULT_DELAY = float(os.environ.get("LLM_HEDGE_DEFAULT_DELAY", "3"))
+HEDGE_MIN_DELAY     = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "0.25"))
+HEDGE_MAX_DELAY     = float(os.environ.get("LLM_HEDGE_MAX_DELAY", "15"))
+
+# Timeouts (see _timeout): TIMEOUT_FACTOR x a backend's recent
+# p{TIMEOUT_PERCENTILE} latency for the expected output length, clamped to
+# [min, max].  The fixed per-backend values apply until enough samples
+# exist, and to Ollama calls that have to load the model first.
+TIMEOUT_PERCENTILE    = float(os.environ.get("LLM_TIMEOUT_PERCENTILE", "99"))
+TIMEOUT_FACTOR        = float(os.environ.get("LLM_TIMEOUT_FACTOR", "3"))
+TIMEOUT_MIN           = float(os.environ.get("LLM_TIMEOUT_MIN", "10"))
+TIMEOUT_MAX           = float(os.environ.get("LLM_TIMEOUT_MAX", "600"))
+OLLAMA_TIMEOUT        = float(os.environ.get("LLM_OLLAMA_TIMEOUT", "120"))
+CLAUDE_TIMEOUT        = float(os.environ.get("LLM_CLAUDE_TIMEOUT", "180"))
+HEALTH_TIMEOUT        = float(os.environ.get("LLM_HEALTH_TIMEOUT", "5"))
+# An Ollama stream that sends nothing for this long after its first token is dead
+STREAM_STALL_TIMEOUT  = float(os.environ.get("LLM_STREAM_STALL_TIMEOUT", "30"))
+# Expected output length when the caller gives no max_tokens and there is no history
+DEFAULT_OUTPUT_TOKENS = int(os.environ.get("LLM_DEFAULT_OUTPUT_TOKENS", "512"))
+
 
 class LLMBackend(str, Enum):
     LOCAL_OLLAMA  = "local_ollama"
@@ -44,152 +82,717 @@ class LLMResponse:
     backend: LLMBackend
     model: str
     tokens_used: int = 0
+    decision_id: str = ""      # complexity_scorer decision, for routing feedback
+    input_tokens: int = 0
+    cache_read_tokens: int = 0       # Claude: prompt prefix served from cache
+    cache_write_tokens: int = 0      # Claude: prompt prefix written to cache
 
 
-# ---------------------------------------------------------------------------
-# Task complexity heuristics
-# ---------------------------------------------------------------------------
+# A system prompt is a string or a list of layers, most stable first
+# (identity, role instructions, ...).  Layers must not embed anything
+# per-request: Claude caches them as a prefix that only hits when it is
+# byte-identical to an earlier request's.
+System = Union[str, list]
+
 
-COMPLEX_KEYWORDS = {
-    "reason", "analyze", "architecture", "design", "refactor",
-    "security", "vulnerability", "optimize", "explain",
-    "compare", "evaluate", "critique", "summarize long",
-}
+def _system_text(system: System) -> str:
+    """System prompt as one string (Ollama)."""
+    if isinstance(system, str):
+        return system
+    return "\n\n".join(layer for layer in system if layer)
 
-def _needs_claude(prompt: str, force_claude: bool = False) -> bool:
-    """Return True when the task should be routed to Claude API."""
-    if force_claude:
-        return True
-    if not ANTHROPIC_API_KEY:
-        return False
-    prompt_lower = prompt.lower()
-    return any(kw in prompt_lower for kw in COMPLEX_KEYWORDS) or len(prompt) > 3000
+
+def _system_blocks(system: System) -> list[dict]:
+    """System prompt as Messages API text blocks; the last one closes the cached prefix."""
+    layers = [system] if isinstance(system, str) else [layer for layer in system if layer]
+    blocks = [{"type": "text", "text": layer} for layer in layers]
+    if blocks and PROMPT_CACHE:
+        blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return blocks
 
 
 def _remote_available() -> bool:
     return bool(OLLAMA_REMOTE_URL)
 
 
+def ollama_backends() -> dict[str, str]:
+    """Configured Ollama backends as {short name: base URL} (names used for pinning)."""
+    backends = {"local": OLLAMA_LOCAL_URL}
+    if _remote_available():
+        backends["remote"] = OLLAMA_REMOTE_URL
+    return backends
+
+
+def _ollama_url(backend: LLMBackend) -> str:
+    return OLLAMA_REMOTE_URL if backend == LLMBackend.REMOTE_OLLAMA else OLLAMA_LOCAL_URL
+
+
+def backend_name(url: str) -> str:
+    return "remote" if url == OLLAMA_REMOTE_URL and url != OLLAMA_LOCAL_URL else "local"
+
+
+def _ollama_backend(url: str) -> LLMBackend:
+    return LLMBackend.REMOTE_OLLAMA if backend_name(url) == "remote" else LLMBackend.LOCAL_OLLAMA
+
+
+# ---------------------------------------------------------------------------
+# Timeouts
+# ---------------------------------------------------------------------------
+
+def _expected_tokens(backend: LLMBackend, max_tokens: Optional[int]) -> float:
+    """Output length to allow for: the caller's cap, else the backend's recent high percentile."""
+    if max_tokens:
+        return max_tokens
+    p = backend_stats.percentile(backend.value, TIMEOUT_PERCENTILE, "output_tokens")
+    return p if p is not None else DEFAULT_OUTPUT_TOKENS
+
+
+def _timeout(backend: LLMBackend, max_tokens: Optional[int] = None) -> float:
+    """
+    Seconds to allow one call to backend.
+
+    Streaming backends: FACTOR x (p first token + expected tokens x p time
+    per token).  Claude (not streamed) has no per-token samples; its p
+    total time is scaled by expected / typical (p50) output length.
+    """
+    q = TIMEOUT_PERCENTILE
+    first = backend_stats.percentile(backend.value, q, "first_token")
+    per_token = backend_stats.percentile(backend.value, q, "per_token")
+    expected = _expected_tokens(backend, max_tokens)
+    if first is not None and per_token is not None:
+        seconds = TIMEOUT_FACTOR * (first + expected * per_token)
+    else:
+        total = backend_stats.percentile(backend.value, q, "total")
+        if total is None:
+            return CLAUDE_TIMEOUT if backend == LLMBackend.CLAUDE_API else OLLAMA_TIMEOUT
+        typical = backend_stats.percentile(backend.value, 50, "output_tokens")
+        seconds = TIMEOUT_FACTOR * total * (max(1.0, expected / typical) if typical else 1.0)
+    return min(max(seconds, TIMEOUT_MIN), TIMEOUT_MAX)
+
+
+def _health_timeout(key: str) -> float:
+    """Ping timeout: FACTOR x the backend's recent ping latency, at most HEALTH_TIMEOUT."""
+    p = backend_stats.percentile(f"{key}:health", TIMEOUT_PERCENTILE, "total")
+    return HEALTH_TIMEOUT if p is None else min(max(TIMEOUT_FACTOR * p, 1.0), HEALTH_TIMEOUT)
+
+
 # ---------------------------------------------------------------------------
 # Backend callers
 # ---------------------------------------------------------------------------
 
-async def _call_ollama(url: str, model: str, prompt: str,
-                       system: str = "") -> str:
+LLM_CANCELLED = Counter("llm_backend_calls_cancelled_total",
+                        "Backend calls aborted because nobody was waiting for them any more",
+                        ["backend"])
+
+def _record_breaker_failure(breaker: circuit_breaker.CircuitBreaker, exc: Exception) -> None:
+    if circuit_breaker.counts_as_failure(exc):
+        breaker.record_failure()
+    else:
+        breaker.release()
+
+
+def _breaker_available(backend: LLMBackend) -> bool:
+    return circuit_breaker.get(backend.value).available()
+
+
+async def _call_ollama(url: str, model: str, prompt: str, system: System = "",
+                       on_first_token=None, max_tokens: Optional[int] = None) -> str:
+    """Stream a generation and return the full text.
+
+    on_first_token() is called as soon as the first chunk arrives; the
+    time to it, the total time and the output length go to backend_stats.
+    Cancelling the call closes the connection, which stops the generation
+    on the Ollama side.
+    """
     payload = {
         "model": model,
         "prompt": prompt,
-        "stream": False,
+        "stream": True,
+        "keep_alive": model_residency.keep_alive_for(backend_name(url), model),
     }
     if system:
-        payload["system"] = system
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            f"{url}/api/generate",
-            json=payload,
-            timeout=aiohttp.ClientTimeout(total=120),
-        ) as resp:
-            resp.raise_for_status()
-            data = await resp.json()
-            return data.get("response", "")
-
-
-async def _call_claude(prompt: str, system: str = "",
-                       model: str = CLAUDE_MODEL) -> tuple[str, int]:
-    """Call Anthropic Claude API using raw HTTP (no SDK dependency required)."""
-    headers = {
+        payload["system"] = _system_text(system)
+    if max_tokens:
+        payload["options"] = {"num_predict": max_tokens}
+
+    backend = _ollama_backend(url)
+    stats_key = backend.value
+    timeout = _timeout(backend, max_tokens)
+    if timeout < OLLAMA_TIMEOUT and not await model_residency.is_loaded(url, model):
+        timeout = OLLAMA_TIMEOUT       # latency history says nothing about a cold load
+    breaker = circuit_breaker.get(stats_key)
+    breaker.acquire()
+    started = time.monotonic()
+    first_token = None
+    output_tokens = None
+    parts: list[str] = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                f"{url}/api/generate",
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as resp:
+                resp.raise_for_status()
+                while True:
+                    try:
+                        line = await asyncio.wait_for(
+                            resp.content.readline(),
+                            STREAM_STALL_TIMEOUT if first_token is not None else None)
+                    except asyncio.TimeoutError:
+                        raise asyncio.TimeoutError(
+                            f"{stats_key} stream stalled for {STREAM_STALL_TIMEOUT:g}s") from None
+                    if not line:
+                        break
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"])
+                    if first_token is None:
+                        first_token = time.monotonic() - started
+                        if on_first_token is not None:
+                            on_first_token()
+                    parts.append(chunk.get("response", ""))
+                    if chunk.get("done"):
+                        output_tokens = chunk.get("eval_count")
+                        model_catalog.record_speed(backend_name(url), model, output_tokens or 0,
+                                                   (chunk.get("eval_duration") or 0) / 1e9)
+                        break
+    except Exception as e:
+        backend_stats.record_error(stats_key)
+        _record_breaker_failure(breaker, e)
+        raise
+    except asyncio.CancelledError:
+        breaker.release()
+        LLM_CANCELLED.labels(backend=stats_key).inc()
+        raise
+    backend_stats.record(stats_key, first_token, time.monotonic() - started, output_tokens)
+    breaker.record_success(first_token)
+    model_residency.note_loaded(url, model)
+    return "".join(parts)
+
+
+def claude_headers() -> dict:
+    return {
         "x-api-key": ANTHROPIC_API_KEY,
         "anthropic-version": "2023-06-01",
         "content-type": "application/json",
     }
-    messages = [{"role": "user", "content": prompt}]
+
+
+def claude_params(prompt: str, system: System = "", model: str = CLAUDE_MODEL,
+                  max_tokens: int = 4096) -> dict:
+    """Messages API request body (also used for Message Batches requests)."""
     body = {
         "model": model,
-        "max_tokens": 4096,
-        "messages": messages,
+        "max_tokens": max_tokens,
     }
-    if system:
-        body["system"] = system
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=body,
-            timeout=aiohttp.ClientTimeout(total=180),
-        ) as resp:
-            resp.raise_for_status()
-            data = await resp.json()
-            text = data["content"][0]["text"]
-            tokens = data.get("usage", {}).get("output_tokens", 0)
-            return text, tokens
+    # Prefix order is system, then messages: keep system first and stable
+    blocks = _system_blocks(system) if system else []
+    if blocks:
+        body["system"] = blocks
+    body["messages"] = [{"role": "user", "content": prompt}]
+    return body
+
+
+CLAUDE_TOKENS = Counter("llm_claude_tokens_total", "Claude API tokens by kind", ["kind"])
+
+
+async def _call_claude(prompt: str, system: System = "", model: str = CLAUDE_MODEL,
+                       max_tokens: Optional[int] = None) -> tuple[str, dict]:
+    """Call Anthropic Claude API using raw HTTP (no SDK dependency required).
+
+    Returns (text, usage) with the API's usage block (input/output and
+    cache read/creation token counts).
+    """
+    headers = claude_headers()
+    body = claude_params(prompt, system, model, max_tokens or 4096)
+
+    breaker = circuit_breaker.get(LLMBackend.CLAUDE_API.value)
+    breaker.acquire()
+    started = time.monotonic()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                f"{ANTHROPIC_BASE_URL}/v1/messages",
+                headers=headers,
+                json=body,
+                timeout=aiohttp.ClientTimeout(total=_timeout(LLMBackend.CLAUDE_API, max_tokens)),
+            ) as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+                text = data["content"][0]["text"]
+                usage = data.get("usage", {})
+    except Exception as e:
+        backend_stats.record_error(LLMBackend.CLAUDE_API.value)
+        _record_breaker_failure(breaker, e)
+        raise
+    except asyncio.CancelledError:
+        breaker.release()
+        LLM_CANCELLED.labels(backend=LLMBackend.CLAUDE_API.value).inc()
+        raise
+    elapsed = time.monotonic() - started
+    backend_stats.record(LLMBackend.CLAUDE_API.value, None, elapsed, usage.get("output_tokens"))
+    # Not streamed: elapsed is the whole answer, not time to first token,
+    # so it says nothing about the breaker's notion of a slow call
+    breaker.record_success()
+    for kind, field_name in (("input", "input_tokens"), ("output", "output_tokens"),
+                             ("cache_read", "cache_read_input_tokens"),
+                             ("cache_write", "cache_creation_input_tokens")):
+        CLAUDE_TOKENS.labels(kind=kind).inc(usage.get(field_name) or 0)
+    return text, usage
+
+
+def _claude_response(text: str, usage: dict, model: str = CLAUDE_MODEL) -> LLMResponse:
+    return LLMResponse(
+        text=text, backend=LLMBackend.CLAUDE_API, model=model,
+        tokens_used=usage.get("output_tokens") or 0,
+        input_tokens=usage.get("input_tokens") or 0,
+        cache_read_tokens=usage.get("cache_read_input_tokens") or 0,
+        cache_write_tokens=usage.get("cache_creation_input_tokens") or 0,
+    )
 
 
 # ---------------------------------------------------------------------------
 # Public interface
 # ---------------------------------------------------------------------------
 
+# ---------------------------------------------------------------------------
+# Single-flight: identical concurrent requests share one backend call
+# ---------------------------------------------------------------------------
+
+LLM_COALESCED = Counter("llm_requests_coalesced_total",
+                        "route() calls served by an identical in-flight request")
+
+class _Flight:
+    """A shared backend call and the number of route() callers awaiting it."""
+
+    __slots__ = ("future", "waiters")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+
+
+_inflight: dict[str, _Flight] = {}
+_singleflight_stats = {"calls": 0, "coalesced": 0, "cancelled": 0}
+
+
+def _request_key(**request) -> str:
+    """Signature of everything that determines a route() result."""
+    request["models"] = (LOCAL_MODEL, CLAUDE_MODEL)
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+def singleflight_stats() -> dict:
+    return {**_singleflight_stats, "in_flight": len(_inflight)}
+
+
 async def route(
     prompt: str,
-    system: str = "",
+    system: System = "",
     force_claude: bool = False,
     force_local: bool = False,
     prefer_remote_gpu: bool = False,
+    coalesce: bool = True,
+    hedge: Optional[bool] = None,
+    role: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    agent: Optional[str] = None,
+    task_type: Optional[str] = None,
+    routing: Optional[dict] = None,
 ) -> LLMResponse:
     """
     Route a prompt to the best available LLM backend and return an LLMResponse.
 
+    Concurrent calls with the same arguments share a single backend call
+    and its result (coalesce=False opts out, e.g. when a fresh sample is
+    wanted).  Cancelling a caller (client disconnect, explicit cancel)
+    detaches it from the shared call; the backend request itself is
+    aborted once no caller is left waiting for it.
+
+    hedge=True is for latency-critical callers: when two Ollama backends
+    are configured and the first has not produced a token by its hedge
+    deadline (see _hedge_delay), the request is also sent to the other
+    one and whichever streams first wins.  Bulk work should leave it off;
+    a hedge can double the load on a backend that is already slow.
+    hedge=None (the default) leaves it to the routing policy (off unless
+    a rule sets it).
+
+    system may be a list of layers (see System); on Claude they are sent
+    as a cached prefix.  max_tokens caps the answer length and sizes the
+    backend timeouts (see _timeout).
+
+    role (the calling agent's AgentRole value), agent (its name) and
+    task_type select the routing_policy rule: backend chain, models,
+    default max_tokens, latency SLO, hedging.  routing holds rule fields
+    (validated with routing_policy.validate_rule) applied over the policy,
+    e.g. an agent's own overrides.  role is also a complexity-scoring
+    feature.
+    """
+    _singleflight_stats["calls"] += 1
+    options = dict(force_claude=force_claude, force_local=force_local,
+                   prefer_remote_gpu=prefer_remote_gpu, role=role, max_tokens=max_tokens,
+                   agent=agent, task_type=task_type, routing=routing)
+    if not coalesce:
+        return await _route(prompt, system, hedge=hedge, **options)
+    key = _request_key(prompt=prompt, system=system, **options)
+    flight = _inflight.get(key)
+    if flight is None:
+        flight = _Flight(asyncio.ensure_future(_route(prompt, system, hedge=hedge, **options)))
+        _inflight[key] = flight
+        flight.future.add_done_callback(
+            lambda f: _inflight.pop(key, None) if _inflight.get(key) is flight else None)
+    else:
+        _singleflight_stats["coalesced"] += 1
+        LLM_COALESCED.inc()
+    flight.waiters += 1
+    try:
+        resp = await asyncio.shield(flight.future)
+    except asyncio.CancelledError:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.future.done():
+            # Last caller gone: stop the generation, and don't let a new
+            # identical request join a call that is being cancelled
+            if _inflight.get(key) is flight:
+                del _inflight[key]
+            flight.future.cancel()
+            _singleflight_stats["cancelled"] += 1
+        raise
+    flight.waiters -= 1
+    # Each caller gets its own copy of the shared response
+    return dataclasses.replace(resp)
+
+
+LLM_TIER_DECISIONS = Counter("llm_complexity_decisions_total",
+                             "route() calls by complexity tier", ["tier"])
+LLM_SLO_MISSES     = Counter("llm_policy_slo_misses_total",
+                             "route() answers slower than the routing policy's latency SLO",
+                             ["role"])
+
+
+async def _route(
+    prompt: str,
+    system: System = "",
+    force_claude: bool = False,
+    force_local: bool = False,
+    prefer_remote_gpu: bool = False,
+    hedge: Optional[bool] = None,
+    role: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    agent: Optional[str] = None,
+    task_type: Optional[str] = None,
+    routing: Optional[dict] = None,
+) -> LLMResponse:
+    """
+    Pick a backend for one request and call it.
+
     Priority logic:
       1. force_claude=True  → Claude API (if key present)
       2. force_local=True   → local Ollama only
-      3. prefer_remote_gpu  → try remote Ollama first
-      4. Complex prompt + Claude key available → Claude API
-      5. Default: local Ollama (fallback to remote, then Claude)
+      3. The routing policy's backend chain for role / task_type / agent,
+         if it sets one
+      4. Complexity tier (complexity_scorer), logged for retraining:
+           HIGH → Claude API, then Ollama as MED
+           MED  → Ollama, best available backend first
+           LOW  → Ollama, local backend first
+    Models, max_tokens and hedging also come from the policy where the
+    caller leaves them open.
     """
+    policy = routing_policy.resolve(role, agent, task_type, routing)
+    model = policy.model or LOCAL_MODEL
+    claude_model = policy.claude_model or CLAUDE_MODEL
+    max_tokens = max_tokens or policy.max_tokens
+    if hedge is None:
+        hedge = bool(policy.hedge)
+
     # --- Claude forced ---
     if force_claude and ANTHROPIC_API_KEY:
-        text, tokens = await _call_claude(prompt, system)
-        return LLMResponse(text=text, backend=LLMBackend.CLAUDE_API,
-                           model=CLAUDE_MODEL, tokens_used=tokens)
+        return _claude_response(*await _call_claude(prompt, system, claude_model, max_tokens),
+                                claude_model)
 
     # --- Local forced ---
     if force_local:
-        text = await _call_ollama(OLLAMA_LOCAL_URL, LOCAL_MODEL, prompt, system)
-        return LLMResponse(text=text, backend=LLMBackend.LOCAL_OLLAMA,
-                           model=LOCAL_MODEL)
+        text = await _call_ollama(OLLAMA_LOCAL_URL, model, prompt, system, max_tokens=max_tokens)
+        return LLMResponse(text=text, backend=LLMBackend.LOCAL_OLLAMA, model=model)
 
-    # --- Complexity routing ---
-    if _needs_claude(prompt, force_claude) and ANTHROPIC_API_KEY:
+    # --- Policy chain / complexity routing ---
+    decision = complexity_scorer.classify(prompt, role)
+    LLM_TIER_DECISIONS.labels(tier=decision.tier.value).inc()
+    started = time.monotonic()
+    try:
+        resp = await _route_tier(decision.tier, prompt, system, prefer_remote_gpu, hedge,
+                                 max_tokens, policy)
+    except Exception:
+        complexity_scorer.log_decision(decision, None, time.monotonic() - started)
+        raise
+    elapsed = time.monotonic() - started
+    complexity_scorer.log_decision(decision, resp.backend.value, elapsed)
+    if policy.latency_slo and elapsed > policy.latency_slo:
+        LLM_SLO_MISSES.labels(role=role or "none").inc()
+    resp.decision_id = decision.id
+    return resp
+
+
+def _meets_slo(backend: LLMBackend, slo: Optional[float]) -> bool:
+    p95 = backend_stats.percentile(backend.value, 95, "total") if slo else None
+    return p95 is None or p95 <= slo
+
+
+async def _ollama_models(tier: str, policy: routing_policy.Policy, min_context: int) -> dict:
+    """Ollama model per backend: the policy's, else model_catalog's choice for tier."""
+    backends = [LLMBackend.LOCAL_OLLAMA] + ([LLMBackend.REMOTE_OLLAMA] if _remote_available() else [])
+    if policy.model or not model_catalog.enabled():
+        return {b: policy.model or LOCAL_MODEL for b in backends}
+    models = {}
+    for backend in backends:
+        url = _ollama_url(backend)
         try:
-            text, tokens = await _call_claude(prompt, system)
-            return LLMResponse(text=text, backend=LLMBackend.CLAUDE_API,
-                               model=CLAUDE_MODEL, tokens_used=tokens)
+            chosen = await model_catalog.choose(url, backend_name(url), tier, min_context)
         except Exception as e:
-            logger.warning(f"Claude API failed, falling back to local: {e}")
+            logger.warning(f"Model selection on {backend.value} failed: {e}")
+            chosen = None
+        models[backend] = chosen or LOCAL_MODEL
+    return models
+
+
+async def _candidates(chain: tuple, tier: complexity_scorer.ComplexityTier,
+                      prefer_remote_gpu: bool, models: dict, slo: Optional[float]) -> list:
+    """Backends for a policy chain, in the order to try them."""
+    candidates: list[LLMBackend] = []
+    for name in chain:
+        if name == "claude":
+            found = [LLMBackend.CLAUDE_API] if ANTHROPIC_API_KEY else []
+        elif name == "local":
+            found = [LLMBackend.LOCAL_OLLAMA]
+        elif name == "remote":
+            found = [LLMBackend.REMOTE_OLLAMA] if _remote_available() else []
+        else:
+            # "ollama".  MED/HIGH: a backend with the model already in
+            # memory first, then the remote GPU if preferred, local
+            # otherwise.  LOW: local first
+            found = [LLMBackend.LOCAL_OLLAMA]
+            if _remote_available():
+                found.append(LLMBackend.REMOTE_OLLAMA)
+                if prefer_remote_gpu and tier != complexity_scorer.ComplexityTier.LOW:
+                    found.reverse()
+            if len(found) > 1 and tier != complexity_scorer.ComplexityTier.LOW:
+                loaded = [b for b in found if await model_residency.is_loaded(_ollama_url(b), models[b])]
+                found = loaded + [b for b in found if b not in loaded]
+        candidates += [b for b in found if b not in candidates]
+    # Backends with an open breaker go last: they reject instantly, so
+    # trying them only matters once everything else has failed.  Those
+    # missing the latency SLO go just before them
+    def rank(backend: LLMBackend) -> int:
+        if not _breaker_available(backend):
+            return 2
+        return 0 if _meets_slo(backend, slo) else 1
+    return sorted(candidates, key=rank)
+
+
+async def _plan(tier: complexity_scorer.ComplexityTier, policy: routing_policy.Policy,
+                prefer_remote_gpu: bool, min_context: int) -> tuple[tuple, list, dict]:
+    """(policy chain, backends in the order to try them, Ollama model per backend)."""
+    chain = policy.backends or (("claude", "ollama")
+                                if tier == complexity_scorer.ComplexityTier.HIGH else ("ollama",))
+    models = await _ollama_models(policy.model_tier or tier.value, policy, min_context)
+    candidates = await _candidates(chain, tier, prefer_remote_gpu, models, policy.latency_slo)
+    return chain, candidates, models
+
+
+async def prompt_model(
+    prompt: str,
+    role: Optional[str] = None,
+    agent: Optional[str] = None,
+    task_type: Optional[str] = None,
+    routing: Optional[dict] = None,
+    prefer_remote_gpu: bool = False,
+) -> str:
+    """
+    Model a route() call with these arguments would try first, for sizing
+    its prompt with prompt_builder.  Fallbacks to Ollama pick a model whose
+    context window fits the prompt they get.
+    """
+    policy = routing_policy.resolve(role, agent, task_type, routing)
+    tier = complexity_scorer.classify(prompt, role).tier
+    _, candidates, models = await _plan(tier, policy, prefer_remote_gpu, 0)
+    if candidates and candidates[0] == LLMBackend.CLAUDE_API:
+        return policy.claude_model or CLAUDE_MODEL
+    if candidates:
+        return models[candidates[0]]
+    return policy.model or LOCAL_MODEL
+
+
+async def ollama_generate(url: str, model: str, prompt: str, system: System = "",
+                          max_tokens: Optional[int] = None) -> str:
+    """
+    One generation with a given model on the Ollama backend at url, with
+    no routing or fallback (batch jobs).  Breaker, latency stats and
+    keep-alive apply as for routed calls.
+    """
+    return await _call_ollama(url, model, prompt, system, max_tokens=max_tokens)
 
-    # --- Remote GPU preferred ---
-    if prefer_remote_gpu and _remote_available():
+
+async def _route_tier(
+    tier: complexity_scorer.ComplexityTier,
+    prompt: str,
+    system: System,
+    prefer_remote_gpu: bool,
+    hedge: bool,
+    max_tokens: Optional[int] = None,
+    policy: routing_policy.Policy = routing_policy.Policy(),
+) -> LLMResponse:
+    claude_model = policy.claude_model or CLAUDE_MODEL
+    # The prompt and the answer must fit the chosen model's context window
+    min_context = (prompt_builder.count_tokens(_system_text(system) + prompt, LOCAL_MODEL)
+                   + (max_tokens or DEFAULT_OUTPUT_TOKENS))
+    chain, candidates, models = await _plan(tier, policy, prefer_remote_gpu, min_context)
+    if not candidates:
+        raise RuntimeError(f"No configured backend in routing chain {list(chain)}")
+
+    # One step per backend; with hedging, consecutive Ollama backends form
+    # one hedged step.  A failed step falls back to the next
+    steps: list[list[LLMBackend]] = []
+    for backend in candidates:
+        if (hedge and backend != LLMBackend.CLAUDE_API and steps
+                and steps[-1][0] != LLMBackend.CLAUDE_API):
+            steps[-1].append(backend)
+        else:
+            steps.append([backend])
+    for i, step in enumerate(steps):
         try:
-            text = await _call_ollama(OLLAMA_REMOTE_URL, LOCAL_MODEL, prompt, system)
-            return LLMResponse(text=text, backend=LLMBackend.REMOTE_OLLAMA,
-                               model=LOCAL_MODEL)
+            if step[0] == LLMBackend.CLAUDE_API:
+                return _claude_response(
+                    *await _call_claude(prompt, system, claude_model, max_tokens), claude_model)
+            if len(step) > 1:
+                return await _hedged_ollama(step, prompt, system, max_tokens, models)
+            text = await _call_ollama(_ollama_url(step[0]), models[step[0]], prompt, system,
+                                      max_tokens=max_tokens)
+            return LLMResponse(text=text, backend=step[0], model=models[step[0]])
         except Exception as e:
-            logger.warning(f"Remote Ollama failed, falling back to local: {e}")
+            name = "+".join(b.value for b in step)
+            if i == len(steps) - 1:
+                logger.error(f"{name} failed: {e}")
+                raise
+            logger.warning(f"{name} failed, falling back to {steps[i + 1][0].value}: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Hedging
+# ---------------------------------------------------------------------------
+
+LLM_HEDGED = Counter("llm_hedged_requests_total",
+                     "Hedged route() calls where a second backend was tried, by which answered",
+                     ["winner"])
+
+
+def _hedge_delay(backend: LLMBackend) -> float:
+    """Seconds to wait for backend's first token before hedging."""
+    p = backend_stats.percentile(backend.value, HEDGE_PERCENTILE)
+    if p is None:
+        return HEDGE_DEFAULT_DELAY
+    return min(max(p, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
 
-    # --- Local Ollama (default) ---
+
+async def _hedged_ollama(candidates: list, prompt: str, system: System,
+                         max_tokens: Optional[int] = None,
+                         models: Optional[dict] = None) -> LLMResponse:
+    """
+    Call candidates[0]; start the next candidate when it misses its hedge
+    deadline (if that backend is healthy) or fails.  The first attempt to
+    stream a token wins and the others are cancelled, as are all of them
+    if the caller is.  models maps a backend to its model (default LOCAL_MODEL).
+    """
+    models = models or {}
+    loop = asyncio.get_running_loop()
+    first_tokens: asyncio.Queue = asyncio.Queue()
+    attempts: dict[LLMBackend, asyncio.Future] = {}
+    waiting = list(candidates)
+    errors: list[Exception] = []
+
+    def launch() -> None:
+        backend = waiting.pop(0)
+        attempts[backend] = asyncio.ensure_future(_call_ollama(
+            _ollama_url(backend), models.get(backend, LOCAL_MODEL), prompt, system,
+            on_first_token=lambda: first_tokens.put_nowait(backend), max_tokens=max_tokens))
+
+    launch()
+    hedge_at = loop.time() + _hedge_delay(candidates[0])
+    winner: Optional[LLMBackend] = None
+    token_wait: Optional[asyncio.Future] = None
     try:
-        text = await _call_ollama(OLLAMA_LOCAL_URL, LOCAL_MODEL, prompt, system)
-        return LLMResponse(text=text, backend=LLMBackend.LOCAL_OLLAMA,
-                           model=LOCAL_MODEL)
-    except Exception as e:
-        logger.error(f"Local Ollama failed: {e}")
-        # Last resort: remote GPU
-        if _remote_available():
-            text = await _call_ollama(OLLAMA_REMOTE_URL, LOCAL_MODEL, prompt, system)
-            return LLMResponse(text=text, backend=LLMBackend.REMOTE_OLLAMA,
-                               model=LOCAL_MODEL)
-        raise
+        while winner is None:
+            live = [a for a in attempts.values() if not a.done()]
+            if not live:
+                if not waiting:
+                    raise errors[-1]
+                launch()       # every attempt so far failed: plain failover
+                continue
+            can_hedge = (bool(waiting) and backend_stats.is_healthy(waiting[0].value)
+                         and _breaker_available(waiting[0]))
+            token_wait = asyncio.ensure_future(first_tokens.get())
+            done, _ = await asyncio.wait(
+                live + [token_wait],
+                timeout=max(0.0, hedge_at - loop.time()) if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if token_wait in done:
+                winner = token_wait.result()
+                break
+            token_wait.cancel()
+            if not done:
+                logger.info(f"{candidates[0].value} slow to first token, hedging to {waiting[0].value}")
+                launch()
+                continue
+            for backend, attempt in attempts.items():
+                if attempt in done:
+                    if attempt.exception() is None:
+                        winner = backend
+                    else:
+                        errors.append(attempt.exception())
+                        logger.warning(f"{backend.value} failed: {attempt.exception()}")
+    finally:
+        if token_wait is not None:
+            token_wait.cancel()
+        for backend, attempt in attempts.items():
+            if backend != winner and not attempt.done():
+                attempt.cancel()
+
+    if len(attempts) > 1:
+        LLM_HEDGED.labels(winner="primary" if winner == candidates[0] else "hedge").inc()
+    text = await attempts[winner]
+    return LLMResponse(text=text, backend=winner, model=models.get(winner, LOCAL_MODEL))
+
+
+def latency_stats() -> dict:
+    """Recent per-backend latency/error stats, hedge deadlines and timeouts."""
+    return {
+        "backends": backend_stats.snapshot(),
+        "hedge_delay": {b.value: round(_hedge_delay(b), 3)
+                        for b in (LLMBackend.LOCAL_OLLAMA, LLMBackend.REMOTE_OLLAMA)},
+        "timeout": {b.value: round(_timeout(b), 1) for b in LLMBackend},
+    }
+
+
+def breaker_status() -> dict:
+    """Circuit breaker state per backend."""
+    return circuit_breaker.snapshot()
+
+
+async def warm_up() -> None:
+    """Preload LOCAL_MODEL and any pinned models on the Ollama backends."""
+    await model_residency.preload_all(ollama_backends(), {"local": [LOCAL_MODEL]})
+
+
+async def model_status() -> dict:
+    """Loaded and pinned models per Ollama backend."""
+    return await model_residency.status(ollama_backends())
+
+
+async def catalog_status(refresh: bool = False) -> dict:
+    """Installed models, measured speeds and per-tier choices per Ollama backend."""
+    return await model_catalog.status(ollama_backends(), refresh=refresh)
 
 
 async def health_check() -> dict:
@@ -201,13 +804,16 @@ async def health_check() -> dict:
     }
 
     async def ping_ollama(url: str, key: str):
+        started = time.monotonic()
         try:
             async with aiohttp.ClientSession() as s:
                 async with s.get(f"{url}/api/tags",
-                                 timeout=aiohttp.ClientTimeout(total=5)) as r:
+                                 timeout=aiohttp.ClientTimeout(total=_health_timeout(key))) as r:
                     status[key] = r.status == 200
         except Exception:
-            pass
+            backend_stats.record_error(f"{key}:health")
+            return
+        backend_stats.record(f"{key}:health", None, time.monotonic() - started)
 
     tasks = [ping_ollama(OLLAMA_LOCAL_URL, "local_ollama")]
     if _remote_available():
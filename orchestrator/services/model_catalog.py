@@ -0,0 +1,318 @@
+"""
+Model Catalogue
+
+The models installed on each Ollama backend, so a request goes to the
+smallest model that is good enough for it instead of always LOCAL_MODEL
+(a 70B model emitting a five-field JSON object is mostly wasted GPU).
+
+  - Discovery: /api/tags lists the models (disk size, parameter count,
+    quantization, family); /api/show adds each model's context length
+    (cached per digest, it never changes).  The list is cached per
+    backend for MODEL_CATALOG_TTL seconds.
+  - Speed: the decode rate (eval_count / eval_duration) of every router
+    call, as a moving average per backend and model, saved to
+    MODEL_SPEEDS_PATH (at most once a minute, from a worker thread) so
+    the measurements survive restarts.
+  - Tiers: a model qualifies for a complexity tier with at least
+    MODEL_TIER_PARAMS billion parameters at MODEL_TIER_QUANT_BITS bits
+    per weight or more (defaults: low 0B / 2 bits, med 7B / 4, high
+    30B / 4).  choose() returns a qualifying model whose context window
+    fits the request: one already loaded if any (a resident or pinned
+    model beats a cold load of a smaller one), else the smallest, then
+    the faster one; if none qualifies, the largest that fits.
+  - Embedding models and names matching MODEL_CATALOG_EXCLUDE (glob
+    patterns) are never chosen.  MODEL_SELECTION=fixed turns selection
+    off (LOCAL_MODEL everywhere, as before).
+
+Backends are identified by their base URL for discovery and by the
+router's short names ("local", "remote") for speeds; this module has no
+routing logic of its own.
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import fnmatch
+import logging
+from pathlib import Path
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+import aiohttp
+
+from . import model_residency
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+SELECTION     = os.environ.get("MODEL_SELECTION", "catalog").lower()      # catalog | fixed
+CATALOG_TTL   = float(os.environ.get("MODEL_CATALOG_TTL", "300"))
+SPEEDS_PATH   = Path(os.environ.get(
+    "MODEL_SPEEDS_PATH",
+    str(Path(os.environ.get("VAULT_MOUNT", "/vault")) / ".agent-routing" / "model_speeds.json")))
+SPEEDS_SAVE_INTERVAL = 60.0
+SPEED_ALPHA   = 0.2         # weight of the newest measurement in the moving average
+EXCLUDE       = [p.strip() for p in os.environ.get("MODEL_CATALOG_EXCLUDE", "").split(",") if p.strip()]
+
+TIERS = ("low", "med", "high")
+DEFAULT_TIER_PARAMS = {"low": 0.0, "med": 7.0, "high": 30.0}
+DEFAULT_TIER_QUANT_BITS = {"low": 2.0, "med": 4.0, "high": 4.0}
+
+
+def _parse_pairs(spec: str) -> dict:
+    pairs = {}
+    for item in spec.split(","):
+        name, sep, value = item.strip().partition(":")
+        if sep and name.strip() in TIERS:
+            try:
+                pairs[name.strip()] = float(value)
+            except ValueError:
+                logger.warning(f"Ignoring bad setting {item!r}")
+    return pairs
+
+
+TIER_PARAMS = {**DEFAULT_TIER_PARAMS, **_parse_pairs(os.environ.get("MODEL_TIER_PARAMS", ""))}
+TIER_QUANT_BITS = {**DEFAULT_TIER_QUANT_BITS,
+                   **_parse_pairs(os.environ.get("MODEL_TIER_QUANT_BITS", ""))}
+
+
+def enabled() -> bool:
+    return SELECTION != "fixed"
+
+
+@dataclass
+class ModelInfo:
+    name: str
+    family: str = ""
+    parameters: Optional[float] = None      # billions
+    quantization: str = ""
+    bits: Optional[float] = None            # per weight
+    size: int = 0                           # bytes on disk (~ memory footprint)
+    context_length: Optional[int] = None
+    digest: str = ""
+
+    @property
+    def embedding(self) -> bool:
+        return "embed" in self.name.lower() or self.family.lower().endswith("bert")
+
+    def qualifies(self, tier: str) -> bool:
+        return ((self.parameters or 0.0) >= TIER_PARAMS[tier]
+                and (self.bits or 16.0) >= TIER_QUANT_BITS[tier])
+
+
+# ---------------------------------------------------------------------------
+# Parsing
+# ---------------------------------------------------------------------------
+
+_PARAMS_RE = re.compile(r"([\d.]+)\s*([KMBT])", re.I)
+_BITS_RE = re.compile(r"^(?:I?Q|F|BF)(\d+)", re.I)
+_SCALE = {"K": 1e-6, "M": 1e-3, "B": 1.0, "T": 1e3}
+
+
+def _parameters(text: str) -> Optional[float]:
+    """Parameter count in billions from e.g. "8.0B" or "137M"."""
+    match = _PARAMS_RE.search(text or "")
+    return float(match.group(1)) * _SCALE[match.group(2).upper()] if match else None
+
+
+def _bits(quantization: str) -> Optional[float]:
+    """Bits per weight from a quantization level, e.g. Q4_K_M -> 4, F16 -> 16."""
+    match = _BITS_RE.match(quantization or "")
+    return float(match.group(1)) if match else None
+
+
+def _from_tags(entry: dict) -> ModelInfo:
+    details = entry.get("details") or {}
+    info = ModelInfo(
+        name=entry.get("name") or entry.get("model", ""),
+        family=details.get("family", ""),
+        parameters=_parameters(details.get("parameter_size", "")),
+        quantization=details.get("quantization_level", ""),
+        size=entry.get("size") or 0,
+        digest=entry.get("digest", ""),
+    )
+    info.bits = _bits(info.quantization)
+    if info.parameters is None and info.size and info.bits:
+        info.parameters = round(info.size * 8 / info.bits / 1e9, 1)
+    return info
+
+
+# ---------------------------------------------------------------------------
+# Discovery (/api/tags, /api/show)
+# ---------------------------------------------------------------------------
+
+_catalogs: dict[str, tuple[float, dict[str, ModelInfo]]] = {}
+_context_lengths: dict[str, Optional[int]] = {}     # digest -> context length
+_refresh_locks: dict[str, asyncio.Lock] = {}
+
+
+async def _show(session: aiohttp.ClientSession, url: str, name: str) -> Optional[int]:
+    async with session.post(f"{url}/api/show", json={"model": name},
+                            timeout=aiohttp.ClientTimeout(total=10)) as resp:
+        resp.raise_for_status()
+        data = await resp.json()
+    for key, value in (data.get("model_info") or {}).items():
+        if key.endswith(".context_length"):
+            return int(value)
+    return None
+
+
+async def _fetch(url: str) -> dict[str, ModelInfo]:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{url}/api/tags",
+                               timeout=aiohttp.ClientTimeout(total=5)) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        models = [_from_tags(entry) for entry in data.get("models", [])]
+        unknown = [m for m in models if m.digest not in _context_lengths]
+        lengths = await asyncio.gather(*(_show(session, url, m.name) for m in unknown),
+                                       return_exceptions=True)
+        for model, length in zip(unknown, lengths):
+            if isinstance(length, Exception):
+                logger.debug(f"/api/show failed for {model.name}: {length}")
+                continue
+            if model.digest:
+                _context_lengths[model.digest] = length
+            model.context_length = length
+    for model in models:
+        model.context_length = model.context_length or _context_lengths.get(model.digest)
+    return {m.name: m for m in models}
+
+
+async def catalog(url: str, refresh: bool = False) -> dict[str, ModelInfo]:
+    """Models installed on the backend at url (cached; the last good list if it is down)."""
+    cached = _catalogs.get(url)
+    if cached and not refresh and time.monotonic() - cached[0] < CATALOG_TTL:
+        return cached[1]
+    lock = _refresh_locks.setdefault(url, asyncio.Lock())
+    async with lock:
+        cached = _catalogs.get(url)
+        if cached and not refresh and time.monotonic() - cached[0] < CATALOG_TTL:
+            return cached[1]
+        try:
+            models = await _fetch(url)
+        except Exception as e:
+            logger.debug(f"Model discovery failed for {url}: {e}")
+            models = cached[1] if cached else {}
+        _catalogs[url] = (time.monotonic(), models)
+        return models
+
+
+# ---------------------------------------------------------------------------
+# Measured speed
+# ---------------------------------------------------------------------------
+
+_speeds: Optional[dict[str, dict[str, float]]] = None      # backend -> model -> tokens/sec
+_save_task: Optional[asyncio.Task] = None
+
+
+def _load_speeds() -> dict[str, dict[str, float]]:
+    global _speeds
+    if _speeds is None:
+        try:
+            _speeds = json.loads(SPEEDS_PATH.read_text())
+        except (OSError, ValueError):
+            _speeds = {}
+    return _speeds
+
+
+def _write_speeds(text: str) -> None:
+    try:
+        SPEEDS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = SPEEDS_PATH.with_suffix(".tmp")
+        tmp.write_text(text)
+        tmp.replace(SPEEDS_PATH)
+    except OSError as e:
+        logger.warning(f"Could not save model speeds to {SPEEDS_PATH}: {e}")
+
+
+def _dump_speeds() -> str:
+    return json.dumps(_load_speeds(), indent=1, sort_keys=True)
+
+
+async def _save_later() -> None:
+    """Coalesce the measurements of SPEEDS_SAVE_INTERVAL seconds into one write."""
+    global _save_task
+    try:
+        await asyncio.sleep(SPEEDS_SAVE_INTERVAL)
+    finally:
+        _save_task = None
+    await asyncio.to_thread(_write_speeds, _dump_speeds())
+
+
+def record_speed(backend: str, model: str, tokens: int, seconds: float) -> None:
+    """Record a decode measurement (tokens generated in seconds)."""
+    global _save_task
+    if not tokens or seconds <= 0:
+        return
+    rate = tokens / seconds
+    speeds = _load_speeds().setdefault(backend, {})
+    previous = speeds.get(model)
+    speeds[model] = round(rate if previous is None
+                          else previous + SPEED_ALPHA * (rate - previous), 2)
+    if _save_task is None:
+        _save_task = asyncio.ensure_future(_save_later())
+
+
+def speed(backend: str, model: str) -> Optional[float]:
+    return _load_speeds().get(backend, {}).get(model)
+
+
+# ---------------------------------------------------------------------------
+# Selection
+# ---------------------------------------------------------------------------
+
+def _eligible(model: ModelInfo) -> bool:
+    return not model.embedding and not any(fnmatch.fnmatch(model.name, p) for p in EXCLUDE)
+
+
+async def choose(url: str, backend: str, tier: str, min_context: int = 0) -> Optional[str]:
+    """
+    Model on the backend qualifying for tier whose context fits
+    min_context tokens: loaded ones first, then the smallest, then the
+    faster; the largest fitting model if none qualifies; None if the
+    catalogue is empty.
+    """
+    models = [m for m in (await catalog(url)).values() if _eligible(m)
+              and (not m.context_length or m.context_length >= min_context)]
+    if not models:
+        return None
+    qualifying = [m for m in models if m.qualifies(tier)]
+    if not qualifying:
+        return max(models, key=lambda m: (m.parameters or 0.0, m.size)).name
+    loaded = {m.name: await model_residency.is_loaded(url, m.name) for m in qualifying}
+    return min(qualifying, key=lambda m: (not loaded[m.name], m.parameters or 0.0, m.size,
+                                          -(speed(backend, m.name) or 0.0))).name
+
+
+async def status(backends: dict[str, str], refresh: bool = False) -> dict:
+    """Catalogue, measured speeds and per-tier choice for each backend ({name: url})."""
+    result = {
+        "selection": SELECTION,
+        "tiers": {t: {"min_parameters_b": TIER_PARAMS[t], "min_quant_bits": TIER_QUANT_BITS[t]}
+                  for t in TIERS},
+        "backends": {},
+    }
+    for name, url in backends.items():
+        models = await catalog(url, refresh=refresh)
+        result["backends"][name] = {
+            "models": [
+                {**asdict(m), "embedding": m.embedding, "tokens_per_sec": speed(name, m.name),
+                 "tiers": [t for t in TIERS if m.qualifies(t)] if _eligible(m) else []}
+                for m in sorted(models.values(), key=lambda m: (m.parameters or 0.0, m.name))
+            ],
+            "choice": {t: await choose(url, name, t) for t in TIERS},
+        }
+    return result
+
+
+def flush() -> None:
+    """Save speed measurements now (at shutdown)."""
+    if _save_task is not None:
+        _save_task.cancel()
+    if _speeds:
+        _write_speeds(_dump_speeds())
@@ -0,0 +1,218 @@
+"""
+Model Residency
+
+Keeps the models we use loaded in Ollama instead of paying a cold load
+(several seconds) every time two callers swap models in VRAM.
+
+  - keep_alive: every Ollama request carries an explicit keep_alive —
+    MODEL_KEEP_ALIVE by default, -1 (never unload) for pinned models.
+  - Pinning: OLLAMA_PINNED_MODELS="local:llama3,local:nomic-embed-text,
+    remote:mistral" pins models per backend ("local" / "remote").
+  - Loaded-model view: /api/ps per backend, cached for RESIDENCY_TTL
+    seconds and updated optimistically after each successful call, so the
+    router can prefer a backend that already has the model in memory.
+  - Preload: pinned models (and the router's default model) are loaded at
+    startup with an empty generate request, or a one-word /api/embed
+    request for embedding models (Ollama rejects generate for those).
+    Workers read the same OLLAMA_PINNED_MODELS for their keep_alive.
+
+Backends are identified by the router's short names ("local", "remote")
+and their base URLs; this module has no routing logic of its own.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Optional, Union
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+MODEL_KEEP_ALIVE = os.environ.get("MODEL_KEEP_ALIVE", "30m")
+RESIDENCY_TTL    = float(os.environ.get("MODEL_RESIDENCY_TTL", "10"))
+PRELOAD_MODELS   = os.environ.get("MODEL_PRELOAD", "on").lower() not in ("off", "0", "false")
+PRELOAD_TIMEOUT  = float(os.environ.get("MODEL_PRELOAD_TIMEOUT", "300"))
+
+
+def _parse_pins(spec: str) -> dict[str, set[str]]:
+    pins: dict[str, set[str]] = {}
+    for item in spec.split(","):
+        backend, sep, model = item.strip().partition(":")
+        if not sep:
+            # "llama3" alone pins on the local backend
+            backend, model = "local", backend
+        if backend.strip() and model.strip():
+            pins.setdefault(backend.strip(), set()).add(model.strip())
+    return pins
+
+
+_pins = _parse_pins(os.environ.get("OLLAMA_PINNED_MODELS", ""))
+
+# url -> (fetched_at, {model name: /api/ps entry})
+_loaded: dict[str, tuple[float, dict[str, dict]]] = {}
+_refresh_locks: dict[str, asyncio.Lock] = {}
+
+
+def is_embedding(model: str) -> bool:
+    """By name, as Ollama's embedding models are published (nomic-embed-text, ...)."""
+    return "embed" in model.lower()
+
+
+def _same_model(a: str, b: str) -> bool:
+    """Ollama reports "llama3:latest" for a request made as "llama3"."""
+    def norm(name: str) -> str:
+        return name if ":" in name else f"{name}:latest"
+    return norm(a) == norm(b)
+
+
+# ---------------------------------------------------------------------------
+# keep_alive and pins
+# ---------------------------------------------------------------------------
+
+def pinned(backend: str) -> set[str]:
+    return set(_pins.get(backend, ()))
+
+
+def is_pinned(backend: str, model: str) -> bool:
+    return any(_same_model(model, m) for m in _pins.get(backend, ()))
+
+
+def keep_alive_for(backend: str, model: str) -> Union[str, int]:
+    """keep_alive value to send with a request for model on backend."""
+    return -1 if is_pinned(backend, model) else MODEL_KEEP_ALIVE
+
+
+# ---------------------------------------------------------------------------
+# Loaded models (/api/ps)
+# ---------------------------------------------------------------------------
+
+async def _fetch_ps(url: str) -> dict[str, dict]:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{url}/api/ps",
+                               timeout=aiohttp.ClientTimeout(total=3)) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+    return {m.get("name") or m.get("model"): m for m in data.get("models", [])}
+
+
+async def loaded_models(url: str, refresh: bool = False) -> dict[str, dict]:
+    """Models currently in memory on the backend at url (cached)."""
+    cached = _loaded.get(url)
+    if cached and not refresh and time.monotonic() - cached[0] < RESIDENCY_TTL:
+        return cached[1]
+    lock = _refresh_locks.setdefault(url, asyncio.Lock())
+    async with lock:
+        cached = _loaded.get(url)
+        if cached and not refresh and time.monotonic() - cached[0] < RESIDENCY_TTL:
+            return cached[1]
+        try:
+            models = await _fetch_ps(url)
+        except Exception as e:
+            logger.debug(f"/api/ps failed for {url}: {e}")
+            models = cached[1] if cached else {}
+        _loaded[url] = (time.monotonic(), models)
+        return models
+
+
+async def is_loaded(url: str, model: str) -> bool:
+    return any(_same_model(model, name) for name in await loaded_models(url))
+
+
+def note_loaded(url: str, model: str) -> None:
+    """Record that model just served a request on url (it is resident now)."""
+    fetched_at, models = _loaded.get(url, (time.monotonic(), {}))
+    if not any(_same_model(model, name) for name in models):
+        models = {**models, model: {"name": model}}
+    _loaded[url] = (fetched_at, models)
+
+
+async def prefer_loaded(candidates: list, model: str, url_of=lambda c: c) -> list:
+    """Stable-reorder candidates so backends with model already loaded come first."""
+    flags = await asyncio.gather(
+        *(is_loaded(url_of(c), model) for c in candidates), return_exceptions=True)
+    loaded = [c for c, f in zip(candidates, flags) if f is True]
+    return loaded + [c for c, f in zip(candidates, flags) if f is not True]
+
+
+# ---------------------------------------------------------------------------
+# Preload
+# ---------------------------------------------------------------------------
+
+async def preload(backend: str, url: str, model: str,
+                  keep_alive: Optional[Union[str, int]] = None) -> bool:
+    """Load model into memory on url without generating anything."""
+    payload = {
+        "model": model,
+        "keep_alive": keep_alive if keep_alive is not None else keep_alive_for(backend, model),
+    }
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def load(embedding: bool) -> None:
+                endpoint, body = (("embed", {**payload, "input": "preload"}) if embedding
+                                  else ("generate", payload))
+                async with session.post(f"{url}/api/{endpoint}", json=body,
+                                        timeout=aiohttp.ClientTimeout(total=PRELOAD_TIMEOUT)) as resp:
+                    resp.raise_for_status()
+                    await resp.read()
+            try:
+                await load(is_embedding(model))
+            except aiohttp.ClientResponseError as e:
+                # An embedding model without "embed" in its name (bge-m3, ...)
+                if e.status != 400 or is_embedding(model):
+                    raise
+                await load(True)
+        note_loaded(url, model)
+        logger.info(f"Preloaded {model} on {backend} ({url}), keep_alive={payload['keep_alive']}")
+        return True
+    except Exception as e:
+        logger.warning(f"Preloading {model} on {backend} failed: {e}")
+        return False
+
+
+async def preload_all(backends: dict[str, str], defaults: dict[str, list[str]]) -> None:
+    """Preload pinned models plus defaults[backend] on every configured backend."""
+    if not PRELOAD_MODELS:
+        return
+    jobs = []
+    for backend, url in backends.items():
+        models = list(dict.fromkeys(list(defaults.get(backend, [])) + sorted(pinned(backend))))
+        # Sequential per backend: concurrent cold loads just fight for VRAM
+        async def load_in_order(backend=backend, url=url, models=models):
+            for model in models:
+                await preload(backend, url, model)
+        jobs.append(load_in_order())
+    await asyncio.gather(*jobs)
+
+
+# ---------------------------------------------------------------------------
+# Status
+# ---------------------------------------------------------------------------
+
+async def status(backends: dict[str, str]) -> dict:
+    """Per-backend loaded models (from a fresh /api/ps) and pins."""
+    async def one(backend: str, url: str) -> dict:
+        models = await loaded_models(url, refresh=True)
+        return {
+            "url": url,
+            "pinned": sorted(pinned(backend)),
+            "loaded": [
+                {
+                    "name": name,
+                    "size_vram": info.get("size_vram"),
+                    "expires_at": info.get("expires_at"),
+                    "pinned": is_pinned(backend, name),
+                }
+                for name, info in sorted(models.items())
+            ],
+        }
+    names = list(backends)
+    results = await asyncio.gather(*(one(b, backends[b]) for b in names))
+    return {
+        "keep_alive": MODEL_KEEP_ALIVE,
+        "backends": dict(zip(names, results)),
+    }
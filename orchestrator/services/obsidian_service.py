@@ -16,10 +16,20 @@ Inside the container the vault is always mounted at /vault.
 
 import os
 import re
+import mmap
+import time
+import asyncio
+import signal
 import logging
+import contextvars
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 import aiofiles
 import aiofiles.os
@@ -29,6 +39,154 @@ logger = logging.getLogger(__name__)
 # Inside the container the vault is always at /vault (see docker-compose)
 VAULT_ROOT = Path(os.environ.get("VAULT_MOUNT", "/vault"))
 
+# Upper bound on the parsed-note cache (approximate bytes of cached text)
+VAULT_CACHE_MAX_BYTES = int(os.environ.get("VAULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Processes used by scan_vault for memory-mapped byte searches (re holds
+# the GIL for a whole match, so threads would search on one core), files
+# per pool task, and the limits on user-supplied patterns: length, and
+# seconds a scan may run before it is abandoned (and the pool replaced)
+VAULT_SCAN_WORKERS     = int(os.environ.get("VAULT_SCAN_WORKERS", str(os.cpu_count() or 4)))
+VAULT_SCAN_CHUNK       = int(os.environ.get("VAULT_SCAN_CHUNK", "32"))
+VAULT_SCAN_MAX_PATTERN = int(os.environ.get("VAULT_SCAN_MAX_PATTERN", "256"))
+VAULT_SCAN_TIMEOUT     = float(os.environ.get("VAULT_SCAN_TIMEOUT", "10"))
+_scan_pool: Optional[ProcessPoolExecutor] = None
+
+# Threads used for bulk note reads/writes (bounded so a large import can't
+# flood a slow bind mount with thousands of concurrent opens)
+VAULT_IO_WORKERS = int(os.environ.get("VAULT_IO_WORKERS", "8"))
+_io_pool = ThreadPoolExecutor(max_workers=VAULT_IO_WORKERS,
+                              thread_name_prefix="vault-io")
+
+
+# ---------------------------------------------------------------------------
+# Parsed-note cache
+# ---------------------------------------------------------------------------
+
+class _NoteCache:
+    """
+    LRU cache of parsed notes keyed by resolved file path.
+
+    Entries are validated against the file's (mtime_ns, size) on every
+    lookup so edits made outside the service (e.g. in Obsidian itself)
+    are picked up.  The cache is bounded by the total size of the cached
+    text rather than by entry count, since note sizes vary wildly.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()   # key -> (sig, meta, body, content, cost)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str, sig: tuple[int, int]) -> Optional[tuple[dict, str, str]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] != sig:
+            # File changed underneath us — drop the stale entry
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1], entry[2], entry[3]
+
+    def put(self, key: str, sig: tuple[int, int], meta: dict, body: str,
+            content: str) -> None:
+        cost = len(content) + len(body)
+        self._drop(key)
+        if cost > self.max_bytes:
+            return
+        self._entries[key] = (sig, meta, body, content, cost)
+        self._bytes += cost
+        while self._bytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old[4]
+            self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        if key in self._entries:
+            self._drop(key)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[4]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_note_cache = _NoteCache(VAULT_CACHE_MAX_BYTES)
+
+
+# ---------------------------------------------------------------------------
+# Change listeners
+# ---------------------------------------------------------------------------
+
+# Indexes over the vault (link graph, ...) register here at startup.  Each
+# listener is called with a list of (vault_relative_path, note) tuples where
+# note is {"meta", "body"} or None for a deletion.  Listeners must be cheap
+# and synchronous; anything slow should be scheduled by the listener itself.
+_change_listeners: list = []
+
+
+def add_change_listener(fn):
+    if fn not in _change_listeners:
+        _change_listeners.append(fn)
+
+
+# When set (see deferred_notifications) changes are buffered here instead of
+# being delivered, so a bulk operation triggers a single index update.
+_deferred_changes: contextvars.ContextVar = contextvars.ContextVar(
+    "vault_deferred_changes", default=None)
+
+
+@contextmanager
+def deferred_notifications():
+    """Buffer change notifications made in this context and deliver them once on exit."""
+    buffer: list = []
+    token = _deferred_changes.set(buffer)
+    try:
+        yield
+    finally:
+        _deferred_changes.reset(token)
+        _notify_changes(buffer)
+
+
+def _notify_changes(changes: list[tuple[str, Optional[dict]]]) -> None:
+    if not changes:
+        return
+    deferred = _deferred_changes.get()
+    if deferred is not None:
+        deferred.extend(changes)
+        return
+    for fn in _change_listeners:
+        try:
+            fn(changes)
+        except Exception as e:
+            logger.warning(f"Vault change listener failed: {e}")
+
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -46,6 +204,11 @@ def _note_path(relative: str) -> Path:
     return resolved
 
 
+def _vault_relative(path: Path) -> str:
+    """Canonical vault-relative path (with .md) for a resolved note path."""
+    return path.relative_to(VAULT_ROOT.resolve()).as_posix()
+
+
 def _parse_frontmatter(content: str) -> tuple[dict, str]:
     """Split YAML front-matter from body. Returns (meta, body)."""
     meta: dict = {}
@@ -62,6 +225,43 @@ def _parse_frontmatter(content: str) -> tuple[dict, str]:
     return meta, body
 
 
+def _stat_sig(st) -> tuple[int, int]:
+    return st.st_mtime_ns, st.st_size
+
+
+async def _load_parsed(path: Path) -> tuple[dict, str, str]:
+    """Return (meta, body, content) for path, served from cache when fresh.
+
+    Raises FileNotFoundError if the note does not exist.
+    """
+    key = str(path)
+    sig = _stat_sig(await aiofiles.os.stat(path))
+    cached = _note_cache.get(key, sig)
+    if cached is not None:
+        return cached
+    async with aiofiles.open(path, "r", encoding="utf-8") as f:
+        content = await f.read()
+    meta, body = _parse_frontmatter(content)
+    # Re-stat after the read so a concurrent writer can't leave us caching
+    # old content under the new signature.
+    sig_after = _stat_sig(await aiofiles.os.stat(path))
+    if sig_after == sig:
+        _note_cache.put(key, sig, meta, body, content)
+    return meta, body, content
+
+
+def _stamp_meta(existing_meta: dict, meta: Optional[dict], now: str) -> dict:
+    merged_meta = {**existing_meta, **(meta or {})}
+    merged_meta["updated"] = now
+    if "created" not in merged_meta:
+        merged_meta["created"] = merged_meta["updated"]
+    return merged_meta
+
+
+def _now_stamp() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+
 def _build_frontmatter(meta: dict) -> str:
     if not meta:
         return ""
@@ -102,12 +302,10 @@ async def read_note(relative_path: str) -> Optional[dict]:
     """Read a note and return {path, meta, body, content}."""
     try:
         path = _note_path(relative_path)
-        async with aiofiles.open(path, "r", encoding="utf-8") as f:
-            content = await f.read()
-        meta, body = _parse_frontmatter(content)
+        meta, body, content = await _load_parsed(path)
         return {
             "path": relative_path,
-            "meta": meta,
+            "meta": dict(meta),
             "body": body,
             "content": content,
         }
@@ -130,27 +328,134 @@ async def write_note(
     # Merge existing meta if not overwriting
     existing_meta: dict = {}
     if path.exists() and not overwrite:
-        async with aiofiles.open(path, "r", encoding="utf-8") as f:
-            existing = await f.read()
-        existing_meta, _ = _parse_frontmatter(existing)
-
-    merged_meta = {**existing_meta, **(meta or {})}
-    merged_meta["updated"] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
-    if "created" not in merged_meta:
-        merged_meta["created"] = merged_meta["updated"]
+        existing_meta, _, _ = await _load_parsed(path)
 
+    merged_meta = _stamp_meta(existing_meta, meta, _now_stamp())
     content = _build_frontmatter(merged_meta) + body
 
     # Ensure parent directory exists
     await aiofiles.os.makedirs(str(path.parent), exist_ok=True)
 
+    _note_cache.invalidate(str(path))
     async with aiofiles.open(path, "w", encoding="utf-8") as f:
         await f.write(content)
 
+    # Prime the cache with what we just wrote; the next read is almost
+    # always ours (append_to_note, the UI refreshing the note, ...).
+    meta_out, body_out = _parse_frontmatter(content)
+    try:
+        sig = _stat_sig(await aiofiles.os.stat(path))
+        _note_cache.put(str(path), sig, meta_out, body_out, content)
+    except OSError:
+        pass
+    _notify_changes([(_vault_relative(path), {"meta": meta_out, "body": body_out})])
+
     logger.info(f"Wrote note: {relative_path}")
     return {"path": relative_path, "meta": merged_meta, "bytes": len(content)}
 
 
+def _read_meta_sync(path: Path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return _parse_frontmatter(f.read())[0]
+    except FileNotFoundError:
+        return {}
+
+
+def _write_file_sync(path: Path, content: str) -> tuple[int, int]:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return _stat_sig(os.stat(path))
+
+
+def _makedirs_sync(dirs: set) -> None:
+    for d in sorted(dirs, key=lambda p: len(p.parts)):
+        os.makedirs(d, exist_ok=True)
+
+
+async def write_notes(items: list[dict], overwrite: bool = True) -> dict:
+    """
+    Write many notes at once.
+
+    Each item is {"path", "body", "meta"} or {"path", "content"} (a full
+    Markdown file including front-matter).  Directories are created in one
+    pass, files are written in parallel on the bounded VAULT_IO_WORKERS
+    pool, and listeners get a single notification for the whole batch.
+    Returns {"written", "bytes", "errors": [{index, path, error}]}.
+    """
+    loop = asyncio.get_running_loop()
+    errors: list[dict] = []
+    prepared: dict[Path, tuple[int, str, dict, str]] = {}
+    for i, item in enumerate(items):
+        try:
+            path = _note_path(item["path"])
+            if "content" in item:
+                meta, body = _parse_frontmatter(item["content"])
+                meta.update(item.get("meta") or {})
+            else:
+                meta, body = dict(item.get("meta") or {}), item.get("body", "")
+            # Later items for the same path win
+            prepared[path] = (i, item["path"], meta, body)
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append({"index": i,
+                           "path": item.get("path") if isinstance(item, dict) else None,
+                           "error": str(e)})
+
+    paths = list(prepared)
+    existing: list[dict] = [{}] * len(paths)
+    if not overwrite:
+        existing = await asyncio.gather(*[
+            loop.run_in_executor(_io_pool, _read_meta_sync, p) for p in paths])
+
+    await loop.run_in_executor(_io_pool, _makedirs_sync, {p.parent for p in paths})
+
+    now = _now_stamp()
+    contents: list[str] = []
+    for path, old_meta in zip(paths, existing):
+        _, _, meta, body = prepared[path]
+        contents.append(_build_frontmatter(_stamp_meta(old_meta, meta, now)) + body)
+        _note_cache.invalidate(str(path))
+
+    results = await asyncio.gather(*[
+        loop.run_in_executor(_io_pool, _write_file_sync, p, c)
+        for p, c in zip(paths, contents)
+    ], return_exceptions=True)
+
+    changes: list[tuple[str, Optional[dict]]] = []
+    total = 0
+    for path, content, result in zip(paths, contents, results):
+        index, rel, _, _ = prepared[path]
+        if isinstance(result, Exception):
+            errors.append({"index": index, "path": rel, "error": str(result)})
+            continue
+        meta_out, body_out = _parse_frontmatter(content)
+        _note_cache.put(str(path), result, meta_out, body_out, content)
+        changes.append((_vault_relative(path), {"meta": meta_out, "body": body_out}))
+        total += len(content)
+    _notify_changes(changes)
+
+    logger.info(f"Bulk wrote {len(changes)} notes ({len(errors)} errors)")
+    return {"written": len(changes), "bytes": total, "errors": errors}
+
+
+def note_files(folder: str = "") -> list[tuple[str, Path]]:
+    """(vault-relative path, absolute path) for every note under folder."""
+    search_root = (VAULT_ROOT / folder).resolve() if folder else VAULT_ROOT.resolve()
+    if not str(search_root).startswith(str(VAULT_ROOT.resolve())):
+        raise ValueError(f"Path traversal attempt: {folder}")
+    return [(_vault_relative(p), p) for p in sorted(search_root.rglob("*.md"))]
+
+
+def read_files(paths: list[Path]) -> list[Optional[bytes]]:
+    """Read raw file bytes in parallel on the I/O pool (blocking; call from a thread)."""
+    def _read(p: Path) -> Optional[bytes]:
+        try:
+            return p.read_bytes()
+        except OSError:
+            return None
+    return list(_io_pool.map(_read, paths))
+
+
 async def append_to_note(relative_path: str, text: str) -> dict:
     """Append text to an existing note (creates it if absent)."""
     existing = await read_note(relative_path)
@@ -177,17 +482,182 @@ async def search_vault(query: str, folder: str = "") -> list[dict]:
     return results
 
 
+def compile_scan_pattern(query: str, regex: bool = False,
+                         ignore_case: bool = True) -> "re.Pattern[bytes]":
+    """Compile a scan_vault pattern. Raises re.error on a bad regex.
+
+    Patterns match raw UTF-8 bytes, so case folding only applies to ASCII.
+    Regexes longer than VAULT_SCAN_MAX_PATTERN, or with backreferences or
+    nested quantifiers such as (a+)+ (the usual catastrophic-backtracking
+    shapes), are rejected with re.error too.
+    """
+    if len(query) > VAULT_SCAN_MAX_PATTERN:
+        raise re.error(f"pattern longer than {VAULT_SCAN_MAX_PATTERN} characters")
+    if regex and _UNSAFE_REGEX.search(query):
+        raise re.error("backreferences and nested quantifiers are not allowed")
+    raw = query.encode("utf-8")
+    return re.compile(raw if regex else re.escape(raw),
+                      re.IGNORECASE if ignore_case else 0)
+
+
+# A quantified group ending in a quantifier, e.g. (a+)+ or (\w*x?)*, or a backreference
+_UNSAFE_REGEX = re.compile(r"[+*?}]\)[+*{?]|\\[1-9]|\(\?P=")
+
+
+def _scan_executor() -> ProcessPoolExecutor:
+    global _scan_pool
+    if _scan_pool is None:
+        # Not fork: this process has an event loop, the progress consumer
+        # thread and executor threads.  The forkserver preloads only this
+        # module (not app.py), and workers only run _scan_files
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload([__name__])
+        _scan_pool = ProcessPoolExecutor(max_workers=VAULT_SCAN_WORKERS, mp_context=ctx,
+                                         initializer=_init_scan_worker)
+    return _scan_pool
+
+
+def _retire_scan_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    Replace the scan pool after a timeout or breakage: queued jobs are
+    cancelled, running ones stop at their deadline alarm, and the next
+    scan gets a fresh pool.
+    """
+    global _scan_pool
+    if pool is _scan_pool:
+        _scan_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _ScanDeadline(Exception):
+    """Raised in a scan worker by SIGALRM when the scan's deadline passes."""
+
+
+def _deadline_alarm(signum, frame):
+    raise _ScanDeadline()
+
+
+def _init_scan_worker() -> None:
+    signal.signal(signal.SIGALRM, _deadline_alarm)
+
+
+def _scan_files(paths: list[Path], pattern: "re.Pattern[bytes]", max_hits: int,
+                deadline: float) -> list[dict]:
+    """
+    Search a chunk of files. Runs in a scan worker process; an alarm at
+    the deadline interrupts even a single long match (re checks signals).
+    """
+    hits: list[dict] = []
+    signal.setitimer(signal.ITIMER_REAL, max(0.001, deadline - time.time()))
+    try:
+        for path in paths:
+            if time.time() >= deadline:
+                break
+            hits += _scan_file(path, pattern, max_hits, deadline)
+    except _ScanDeadline:
+        pass
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return hits
+
+
+def _scan_file(path: Path, pattern: "re.Pattern[bytes]", max_hits: int,
+               deadline: float) -> list[dict]:
+    """Search one memory-mapped file."""
+    hits: list[dict] = []
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return hits
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for m in pattern.finditer(mm):
+                    if time.time() >= deadline:
+                        break
+                    start = max(0, m.start() - 80)
+                    end = min(len(mm), m.end() + 80)
+                    hits.append({
+                        "path": _vault_relative(path),
+                        "offset": m.start(),
+                        "match": m.group(0)[:200].decode("utf-8", errors="replace"),
+                        "snippet": "..." + mm[start:end].decode("utf-8", errors="replace") + "...",
+                    })
+                    if len(hits) >= max_hits:
+                        break
+    except (FileNotFoundError, PermissionError, ValueError) as e:
+        logger.debug(f"Scan skipped {path}: {e}")
+    return hits
+
+
+async def scan_vault(pattern: "re.Pattern[bytes]", folder: str = "",
+                     limit: int = 100, per_note: int = 5) -> AsyncIterator[dict]:
+    """
+    Raw scan of every note with a byte-level regex, yielding hits as they
+    are found.  Files are memory-mapped rather than loaded into Python
+    strings and searched in parallel by VAULT_SCAN_WORKERS processes, in
+    chunks of VAULT_SCAN_CHUNK files; the scan stops early once `limit`
+    hits have been produced (or the consumer goes away).  After
+    VAULT_SCAN_TIMEOUT seconds it ends with an {"error": ...} line and the
+    worker pool is replaced.
+    """
+    search_root = (VAULT_ROOT / folder).resolve() if folder else VAULT_ROOT.resolve()
+    if not str(search_root).startswith(str(VAULT_ROOT.resolve())):
+        raise ValueError(f"Path traversal attempt: {folder}")
+    loop = asyncio.get_running_loop()
+    paths = await loop.run_in_executor(
+        _io_pool, lambda: sorted(search_root.rglob("*.md")))
+    deadline = time.time() + VAULT_SCAN_TIMEOUT
+    pool = _scan_executor()
+    jobs = [pool.submit(_scan_files, paths[i:i + VAULT_SCAN_CHUNK], pattern, per_note, deadline)
+            for i in range(0, len(paths), VAULT_SCAN_CHUNK)]
+    waiting = [asyncio.wrap_future(j) for j in jobs]
+    produced = 0
+    try:
+        for fut in asyncio.as_completed(waiting, timeout=VAULT_SCAN_TIMEOUT):
+            try:
+                hits = await fut
+            except asyncio.CancelledError:
+                if pool is _scan_pool:
+                    raise
+                # Another scan timed out and retired the pool under us
+                yield {"error": "scan aborted (workers restarted)"}
+                return
+            for hit in hits:
+                yield hit
+                produced += 1
+                if produced >= limit:
+                    return
+    except asyncio.TimeoutError:
+        logger.warning(f"Vault scan for {pattern.pattern[:80]!r} timed out "
+                       f"after {VAULT_SCAN_TIMEOUT:g}s")
+        _retire_scan_pool(pool)
+        yield {"error": f"scan timed out after {VAULT_SCAN_TIMEOUT:g}s"}
+    except BrokenProcessPool:
+        _retire_scan_pool(pool)
+        yield {"error": "scan aborted (workers restarted)"}
+    finally:
+        # Cancels the jobs not started yet and drops the others' results
+        for fut in waiting:
+            fut.cancel()
+
+
 async def delete_note(relative_path: str) -> bool:
     """Delete a note. Returns True if deleted, False if not found."""
     try:
         path = _note_path(relative_path)
+        _note_cache.invalidate(str(path))
         path.unlink()
+        _notify_changes([(_vault_relative(path), None)])
         logger.info(f"Deleted note: {relative_path}")
         return True
     except FileNotFoundError:
         return False
 
 
+def cache_stats() -> dict:
+    """Return hit/miss/eviction counters for the parsed-note cache."""
+    return _note_cache.stats()
+
+
 async def log_agent_activity(agent_name: str, activity: str,
                                project: str = "General") -> None:
     """Append an agent activity entry to the project's activity log note."""
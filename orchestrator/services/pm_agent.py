@@ -9,62 +9,77 @@ The singleton "lead" agent.  It:
   - Broadcasts state changes via WebSocket for the office UI
 """
 
+import os
 import json
+import asyncio
 import logging
 import uuid
 from datetime import datetime, timezone
 from typing import Optional
 
-from . import llm_router, agent_manager, obsidian_service
+from . import llm_router, agent_manager, obsidian_service, vector_index, prompt_builder
 from .agent_manager import AgentRole, AgentStatus
 
 logger = logging.getLogger(__name__)
 
+# Token budget for vault passages handed to a sub-agent with its task (0 = off)
+VAULT_CONTEXT_TOKENS = int(os.environ.get("VAULT_CONTEXT_TOKENS", "500"))
+# Each past chat message is cut to this many tokens in the history section
+HISTORY_MESSAGE_TOKENS = int(os.environ.get("PM_HISTORY_MESSAGE_TOKENS", "300"))
+# Length cap for the 2-3 sentence summary of a sub-agent's result
+SUMMARY_MAX_TOKENS = int(os.environ.get("PM_SUMMARY_MAX_TOKENS", "300"))
+
 # ---------------------------------------------------------------------------
 # Chat history (in-memory; also persisted to vault and DB by callers)
 # ---------------------------------------------------------------------------
 
 _chat_history: list[dict] = []
 
-_DELEGATION_PROMPT = """
-You are the Project Manager AI. A user has sent you the following message:
-
-<message>
-{message}
-</message>
-
-Current active agents:
-{agents}
-
-Decide what to do:
+# Fixed instructions go in the system prompt (a cacheable prefix on
+# Claude); only the per-request parts are formatted into the user turn.
+_DELEGATION_INSTRUCTIONS = """
+For each user message, decide what to do:
 1. If you can answer directly, do so.
 2. If a task needs a specialist, respond with a JSON block ONLY (no extra text):
-{{
+{
   "action": "delegate",
   "role": "<role>",           // one of: researcher, coder, writer, analyst, reviewer, archivist
   "task": "<task description>",
   "prefer_remote_gpu": false  // set true for heavy compute tasks
-}}
+}
 3. To spawn a NEW agent first then delegate:
-{{
+{
   "action": "spawn_and_delegate",
   "role": "<role>",
   "agent_name": "<optional name>",
   "task": "<task description>",
   "prefer_remote_gpu": false
-}}
+}
 4. To report status to the user, respond normally (no JSON).
 
 Be concise. If delegating, only output the JSON block.
+""".strip()
+
+_DELEGATION_PROMPT = """
+A user has sent you the following message:
+
+<message>
+{message}
+</message>
+
+Current active agents:
+{agents}
 """
 
-_DIRECT_ANSWER_PROMPT = """
+_DIRECT_ANSWER_INSTRUCTIONS = """
 You are the Project Manager AI for a local AI agent system.
 Answer the user's message helpfully. You have:
 - Access to a team of specialised agents (researcher, coder, writer, analyst, reviewer, archivist)
 - An Obsidian knowledge vault
 - Both local GPU (Ollama/Llama) and Claude API for inference
+""".strip()
 
+_DIRECT_ANSWER_PROMPT = """
 User message: {message}
 
 Previous conversation context:
@@ -88,15 +103,46 @@ def _fmt_agents() -> str:
     return "\n".join(lines)
 
 
-def _fmt_history(limit: int = 6) -> str:
+def _fmt_history(max_tokens: int, model: str, limit: int = 6) -> str:
     recent = _chat_history[-limit:] if len(_chat_history) > limit else _chat_history
     lines = []
     for m in recent:
         role = "User" if m["role"] == "user" else "PM"
         lines.append(f"{role}: {m['content']}")
+    lines = prompt_builder.fit_messages(lines, max_tokens, model,
+                                        per_message=HISTORY_MESSAGE_TOKENS)
     return "\n".join(lines) if lines else "No previous messages."
 
 
+async def _budget(prompt: str, system: list[str], **route_args) -> tuple[str, int]:
+    """
+    (model, tokens) for a prompt: the model route() will send it to and
+    its input budget less the system layers, which are sent whole (they
+    are the cached prefix on Claude).
+    """
+    model = await llm_router.prompt_model(prompt, **route_args)
+    used = prompt_builder.count_tokens("\n\n".join(system), model)
+    return model, max(256, prompt_builder.input_budget(model) - used)
+
+
+def _fit(model: str, total: int, **sections) -> dict[str, str]:
+    """prompt_builder.fit() within total tokens: name=(text, strategy)."""
+    return prompt_builder.fit(sections, model, total)
+
+
+async def _vault_context(task_desc: str) -> str:
+    """Top vault passages related to task_desc, formatted for a prompt."""
+    if VAULT_CONTEXT_TOKENS <= 0:
+        return ""
+    try:
+        chunks = await vector_index.retrieve(task_desc, k=5,
+                                             token_budget=VAULT_CONTEXT_TOKENS)
+    except Exception as e:
+        logger.warning(f"Vault retrieval failed, running task without context: {e}")
+        return ""
+    return vector_index.format_context(chunks)
+
+
 def _parse_delegation(text: str) -> Optional[dict]:
     """Try to extract a JSON delegation block from LLM output."""
     text = text.strip()
@@ -122,10 +168,20 @@ async def handle_message(user_message: str) -> dict:
     """
     Process a user message.
     Returns {"reply": str, "agent_events": list}.
+
+    Cancelling it (client disconnect or an explicit cancel) aborts the
+    LLM calls in flight and puts the PM agent back to idle.
     """
     # Ensure PM agent exists in the registry
     pm = await agent_manager.ensure_pm_agent()
+    try:
+        return await _handle_message(pm, user_message)
+    except asyncio.CancelledError:
+        await agent_manager.update_agent_status(pm.id, AgentStatus.IDLE)
+        raise
+
 
+async def _handle_message(pm, user_message: str) -> dict:
     _chat_history.append({
         "id": str(uuid.uuid4()),
         "role": "user",
@@ -148,14 +204,27 @@ async def handle_message(user_message: str) -> dict:
 
     # --- Step 1: Ask PM LLM whether to delegate ---
     try:
+        routing_system = await agent_manager.system_layers(
+            AgentRole.PROJECT_MANAGER, _DELEGATION_INSTRUCTIONS)
+        model, total = await _budget(user_message, routing_system,
+                                     role=AgentRole.PROJECT_MANAGER.value,
+                                     task_type="delegation")
+        fitted = _fit(
+            model, total,
+            task=(user_message, "middle"),
+            context=(_fmt_agents(), "head"),
+        )
         routing_prompt = _DELEGATION_PROMPT.format(
-            message=user_message,
-            agents=_fmt_agents(),
+            message=fitted["task"],
+            agents=fitted["context"],
         )
         routing_resp = await llm_router.route(
             routing_prompt,
-            system=agent_manager.ROLE_SYSTEM_PROMPTS[AgentRole.PROJECT_MANAGER],
+            system=routing_system,
             force_claude=False,
+            hedge=True,
+            role=AgentRole.PROJECT_MANAGER.value,
+            task_type="delegation",
         )
         delegation = _parse_delegation(routing_resp.text)
     except Exception as e:
@@ -198,14 +267,34 @@ async def handle_message(user_message: str) -> dict:
         await agent_manager.assign_task(target_agent.id, task_desc)
         await agent_manager.update_agent_status(target_agent.id, AgentStatus.WORKING)
 
-        # Run the task
+        # Run the task, with related prior work from the vault
+        context = await _vault_context(task_desc)
+        task_system = await agent_manager.system_layers(target_agent.role)
+        model, total = await _budget(task_desc, task_system,
+                                     role=target_agent.role.value, agent=target_agent.name,
+                                     task_type="task", routing=target_agent.routing,
+                                     prefer_remote_gpu=target_agent.prefer_remote_gpu)
+        fitted = _fit(
+            model, total,
+            context=(context, "head"),
+            task=(task_desc, "middle"),
+        )
+        task_prompt = (f"{fitted['context']}\n\nTask:\n{fitted['task']}"
+                       if context else fitted["task"])
         try:
             task_resp = await llm_router.route(
-                task_desc,
-                system=target_agent.system_prompt,
+                task_prompt,
+                system=task_system,
                 prefer_remote_gpu=target_agent.prefer_remote_gpu,
+                role=target_agent.role.value,
+                agent=target_agent.name,
+                task_type="task",
+                routing=target_agent.routing,
             )
             task_result = task_resp.text
+        except asyncio.CancelledError:
+            await agent_manager.update_agent_status(target_agent.id, AgentStatus.IDLE)
+            raise
         except Exception as e:
             task_result = f"Error: {e}"
             await agent_manager.update_agent_status(target_agent.id, AgentStatus.ERROR)
@@ -217,15 +306,28 @@ async def handle_message(user_message: str) -> dict:
                               "result": task_result[:300]})
 
         # Summarise for user
+        # Long sub-agent output dominates prefill; keep its key sentences
+        pm_system = await agent_manager.system_layers(AgentRole.PROJECT_MANAGER)
+        model, total = await _budget(task_desc, pm_system,
+                                     role=AgentRole.PROJECT_MANAGER.value, task_type="summary")
+        fitted = _fit(
+            model, total,
+            task=(task_desc, "middle"),
+            context=(task_result, "extractive"),
+        )
         summary_prompt = (
-            f"A {role.value} agent completed this task: '{task_desc}'.\n"
-            f"Result:\n{task_result}\n\n"
+            f"A {role.value} agent completed this task: '{fitted['task']}'.\n"
+            f"Result:\n{fitted['context']}\n\n"
             f"Summarise the result for the user in 2-3 sentences."
         )
         try:
             summary_resp = await llm_router.route(
                 summary_prompt,
-                system=agent_manager.ROLE_SYSTEM_PROMPTS[AgentRole.PROJECT_MANAGER],
+                system=pm_system,
+                hedge=True,
+                role=AgentRole.PROJECT_MANAGER.value,
+                task_type="summary",
+                max_tokens=SUMMARY_MAX_TOKENS,
             )
             reply = summary_resp.text
         except Exception as e:
@@ -245,13 +347,26 @@ async def handle_message(user_message: str) -> dict:
     else:
         # Direct answer
         try:
+            direct_system = await agent_manager.system_layers(
+                AgentRole.PROJECT_MANAGER, _DIRECT_ANSWER_INSTRUCTIONS)
+            model, total = await _budget(user_message, direct_system,
+                                         role=AgentRole.PROJECT_MANAGER.value, task_type="chat")
+            budgets = prompt_builder.section_budgets(model, total, ("history", "task"))
+            history = _fmt_history(budgets["history"], model)
+            fitted = _fit(
+                model, total - prompt_builder.count_tokens(history, model),
+                task=(user_message, "middle"),
+            )
             direct_prompt = _DIRECT_ANSWER_PROMPT.format(
-                message=user_message,
-                history=_fmt_history(),
+                message=fitted["task"],
+                history=history,
             )
             resp = await llm_router.route(
                 direct_prompt,
-                system=agent_manager.ROLE_SYSTEM_PROMPTS[AgentRole.PROJECT_MANAGER],
+                system=direct_system,
+                hedge=True,
+                role=AgentRole.PROJECT_MANAGER.value,
+                task_type="chat",
             )
             reply = resp.text
         except Exception as e:
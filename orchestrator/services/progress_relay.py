@@ -0,0 +1,155 @@
+"""
+Task Progress Relay
+
+Forwards the workers' streaming progress events to the office UI.
+
+Workers publish throttled events ({task_id, seq, tokens, delta, elapsed},
+plus done/status on the last one) to the `task.progress` topic exchange.
+Each orchestrator binds its own exclusive, length- and TTL-bounded queue
+to it, so every replica sees every event and a stalled consumer only
+drops stale progress.  Events are coalesced per task and broadcast to
+/ws clients at most every PROGRESS_RELAY_INTERVAL as
+
+    {"event": "task_progress", "data": {"tasks": [...]}}
+
+where consecutive deltas for a task are concatenated.
+
+pika's BlockingConnection runs in its own thread; events are handed to
+the event loop with call_soon_threadsafe.
+"""
+
+import os
+import json
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+PROGRESS_EXCHANGE       = "task.progress"       # must match worker_agent/worker.py
+PROGRESS_RELAY_INTERVAL = float(os.environ.get("PROGRESS_RELAY_INTERVAL_MS", "250")) / 1000
+_QUEUE_ARGS = {
+    "x-max-length": 10000,
+    "x-overflow": "drop-head",
+    "x-message-ttl": 30000,
+}
+
+RABBITMQ_HOST = os.environ.get("RABBITMQ_HOST", "message_queue")
+RABBITMQ_USER = os.environ.get("RABBITMQ_USER", "guest")
+RABBITMQ_PASS = os.environ.get("RABBITMQ_PASS", "guest")
+
+_broadcast_fn = None
+_pending: dict = {}                 # task_id -> coalesced event
+_flush_handle: Optional[asyncio.TimerHandle] = None
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+_stats = {"received": 0, "broadcasts": 0, "connected": False}
+
+
+def set_broadcast(fn):
+    """Set the coroutine used to push a message to all /ws clients."""
+    global _broadcast_fn
+    _broadcast_fn = fn
+
+
+# ---------------------------------------------------------------------------
+# Coalescing (event loop side)
+# ---------------------------------------------------------------------------
+
+def _merge(event: dict) -> None:
+    task_id = event.get("task_id")
+    prev = _pending.get(task_id)
+    if prev is not None:
+        event = {**prev, **event, "delta": prev.get("delta", "") + event.get("delta", "")}
+    _pending[task_id] = event
+
+
+def _on_event(body: bytes) -> None:
+    global _flush_handle
+    try:
+        event = json.loads(body)
+    except ValueError:
+        return
+    if not isinstance(event, dict) or "task_id" not in event:
+        return
+    _stats["received"] += 1
+    _merge(event)
+    if _flush_handle is None:
+        _flush_handle = asyncio.get_running_loop().call_later(
+            PROGRESS_RELAY_INTERVAL, lambda: asyncio.ensure_future(_flush()))
+
+
+async def _flush() -> None:
+    global _flush_handle, _pending
+    _flush_handle = None
+    batch, _pending = _pending, {}
+    if batch and _broadcast_fn is not None:
+        _stats["broadcasts"] += 1
+        try:
+            await _broadcast_fn({"event": "task_progress",
+                                 "data": {"tasks": list(batch.values())}})
+        except Exception as e:
+            logger.debug(f"Progress broadcast failed: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Consumer thread
+# ---------------------------------------------------------------------------
+
+def _consume(loop: asyncio.AbstractEventLoop) -> None:
+    while not _stop.is_set():
+        connection = None
+        try:
+            connection = pika.BlockingConnection(pika.ConnectionParameters(
+                host=RABBITMQ_HOST,
+                credentials=pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS),
+            ))
+            channel = connection.channel()
+            channel.exchange_declare(PROGRESS_EXCHANGE, exchange_type="topic", durable=True)
+            queue = channel.queue_declare("", exclusive=True, auto_delete=True,
+                                          arguments=_QUEUE_ARGS).method.queue
+            channel.queue_bind(queue, PROGRESS_EXCHANGE, routing_key="task.#")
+            _stats["connected"] = True
+            logger.info("Progress relay consuming task.progress")
+            for _method, _props, body in channel.consume(queue, auto_ack=True,
+                                                         inactivity_timeout=1):
+                if _stop.is_set():
+                    break
+                if body is not None:
+                    loop.call_soon_threadsafe(_on_event, body)
+        except Exception as e:
+            logger.warning(f"Progress relay connection failed: {e}. Retrying in 5 seconds")
+            _stop.wait(5)
+        finally:
+            _stats["connected"] = False
+            try:
+                if connection is not None and connection.is_open:
+                    connection.close()
+            except Exception:
+                pass
+
+
+def start() -> None:
+    """Start relaying on the running event loop."""
+    global _thread
+    if _thread is None:
+        _stop.clear()
+        _thread = threading.Thread(target=_consume, args=(asyncio.get_running_loop(),),
+                                   name="progress-relay", daemon=True)
+        _thread.start()
+
+
+def stop() -> None:
+    global _thread
+    _stop.set()
+    _thread = None
+
+
+def stats() -> dict:
+    return dict(_stats)
@@ -0,0 +1,328 @@
+"""
+Prompt Builder
+
+Token-budgeted prompt assembly, so prompts stop growing with whatever
+history or sub-agent output happens to be around (prefill time grows
+with every token).
+
+  - Counting: a real tokenizer where one is available, else a ~4 chars
+    per token estimate.  tiktoken gives cl100k counts, used for Claude
+    models (a close proxy; Anthropic ships no local tokenizer).  Ollama
+    models use the Hugging Face tokenizer.json in PROMPT_TOKENIZER_DIR
+    named after the model family (llama3.2 falls back to llama3.json).
+    The image ships cl100k, llama3.json and qwen2.5.json (see the
+    Dockerfile); other families, or a run without tiktoken / tokenizers
+    installed, get the estimate.
+  - Context windows: CONTEXT_WINDOWS by model family, overridable with
+    MODEL_CONTEXT_WINDOWS="llama3:8192,mistral:32768".  OUTPUT_RESERVE
+    tokens are kept free for the answer; PROMPT_MAX_TOKENS caps the input
+    below the window.
+  - Sections: system / history / context / task, each with a share of
+    the input budget (PROMPT_BUDGETS).  Budget a section does not use is
+    handed to the sections that need more.
+  - Truncation strategies: head (keep the start), tail (keep the end),
+    middle (keep both ends) and extractive (keep the highest-scoring
+    sentences, in their original order).
+"""
+
+import os
+import re
+import math
+import heapq
+import logging
+from pathlib import Path
+from collections import Counter
+from typing import Optional
+
+try:
+    import tiktoken
+except ImportError:         # installed in the image; estimates are used without it
+    tiktoken = None
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:         # installed in the image; estimates are used without it
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+TOKENIZER_DIR     = Path(os.environ.get("PROMPT_TOKENIZER_DIR", "/app/tokenizers"))
+OUTPUT_RESERVE    = int(os.environ.get("PROMPT_OUTPUT_RESERVE", "1024"))
+PROMPT_MAX_TOKENS = int(os.environ.get("PROMPT_MAX_TOKENS", "6000"))    # 0 = whole window
+
+# Context window per model family (the part of the name before ":")
+CONTEXT_WINDOWS = {
+    "llama3": 8192,
+    "llama3.1": 131072,
+    "llama3.2": 131072,
+    "llama3.3": 131072,
+    "mistral": 32768,
+    "mixtral": 32768,
+    "qwen2.5": 32768,
+    "gemma2": 8192,
+    "phi3": 4096,
+    "claude": 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+SECTIONS = ("system", "history", "context", "task")
+DEFAULT_BUDGETS = {"system": 0.15, "history": 0.20, "context": 0.25, "task": 0.40}
+STRATEGIES = ("head", "tail", "middle", "extractive")
+
+
+def _parse_pairs(spec: str, cast) -> dict:
+    pairs = {}
+    for item in spec.split(","):
+        name, sep, value = item.strip().partition(":")
+        if sep and name.strip():
+            try:
+                pairs[name.strip()] = cast(value)
+            except ValueError:
+                logger.warning(f"Ignoring bad setting {item!r}")
+    return pairs
+
+
+CONTEXT_WINDOWS.update(_parse_pairs(os.environ.get("MODEL_CONTEXT_WINDOWS", ""), int))
+BUDGETS = {**DEFAULT_BUDGETS, **_parse_pairs(os.environ.get("PROMPT_BUDGETS", ""), float)}
+
+
+# ---------------------------------------------------------------------------
+# Tokenizers
+# ---------------------------------------------------------------------------
+
+def _family(model: str) -> str:
+    name = model.split("/")[-1].split(":")[0].lower()
+    return "claude" if name.startswith("claude") else name
+
+
+class _Estimate:
+    """~4 characters per token; truncation slices characters."""
+
+    name = "estimate"
+
+    def count(self, text: str) -> int:
+        return math.ceil(len(text) / 4)
+
+    def head(self, text: str, tokens: int) -> str:
+        return text[:tokens * 4]
+
+    def tail(self, text: str, tokens: int) -> str:
+        return text[-tokens * 4:] if tokens > 0 else ""
+
+
+class _Encoded:
+    """Any tokenizer with encode(text) -> ids and decode(ids) -> text."""
+
+    def __init__(self, name: str, encode, decode):
+        self.name = name
+        self._encode = encode
+        self._decode = decode
+
+    def count(self, text: str) -> int:
+        return len(self._encode(text))
+
+    def head(self, text: str, tokens: int) -> str:
+        return self._decode(self._encode(text)[:tokens])
+
+    def tail(self, text: str, tokens: int) -> str:
+        return self._decode(self._encode(text)[-tokens:]) if tokens > 0 else ""
+
+
+_ESTIMATE = _Estimate()
+_tokenizers: dict = {}
+
+
+def _tokenizer_file(family: str) -> Optional[Path]:
+    """<family>.json, else the base family's (llama3.1 -> llama3.json)."""
+    for name in dict.fromkeys((family, family.split(".")[0])):
+        path = TOKENIZER_DIR / f"{name}.json"
+        if path.exists():
+            return path
+    return None
+
+
+def _load_tokenizer(family: str):
+    path = _tokenizer_file(family)
+    if Tokenizer is not None and path is not None:
+        tok = Tokenizer.from_file(str(path))
+        return _Encoded(f"hf:{path.name}", lambda t: tok.encode(t, add_special_tokens=False).ids,
+                        tok.decode)
+    if tiktoken is not None and family == "claude":
+        enc = tiktoken.get_encoding("cl100k_base")
+        return _Encoded("tiktoken:cl100k_base", lambda t: enc.encode(t, disallowed_special=()),
+                        enc.decode)
+    return _ESTIMATE
+
+
+def tokenizer(model: str):
+    """Tokenizer for model: real if available, else the estimate (cached)."""
+    family = _family(model)
+    tok = _tokenizers.get(family)
+    if tok is None:
+        try:
+            tok = _load_tokenizer(family)
+        except Exception as e:
+            logger.warning(f"Tokenizer for {family} unavailable, estimating: {e}")
+            tok = _ESTIMATE
+        _tokenizers[family] = tok
+    return tok
+
+
+def count_tokens(text: str, model: str) -> int:
+    return tokenizer(model).count(text) if text else 0
+
+
+def context_window(model: str) -> int:
+    family = _family(model)
+    for name in (model, family):
+        if name in CONTEXT_WINDOWS:
+            return CONTEXT_WINDOWS[name]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def input_budget(model: str) -> int:
+    """Tokens available for the prompt (window minus output reserve, capped)."""
+    budget = max(256, context_window(model) - OUTPUT_RESERVE)
+    return min(budget, PROMPT_MAX_TOKENS) if PROMPT_MAX_TOKENS > 0 else budget
+
+
+# ---------------------------------------------------------------------------
+# Truncation
+# ---------------------------------------------------------------------------
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_MAX_SENTENCES = 2000
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or "
+    "that the this to was were will with you your we our they their i".split())
+
+
+def _extractive(text: str, tokens: int, tok) -> str:
+    """
+    Greedy extractive summary: repeatedly take the sentence whose not yet
+    covered content words are most frequent in the text, until the budget
+    is spent; emit the chosen sentences in their original order.
+    """
+    sentences = [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()][:_MAX_SENTENCES]
+    words = [set(w for w in _WORD_RE.findall(s.lower()) if w not in _STOPWORDS) for s in sentences]
+    freq = Counter(w for ws in words for w in ws)
+    costs = [tok.count(s) + 1 for s in sentences]
+    covered: set = set()
+
+    def gain(i: int) -> float:
+        score = sum(freq[w] for w in words[i] - covered) / math.sqrt(len(words[i]) + 1)
+        return score * 1.5 if i < 2 else score     # openings usually state the result
+
+    # Lazy greedy: gains only shrink as words get covered, so a popped
+    # sentence whose recomputed gain still tops the heap is the best pick
+    heap = [(-gain(i), i) for i in range(len(sentences))]
+    heapq.heapify(heap)
+    chosen, used = [], 0
+    while heap:
+        _, i = heapq.heappop(heap)
+        current = gain(i)
+        if current <= 0:
+            continue
+        if heap and current < -heap[0][0]:
+            heapq.heappush(heap, (-current, i))
+            continue
+        if used + costs[i] > tokens:
+            continue
+        chosen.append(i)
+        used += costs[i]
+        covered |= words[i]
+    if not chosen:
+        return tok.head(text, tokens)
+    chosen.sort()
+    parts = [sentences[chosen[0]]]
+    for prev, i in zip(chosen, chosen[1:]):
+        parts.append((" " if i == prev + 1 else " … ") + sentences[i])
+    return "".join(parts)
+
+
+def truncate(text: str, max_tokens: int, model: str, strategy: str = "tail") -> str:
+    """Shorten text to at most max_tokens (for model) with the given strategy."""
+    tok = tokenizer(model)
+    if max_tokens <= 0:
+        return ""
+    if tok.count(text) <= max_tokens:
+        return text
+    if strategy == "head":
+        return tok.head(text, max_tokens)
+    if strategy == "tail":
+        return tok.tail(text, max_tokens)
+    if strategy == "middle":
+        marker = "\n[…]\n"
+        keep = max(0, max_tokens - tok.count(marker))
+        return tok.head(text, keep - keep // 2) + marker + tok.tail(text, keep // 2)
+    if strategy == "extractive":
+        return _extractive(text, max_tokens, tok)
+    raise ValueError(f"Unknown truncation strategy: {strategy}")
+
+
+# ---------------------------------------------------------------------------
+# Sections
+# ---------------------------------------------------------------------------
+
+def section_budgets(model: str, total: Optional[int] = None,
+                    sections: tuple = SECTIONS) -> dict[str, int]:
+    """Token budget per section: BUDGETS shares of the input budget among sections."""
+    total = total if total is not None else input_budget(model)
+    weight = sum(BUDGETS.get(s, 0.0) for s in sections) or 1.0
+    return {s: int(total * BUDGETS.get(s, 0.0) / weight) for s in sections}
+
+
+def fit(sections: dict, model: str, total: Optional[int] = None) -> dict[str, str]:
+    """
+    Fit sections into total tokens (default: the input budget).
+
+    sections maps a section name (system / history / context / task) to
+    (text, strategy); total is shared among the sections given, in their
+    BUDGETS proportions.  Sections within their budget are kept whole;
+    what they leave unused goes to the over-budget ones in proportion to
+    their budgets.  Returns {name: text}.
+    """
+    budgets = section_budgets(model, total, tuple(sections))
+    sizes = {name: count_tokens(text, model) for name, (text, _) in sections.items()}
+    spare = sum(max(0, budgets.get(n, 0) - sizes[n]) for n in sections)
+    over = {n: budgets.get(n, 0) for n in sections if sizes[n] > budgets.get(n, 0)}
+    over_weight = sum(over.values()) or 1
+    out = {}
+    for name, (text, strategy) in sections.items():
+        if name not in over:
+            out[name] = text
+            continue
+        allowed = over[name] + spare * over[name] // over_weight
+        out[name] = truncate(text, allowed, model, strategy)
+        logger.debug(f"Prompt section {name}: {sizes[name]} -> {allowed} tokens ({strategy})")
+    return out
+
+
+def fit_messages(messages: list[str], max_tokens: int, model: str,
+                 per_message: Optional[int] = None) -> list[str]:
+    """Most recent messages (each cut to per_message tokens) that fit, oldest first."""
+    kept, used = [], 0
+    for message in reversed(messages):
+        if per_message:
+            message = truncate(message, per_message, model, "head")
+        cost = count_tokens(message, model) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(message)
+        used += cost
+    return kept[::-1]
+
+
+def describe(model: str) -> dict:
+    """Tokenizer, window and section budgets in use for model."""
+    return {
+        "model": model,
+        "tokenizer": tokenizer(model).name,
+        "context_window": context_window(model),
+        "input_budget": input_budget(model),
+        "sections": section_budgets(model),
+    }
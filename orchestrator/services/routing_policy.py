@@ -0,0 +1,237 @@
+"""
+Routing Policy
+
+Declarative per-role / per-task-type / per-agent routing rules for the
+LLM router, e.g. "PM and Reviewer prefer Claude, Archivist always local,
+summaries go to a small fast model".
+
+The policy is JSON with four tables of rules:
+
+  {
+    "default":    {...},
+    "roles":      {"project_manager": {...}, "archivist": {...}},
+    "task_types": {"summary": {...}},
+    "agents":     {"Coder 1": {...}}          (agent names)
+  }
+
+A rule may set:
+
+  backends     fallback chain, tried in order: "claude", "local",
+               "remote", or "ollama" (the Ollama backends in the router's
+               usual order: model already loaded, prefer_remote_gpu, ...).
+               Unset = complexity routing (HIGH -> claude, ollama).
+  model        Ollama model (default: chosen from model_catalog)
+  model_tier   complexity tier ("low", "med", "high") the Ollama model is
+               chosen for, instead of the request's own tier
+  claude_model Claude model (default CLAUDE_MODEL)
+  max_tokens   answer length cap when the caller gives none
+  latency_slo  seconds; backends whose recent p95 total latency is over
+               it are tried last, and slower answers are counted as misses
+  hedge        hedge Ollama calls when the caller passes no hedge=
+               (see llm_router.route)
+
+Rules are merged field by field: default, then role, then task type,
+then agent, then per-call overrides (an agent's own routing, set at
+spawn).  The file (ROUTING_POLICY_PATH) replaces DEFAULT_POLICY and is
+reloaded when it changes; a file that fails validation is logged and the
+previous policy stays in force.  Each load compiles the tables into a
+memoised decision function, so route() pays a dict lookup per call.
+"""
+
+import os
+import json
+import logging
+import functools
+from pathlib import Path
+from dataclasses import dataclass, replace
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+POLICY_PATH = Path(os.environ.get(
+    "ROUTING_POLICY_PATH",
+    str(Path(os.environ.get("VAULT_MOUNT", "/vault")) / ".agent-routing" / "policy.json")))
+
+BACKENDS = ("claude", "local", "remote", "ollama")
+TABLES = ("roles", "task_types", "agents")
+
+MODEL_TIERS = ("low", "med", "high")
+
+# Built-in default: no rules, so complexity routing (complexity_scorer) and
+# hedging apply unchanged.  Role rules such as the spec's "PM / Reviewer on
+# Claude, Archivist local" are opt-in: config/routing_policy.example.json
+DEFAULT_POLICY = {"default": {}, "roles": {}, "task_types": {}, "agents": {}}
+
+
+@dataclass(frozen=True)
+class Policy:
+    backends: tuple = ()
+    model: Optional[str] = None
+    model_tier: Optional[str] = None
+    claude_model: Optional[str] = None
+    max_tokens: Optional[int] = None
+    latency_slo: Optional[float] = None
+    hedge: Optional[bool] = None
+    matched: tuple = ()          # entries that applied, e.g. ("role:archivist",)
+
+    def to_dict(self) -> dict:
+        return {
+            "backends": list(self.backends),
+            "model": self.model,
+            "model_tier": self.model_tier,
+            "claude_model": self.claude_model,
+            "max_tokens": self.max_tokens,
+            "latency_slo": self.latency_slo,
+            "hedge": self.hedge,
+            "matched": list(self.matched),
+        }
+
+
+# ---------------------------------------------------------------------------
+# Validation / compilation
+# ---------------------------------------------------------------------------
+
+def _positive(cast):
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"expected a positive number, got {value!r}")
+        return cast(value)
+    return check
+
+
+def _name(value):
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"expected a model name, got {value!r}")
+    return value
+
+
+def _tier(value):
+    if value not in MODEL_TIERS:
+        raise ValueError(f"expected one of {', '.join(MODEL_TIERS)}, got {value!r}")
+    return value
+
+
+def _flag(value):
+    if not isinstance(value, bool):
+        raise ValueError(f"expected true or false, got {value!r}")
+    return value
+
+
+def _chain(value):
+    if not isinstance(value, list) or not value:
+        raise ValueError(f"expected a non-empty list of backends, got {value!r}")
+    unknown = [b for b in value if b not in BACKENDS]
+    if unknown:
+        raise ValueError(f"unknown backend(s) {unknown}; use {', '.join(BACKENDS)}")
+    return tuple(dict.fromkeys(value))
+
+
+_FIELDS = {
+    "backends": _chain,
+    "model": _name,
+    "model_tier": _tier,
+    "claude_model": _name,
+    "max_tokens": _positive(int),
+    "latency_slo": _positive(float),
+    "hedge": _flag,
+}
+
+
+def validate_rule(rule: dict, where: str = "rule") -> dict:
+    """Normalised copy of rule; raises ValueError on unknown fields or bad values."""
+    if not isinstance(rule, dict):
+        raise ValueError(f"{where}: expected an object")
+    out = {}
+    for key, value in rule.items():
+        if key not in _FIELDS:
+            raise ValueError(f"{where}: unknown field {key!r}")
+        try:
+            out[key] = _FIELDS[key](value)
+        except ValueError as e:
+            raise ValueError(f"{where}.{key}: {e}") from None
+    return out
+
+
+def compile_policy(raw: dict) -> Callable[..., Policy]:
+    """Validate a policy document and return decide(role, agent, task_type) -> Policy."""
+    if not isinstance(raw, dict):
+        raise ValueError("policy: expected an object")
+    unknown = set(raw) - {"default", *TABLES}
+    if unknown:
+        raise ValueError(f"policy: unknown section(s) {sorted(unknown)}")
+    default = validate_rule(raw.get("default", {}), "default")
+    tables = {}
+    for table in TABLES:
+        entries = raw.get(table, {})
+        if not isinstance(entries, dict):
+            raise ValueError(f"{table}: expected an object")
+        tables[table] = {key: validate_rule(rule, f"{table}.{key}") for key, rule in entries.items()}
+    roles, task_types, agents = (tables[t] for t in TABLES)
+
+    @functools.lru_cache(maxsize=1024)
+    def decide(role: Optional[str], agent: Optional[str], task_type: Optional[str]) -> Policy:
+        fields, matched = dict(default), []
+        for label, table, key in (("role", roles, role), ("task_type", task_types, task_type),
+                                  ("agent", agents, agent)):
+            rule = table.get(key) if key else None
+            if rule:
+                fields.update(rule)
+                matched.append(f"{label}:{key}")
+        return Policy(**fields, matched=tuple(matched))
+
+    return decide
+
+
+# ---------------------------------------------------------------------------
+# Loading (hot reload)
+# ---------------------------------------------------------------------------
+
+_default_decide = compile_policy(DEFAULT_POLICY)
+_state = {"decide": _default_decide, "raw": DEFAULT_POLICY, "source": "default",
+          "mtime": None, "error": None}
+
+
+def _current() -> Callable[..., Policy]:
+    """Decision function for the policy file if present (reloaded on change), else the default."""
+    try:
+        mtime = POLICY_PATH.stat().st_mtime
+    except OSError:
+        if _state["source"] != "default":
+            logger.info(f"{POLICY_PATH} removed, using the default routing policy")
+            _state.update(decide=_default_decide, raw=DEFAULT_POLICY, source="default",
+                          mtime=None, error=None)
+        return _state["decide"]
+    if mtime != _state["mtime"]:
+        _state["mtime"] = mtime
+        try:
+            raw = json.loads(POLICY_PATH.read_text())
+            _state.update(decide=compile_policy(raw), raw=raw, source=str(POLICY_PATH), error=None)
+            logger.info(f"Loaded routing policy from {POLICY_PATH}")
+        except (OSError, ValueError) as e:
+            # json.JSONDecodeError is a ValueError too
+            _state["error"] = str(e)
+            logger.warning(f"Ignoring invalid routing policy {POLICY_PATH}, "
+                           f"keeping the previous one: {e}")
+    return _state["decide"]
+
+
+def resolve(role: Optional[str] = None, agent: Optional[str] = None,
+            task_type: Optional[str] = None, overrides: Optional[dict] = None) -> Policy:
+    """Effective rule for one request; overrides (already validated) apply last."""
+    policy = _current()(role, agent, task_type)
+    if overrides:
+        policy = replace(policy, **overrides, matched=policy.matched + ("call",))
+    return policy
+
+
+def status() -> dict:
+    _current()
+    return {
+        "path": str(POLICY_PATH),
+        "source": _state["source"],
+        "error": _state["error"],
+        "policy": _state["raw"],
+    }
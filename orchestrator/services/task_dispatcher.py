@@ -0,0 +1,396 @@
+"""
+Task Dispatcher
+
+Moves tasks from the `tasks` table onto the worker fleet's RabbitMQ
+work queues.
+
+  - Claims `pending` tasks in batches with SELECT ... FOR UPDATE SKIP
+    LOCKED, so several orchestrator replicas can dispatch concurrently
+    without handing out the same task twice.
+  - Highest `priority` first (oldest first within a priority); a task is
+    only claimed once every task id in its `dependencies` exists and is
+    completed.  A pending task whose dependency failed is failed too
+    (metadata.error names the dependency), which cascades down the chain;
+    tasks waiting on ids that do not exist stay pending and are counted
+    in status().
+  - Claimed tasks become `dispatched` with a lease (TASK_LEASE_SECONDS);
+    a task whose lease runs out without a result can be reclaimed.
+  - Publishes to the `tasks` direct exchange with publisher confirms and
+    mandatory routing.  A task the broker did not confirm is released
+    back to `pending` straight away.
+  - Routing key: metadata.capability if set, else "default" — the same
+    shared queues the workers consume (see worker_agent/worker.py).
+
+pika's BlockingConnection is not thread-safe, so every broker and
+database call runs on one dedicated dispatcher thread.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import pika
+from prometheus_client import Counter
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+DISPATCH_ENABLED   = os.environ.get("TASK_DISPATCH", "on").lower() not in ("off", "0", "false")
+DISPATCH_INTERVAL  = float(os.environ.get("TASK_DISPATCH_INTERVAL", "2"))
+DISPATCH_BATCH     = int(os.environ.get("TASK_DISPATCH_BATCH", "50"))
+TASK_LEASE_SECONDS = int(os.environ.get("TASK_LEASE_SECONDS", "900"))
+
+RABBITMQ_HOST = os.environ.get("RABBITMQ_HOST", "message_queue")
+RABBITMQ_USER = os.environ.get("RABBITMQ_USER", "guest")
+RABBITMQ_PASS = os.environ.get("RABBITMQ_PASS", "guest")
+
+# Shared work-queue topology — must match worker_agent/worker.py
+TASK_EXCHANGE        = "tasks"
+DEAD_LETTER_EXCHANGE = "tasks.dlx"
+DEFAULT_ROUTING_KEY  = "default"
+MAX_PRIORITY         = 10
+TASK_QUEUE_ARGS = {
+    "x-dead-letter-exchange": DEAD_LETTER_EXCHANGE,
+    "x-max-priority": MAX_PRIORITY,
+}
+
+TASKS_DISPATCHED = Counter("tasks_dispatched_total", "Tasks published to the worker queues")
+DISPATCH_FAILURES = Counter("task_dispatch_failures_total",
+                            "Tasks the broker did not confirm (released to pending)")
+
+
+# ---------------------------------------------------------------------------
+# SQL
+# ---------------------------------------------------------------------------
+
+# A task's dependency ids, whatever shape the column holds
+_DEPENDENCIES = """jsonb_array_elements_text(
+                   CASE WHEN jsonb_typeof(t.dependencies) = 'array'
+                        THEN t.dependencies ELSE '[]'::jsonb END) AS dep(id)"""
+
+_CLAIM_SQL = """
+WITH ready AS (
+    SELECT t.id
+    FROM tasks t
+    WHERE t.status = 'pending'
+      AND NOT EXISTS (
+          SELECT 1
+          FROM """ + _DEPENDENCIES + """
+          LEFT JOIN tasks d ON d.id::text = dep.id
+          WHERE d.id IS NULL OR d.status <> 'completed'
+      )
+    ORDER BY t.priority DESC NULLS LAST, t.created_at, t.id
+    LIMIT %s
+    FOR UPDATE OF t SKIP LOCKED
+)
+UPDATE tasks
+SET status = 'dispatched',
+    dispatched_at = NOW(),
+    lease_expires_at = NOW() + make_interval(secs => %s),
+    dispatch_count = tasks.dispatch_count + 1
+FROM ready
+WHERE tasks.id = ready.id
+RETURNING tasks.id, tasks.project_id, tasks.description, tasks.priority,
+          tasks.metadata->>'capability', tasks.dispatch_count, tasks.metadata->>'type',
+          tasks.metadata->>'model'
+"""
+
+_FAIL_BLOCKED_SQL = """
+UPDATE tasks
+SET status = 'failed',
+    metadata = COALESCE(tasks.metadata, '{}'::jsonb) || jsonb_build_object(
+        'error', 'dependency ' || blocked.dep_id || ' failed',
+        'failed_dependency', blocked.dep_id::int
+    )
+FROM (
+    SELECT DISTINCT ON (t.id) t.id, d.id AS dep_id
+    FROM tasks t
+    CROSS JOIN LATERAL """ + _DEPENDENCIES + """
+    JOIN tasks d ON d.id::text = dep.id
+    WHERE t.status = 'pending' AND d.status = 'failed'
+    ORDER BY t.id, d.id
+) AS blocked
+WHERE tasks.id = blocked.id AND tasks.status = 'pending'
+RETURNING tasks.id
+"""
+
+_MISSING_DEPENDENCIES_SQL = """
+SELECT COUNT(*)
+FROM tasks t
+WHERE t.status = 'pending'
+  AND EXISTS (
+      SELECT 1
+      FROM """ + _DEPENDENCIES + """
+      LEFT JOIN tasks d ON d.id::text = dep.id
+      WHERE d.id IS NULL
+  )
+"""
+
+_RELEASE_SQL = """
+UPDATE tasks
+SET status = 'pending', dispatched_at = NULL, lease_expires_at = NULL
+WHERE id = ANY(%s) AND status = 'dispatched'
+"""
+
+_LEASE_SUMMARY_SQL = """
+SELECT status,
+       COUNT(*),
+       COUNT(*) FILTER (WHERE lease_expires_at < NOW()),
+       MIN(lease_expires_at)
+FROM tasks
+WHERE status IN ('dispatched', 'processing')
+GROUP BY status
+"""
+
+
+def _claim(limit: int) -> list[tuple]:
+    with db.transaction() as cur:
+        cur.execute(_CLAIM_SQL, (limit, TASK_LEASE_SECONDS))
+        return cur.fetchall()
+
+
+def _fail_blocked() -> int:
+    """Fail pending tasks whose dependency failed; returns how many."""
+    with db.transaction() as cur:
+        cur.execute(_FAIL_BLOCKED_SQL)
+        return len(cur.fetchall())
+
+
+def _release(task_ids: list[int]) -> None:
+    if task_ids:
+        with db.transaction() as cur:
+            cur.execute(_RELEASE_SQL, (task_ids,))
+
+
+# ---------------------------------------------------------------------------
+# Publishing
+# ---------------------------------------------------------------------------
+
+def task_message(task_id: int, project_id: Optional[int], description: str,
+                 priority: Optional[int], capability: Optional[str],
+                 dispatch: int, task_type: Optional[str] = None,
+                 model: Optional[str] = None) -> tuple[str, bytes, int]:
+    """Return (routing key, body, AMQP priority) for a claimed task.
+
+    dispatch (the task's dispatch_count) lets workers recognise and drop
+    deliveries left over from an earlier dispatch of a reclaimed task.
+    task_type (metadata.type) selects the worker's handler, e.g. "embed".
+    model (metadata.model) overrides the worker's WORKER_MODEL for the task.
+    """
+    routing_key = capability or DEFAULT_ROUTING_KEY
+    body = json.dumps({
+        "task_id": task_id,
+        "project_id": project_id,
+        "description": description,
+        "priority": priority,
+        "capability": routing_key,
+        "dispatch": dispatch,
+        "type": task_type or "generate",
+        "model": model,
+    }).encode()
+    return routing_key, body, max(0, min(MAX_PRIORITY, priority or 0))
+
+
+class _Publisher:
+    """Confirming pika channel plus the shared queues declared so far."""
+
+    def __init__(self):
+        self._connection = None
+        self._channel = None
+        self._declared: set[str] = set()
+
+    def _ensure(self):
+        if self._channel is not None and self._channel.is_open:
+            return self._channel
+        self.close()
+        self._connection = pika.BlockingConnection(pika.ConnectionParameters(
+            host=RABBITMQ_HOST,
+            credentials=pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS),
+        ))
+        channel = self._connection.channel()
+        channel.confirm_delivery()
+        channel.exchange_declare(TASK_EXCHANGE, exchange_type="direct", durable=True)
+        self._channel = channel
+        self._declared.clear()
+        return channel
+
+    def _declare_queue(self, channel, routing_key: str) -> None:
+        # Declared here as well as by workers so a task for a capability no
+        # worker has come up for yet waits in its queue instead of being lost.
+        if routing_key not in self._declared:
+            queue = f"tasks.{routing_key}"
+            channel.queue_declare(queue, durable=True, arguments=TASK_QUEUE_ARGS)
+            channel.queue_bind(queue, TASK_EXCHANGE, routing_key=routing_key)
+            self._declared.add(routing_key)
+
+    def publish(self, task_id: int, routing_key: str, body: bytes, priority: int) -> None:
+        """Publish and wait for the broker's confirm; raises on nack/unroutable."""
+        channel = self._ensure()
+        self._declare_queue(channel, routing_key)
+        channel.basic_publish(
+            TASK_EXCHANGE, routing_key, body,
+            pika.BasicProperties(
+                delivery_mode=2,
+                content_type="application/json",
+                priority=priority,
+                message_id=str(task_id),
+                timestamp=int(time.time()),
+                # Sub-second enqueue time for the workers' queue-wait histogram
+                headers={"x-enqueued-at": time.time()},
+            ),
+            mandatory=True,
+        )
+
+    def keepalive(self) -> None:
+        """Service broker heartbeats between polls."""
+        if self._connection is not None and self._connection.is_open:
+            self._connection.process_data_events(0)
+
+    def close(self) -> None:
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = self._channel = None
+
+
+_publisher = _Publisher()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-dispatch")
+_wakeup: Optional[asyncio.Event] = None
+_runner: Optional[asyncio.Task] = None
+_stats = {"dispatched": 0, "failed": 0, "failed_dependencies": 0, "batches": 0,
+          "last_error": None}
+
+
+def dispatch_once(limit: int = DISPATCH_BATCH) -> int:
+    """Claim and publish one batch (blocking).  Returns the number published."""
+    try:
+        _publisher.keepalive()
+    except Exception:
+        _publisher.close()
+    failed = _fail_blocked()
+    if failed:
+        _stats["failed_dependencies"] += failed
+        logger.warning(f"Failed {failed} pending task(s) whose dependency failed")
+    claimed = _claim(limit)
+    if not claimed:
+        return 0
+    published, unconfirmed = 0, []
+    for i, (task_id, project_id, description, priority, capability, dispatch,
+            task_type, model) in enumerate(claimed):
+        routing_key, body, amqp_priority = task_message(
+            task_id, project_id, description, priority, capability, dispatch, task_type, model)
+        try:
+            _publisher.publish(task_id, routing_key, body, amqp_priority)
+            published += 1
+        except (pika.exceptions.UnroutableError, pika.exceptions.NackError) as e:
+            logger.warning(f"Broker refused task {task_id} ({routing_key}): {e}")
+            unconfirmed.append(task_id)
+        except Exception as e:
+            # Connection-level failure: everything not yet confirmed goes back
+            logger.error(f"Dispatch publish failed at task {task_id}: {e}")
+            _publisher.close()
+            unconfirmed.extend(row[0] for row in claimed[i:])
+            _stats["last_error"] = str(e)
+            break
+    _release(unconfirmed)
+    TASKS_DISPATCHED.inc(published)
+    DISPATCH_FAILURES.inc(len(unconfirmed))
+    _stats["dispatched"] += published
+    _stats["failed"] += len(unconfirmed)
+    _stats["batches"] += 1
+    logger.info(f"Dispatched {published}/{len(claimed)} task(s)")
+    return published
+
+
+# ---------------------------------------------------------------------------
+# Background loop
+# ---------------------------------------------------------------------------
+
+def notify() -> None:
+    """Wake the dispatcher now (e.g. right after tasks were inserted)."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _run() -> None:
+    loop = asyncio.get_running_loop()
+    backoff = DISPATCH_INTERVAL
+    while True:
+        try:
+            published = await loop.run_in_executor(_executor, dispatch_once, DISPATCH_BATCH)
+            backoff = DISPATCH_INTERVAL
+            if published >= DISPATCH_BATCH:
+                continue   # more may be waiting; go again without sleeping
+        except Exception as e:
+            _stats["last_error"] = str(e)
+            logger.error(f"Task dispatch failed: {e}")
+            backoff = min(backoff * 2, 60)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=backoff)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start() -> None:
+    """Start the dispatch loop on the running event loop (no-op if disabled)."""
+    global _wakeup, _runner
+    if not DISPATCH_ENABLED or _runner is not None:
+        return
+    _wakeup = asyncio.Event()
+    _runner = asyncio.ensure_future(_run())
+    logger.info(f"Task dispatcher started (batch={DISPATCH_BATCH}, lease={TASK_LEASE_SECONDS}s)")
+
+
+async def stop() -> None:
+    global _runner
+    if _runner is not None:
+        _runner.cancel()
+        _runner = None
+    await asyncio.get_running_loop().run_in_executor(_executor, _publisher.close)
+
+
+def _missing_dependencies() -> int:
+    with db.transaction() as cur:
+        cur.execute(_MISSING_DEPENDENCIES_SQL)
+        return cur.fetchone()[0]
+
+
+def _lease_summary() -> dict:
+    with db.transaction() as cur:
+        cur.execute(_LEASE_SUMMARY_SQL)
+        return {
+            status: {
+                "count": count,
+                "lease_expired": expired,
+                "next_expiry": nxt.isoformat() if nxt else None,
+            }
+            for status, count, expired, nxt in cur.fetchall()
+        }
+
+
+async def status() -> dict:
+    """Dispatcher counters, in-flight lease totals and pending tasks waiting on
+    dependency ids that do not exist."""
+    loop = asyncio.get_running_loop()
+    leases = await loop.run_in_executor(_executor, _lease_summary)
+    missing = await loop.run_in_executor(_executor, _missing_dependencies)
+    return {
+        "enabled": DISPATCH_ENABLED,
+        "running": _runner is not None and not _runner.done(),
+        "batch_size": DISPATCH_BATCH,
+        "lease_seconds": TASK_LEASE_SECONDS,
+        **_stats,
+        "in_flight": leases,
+        "missing_dependencies": missing,
+    }
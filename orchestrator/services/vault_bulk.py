@@ -0,0 +1,273 @@
+"""
+Vault Bulk Import / Export
+
+Moves many notes in or out of the vault in one request instead of one
+POST /api/vault/notes per note.
+
+Import accepts
+  - NDJSON: one {"path", "body", "meta"} or {"path", "content"} per line
+  - tar (optionally gzip'd): every *.md member becomes a note
+and hands notes to obsidian_service.write_notes in batches, with change
+notifications deferred so the vault indexes are updated once at the end.
+
+Export streams a tar, tar.gz or zip of a folder without building the
+archive in memory: a worker thread writes the archive into a bounded
+queue that the response drains.
+"""
+
+import io
+import json
+import time
+import queue
+import asyncio
+import logging
+import tarfile
+import tempfile
+import threading
+import zipfile
+from typing import AsyncIterator, Optional
+
+from . import obsidian_service
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH = 500          # notes per write_notes call
+EXPORT_READ_AHEAD = 32      # files read in parallel ahead of the archiver
+_SPOOL_BYTES = 64 * 1024 * 1024
+
+EXPORT_FORMATS = {
+    "tar": "application/x-tar",
+    "tgz": "application/gzip",
+    "zip": "application/zip",
+}
+
+
+class BulkFormatError(ValueError):
+    """Raised for malformed import payloads."""
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+def _merge(summary: dict, result: dict, offset: int) -> None:
+    summary["written"] += result["written"]
+    summary["bytes"] += result["bytes"]
+    for err in result["errors"]:
+        summary["errors"].append({**err, "index": err["index"] + offset})
+
+
+def _parse_line(line: bytes, line_no: int) -> Optional[dict]:
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise BulkFormatError(f"Line {line_no}: invalid JSON ({e})")
+    if not isinstance(item, dict):
+        raise BulkFormatError(f"Line {line_no}: expected an object")
+    return item
+
+
+async def import_ndjson(chunks: AsyncIterator[bytes], overwrite: bool = True) -> dict:
+    """
+    Import notes from an NDJSON byte stream.
+
+    The stream is spooled and every line validated before the first note
+    is written, so a malformed line rejects the whole import
+    (BulkFormatError) instead of leaving it half done.
+    """
+    summary = {"written": 0, "bytes": 0, "errors": []}
+    with tempfile.SpooledTemporaryFile(max_size=_SPOOL_BYTES) as spool:
+        line_no = 0
+        buffer = b""
+        async for chunk in chunks:
+            spool.write(chunk)
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line_no += 1
+                _parse_line(line, line_no)
+        _parse_line(buffer, line_no + 1)
+
+        spool.seek(0)
+        batch: list[dict] = []
+        offset = 0
+        with obsidian_service.deferred_notifications():
+            for line_no, line in enumerate(spool, 1):
+                item = _parse_line(line, line_no)
+                if item is not None:
+                    batch.append(item)
+                if len(batch) >= IMPORT_BATCH:
+                    _merge(summary, await obsidian_service.write_notes(batch, overwrite), offset)
+                    offset += len(batch)
+                    batch = []
+            if batch:
+                _merge(summary, await obsidian_service.write_notes(batch, overwrite), offset)
+    return summary
+
+
+def _next_tar_batch(tar: tarfile.TarFile, limit: int) -> list[dict]:
+    """Read up to limit *.md members from tar (blocking)."""
+    items: list[dict] = []
+    while len(items) < limit:
+        member = tar.next()
+        if member is None:
+            break
+        if not member.isfile() or not member.name.endswith(".md"):
+            continue
+        f = tar.extractfile(member)
+        if f is None:
+            continue
+        name = member.name
+        while name.startswith("./"):
+            name = name[2:]
+        items.append({
+            "path": name,
+            "content": f.read().decode("utf-8", errors="replace"),
+        })
+    return items
+
+
+async def import_tar(chunks: AsyncIterator[bytes], overwrite: bool = True) -> dict:
+    """Import notes from a (optionally gzip'd) tar byte stream."""
+    summary = {"written": 0, "bytes": 0, "errors": []}
+    loop = asyncio.get_running_loop()
+    with tempfile.SpooledTemporaryFile(max_size=_SPOOL_BYTES) as spool:
+        async for chunk in chunks:
+            spool.write(chunk)
+        spool.seek(0)
+        try:
+            tar = tarfile.open(fileobj=spool, mode="r:*")
+        except tarfile.TarError as e:
+            raise BulkFormatError(f"Not a tar archive: {e}")
+        offset = 0
+        with tar, obsidian_service.deferred_notifications():
+            while True:
+                batch = await loop.run_in_executor(None, _next_tar_batch, tar, IMPORT_BATCH)
+                if not batch:
+                    break
+                _merge(summary, await obsidian_service.write_notes(batch, overwrite), offset)
+                offset += len(batch)
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+class _QueueWriter(io.RawIOBase):
+    """Write-only, non-seekable file object feeding a bounded queue."""
+
+    def __init__(self, q: "queue.Queue[Optional[bytes]]", abort: threading.Event):
+        self._q = q
+        self._abort = abort
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._abort.is_set():
+            raise BrokenPipeError("export consumer went away")
+        payload = bytes(data)
+        while True:
+            try:
+                self._q.put(payload, timeout=0.5)
+                return len(payload)
+            except queue.Full:
+                if self._abort.is_set():
+                    raise BrokenPipeError("export consumer went away")
+
+
+def _write_archive(fmt: str, files: list, writer: _QueueWriter) -> None:
+    """Archive files into writer (blocking; runs in its own thread)."""
+    if fmt == "zip":
+        archive = zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_DEFLATED)
+
+        def add(rel, data, mtime):
+            info = zipfile.ZipInfo(rel, date_time=_zip_time(mtime))
+            archive.writestr(info, data, compress_type=zipfile.ZIP_DEFLATED)
+    else:
+        archive = tarfile.open(fileobj=writer, mode="w|gz" if fmt == "tgz" else "w|")
+
+        def add(rel, data, mtime):
+            info = tarfile.TarInfo(rel)
+            info.size = len(data)
+            info.mtime = mtime
+            archive.addfile(info, io.BytesIO(data))
+
+    with archive:
+        for i in range(0, len(files), EXPORT_READ_AHEAD):
+            window = files[i:i + EXPORT_READ_AHEAD]
+            contents = obsidian_service.read_files([p for _, p in window])
+            for (rel, path), data in zip(window, contents):
+                if data is None:
+                    continue
+                try:
+                    mtime = int(path.stat().st_mtime)
+                except OSError:
+                    mtime = 0
+                add(rel, data, mtime)
+
+
+def _zip_time(mtime: int) -> tuple:
+    t = time.gmtime(max(mtime, 315532800))   # zip can't encode dates before 1980
+    return t[:6]
+
+
+async def export_stream(folder: str = "", fmt: str = "tar") -> AsyncIterator[bytes]:
+    """
+    Archive of every note under folder, as an iterator of chunks.
+
+    The format and folder are checked (BulkFormatError / ValueError on a
+    path outside the vault) when this is awaited, before the response
+    starts; the archive itself is produced as the iterator is consumed.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise BulkFormatError(f"Unknown export format: {fmt}")
+    files = await asyncio.get_running_loop().run_in_executor(
+        None, obsidian_service.note_files, folder)
+    return _archive_chunks(files, fmt)
+
+
+async def _archive_chunks(files: list, fmt: str) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    q: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=64)
+    abort = threading.Event()
+    error: list[BaseException] = []
+
+    def produce():
+        try:
+            _write_archive(fmt, files, _QueueWriter(q, abort))
+        except BrokenPipeError:
+            pass
+        except BaseException as e:
+            error.append(e)
+        finally:
+            while not abort.is_set():
+                try:
+                    q.put(None, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    producer = threading.Thread(target=produce, name="vault-export", daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, q.get)
+            if chunk is None:
+                break
+            yield chunk
+        if error:
+            logger.error(f"Vault export failed: {error[0]}")
+            raise error[0]
+        logger.info(f"Exported {len(files)} notes as {fmt}")
+    finally:
+        abort.set()
+        # Unblock a q.get() still parked in the executor
+        try:
+            q.put_nowait(None)
+        except queue.Full:
+            pass
@@ -0,0 +1,531 @@
+"""
+Vault Vector Index
+
+Semantic retrieval over the Obsidian vault so agents can be handed the
+few most relevant passages of prior work instead of whole notes.
+
+  - Notes are split into paragraph-packed chunks and embedded through
+    Ollama (EMBED_MODEL, default nomic-embed-text).
+  - Vectors live in a float32 NumPy matrix (L2-normalised, so a dot
+    product is cosine similarity).  The matrix is persisted as .npy under
+    VECTOR_INDEX_DIR and memory-mapped on startup.
+  - Above VECTOR_ANN_MIN_ROWS live chunks an IVF (inverted file) coarse
+    quantiser is trained and only the closest VECTOR_ANN_NPROBE clusters
+    are scanned.  VECTOR_ANN=exact disables it, VECTOR_ANN=ivf forces it.
+  - obsidian_service change notifications mark notes dirty; a debounced
+    background flush re-embeds only notes whose body actually changed.
+"""
+
+import os
+import json
+import asyncio
+import fnmatch
+import hashlib
+import logging
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+import numpy as np
+
+from . import obsidian_service, llm_router, model_residency
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+EMBED_MODEL      = os.environ.get("EMBED_MODEL", "nomic-embed-text")
+EMBED_URL        = os.environ.get("EMBED_URL", llm_router.OLLAMA_LOCAL_URL)
+VECTOR_INDEX_DIR = Path(os.environ.get(
+    "VECTOR_INDEX_DIR", str(obsidian_service.VAULT_ROOT / ".agent-index")))
+CHUNK_CHARS      = int(os.environ.get("VECTOR_CHUNK_CHARS", "1200"))
+EMBED_BATCH      = int(os.environ.get("VECTOR_EMBED_BATCH", "32"))
+ANN_MODE         = os.environ.get("VECTOR_ANN", "auto")          # auto | exact | ivf
+ANN_MIN_ROWS     = int(os.environ.get("VECTOR_ANN_MIN_ROWS", "20000"))
+ANN_NPROBE       = int(os.environ.get("VECTOR_ANN_NPROBE", "8"))
+# Notes that churn constantly and carry little retrievable knowledge
+EXCLUDE_PATTERNS = [p.strip() for p in os.environ.get(
+    "VECTOR_EXCLUDE", "*/activity_log.md,.agent-index/*").split(",") if p.strip()]
+
+_FLUSH_DELAY = 1.0   # seconds to coalesce bursts of writes
+
+
+# ---------------------------------------------------------------------------
+# Index state
+# ---------------------------------------------------------------------------
+
+_vectors: Optional[np.ndarray] = None   # (capacity, dim); rows [0, _n) are valid
+_n = 0
+_chunks: list = []                      # row -> {"path", "text", "tokens"} or None (deleted)
+_rows_by_path: dict[str, list[int]] = {}
+_note_hashes: dict[str, str] = {}       # path -> hash of the body that was embedded
+_dead = 0
+
+# IVF coarse quantiser
+_centroids: Optional[np.ndarray] = None
+_assign: Optional[np.ndarray] = None    # row -> centroid id
+_trained_rows = 0
+
+# What retrieve() reads, published in one assignment after every change:
+# (vectors, n, chunks, centroids, assign).  Rows [0, n) are never rewritten
+# in place (appends go past n, compaction and growth build new arrays), so
+# a reader holding the tuple sees a consistent index.
+_view: tuple = (None, 0, [], None, None)
+
+_loaded = False
+_synced = False
+_dirty: dict[str, Optional[dict]] = {}
+_flush_task: Optional[asyncio.Task] = None
+_index_lock = asyncio.Lock()
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return max(1, len(text) // 4)
+
+
+def _excluded(path: str) -> bool:
+    return any(fnmatch.fnmatch(path, pat) for pat in EXCLUDE_PATTERNS)
+
+
+def _body_hash(body: str) -> str:
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def _chunk(body: str) -> list[str]:
+    """Pack paragraphs into chunks of at most CHUNK_CHARS characters."""
+    chunks: list[str] = []
+    current = ""
+    for para in (p.strip() for p in body.split("\n\n")):
+        if not para:
+            continue
+        while len(para) > CHUNK_CHARS:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(para[:CHUNK_CHARS])
+            para = para[CHUNK_CHARS:]
+        if current and len(current) + len(para) + 2 > CHUNK_CHARS:
+            chunks.append(current)
+            current = para
+        else:
+            current = f"{current}\n\n{para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _normalise(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (mat / norms).astype(np.float32)
+
+
+def _keep_alive():
+    return model_residency.keep_alive_for(llm_router.backend_name(EMBED_URL), EMBED_MODEL)
+
+
+async def _embed(texts: list[str]) -> np.ndarray:
+    """Embed texts with Ollama, batching requests. Returns normalised (n, dim)."""
+    out: list[list[float]] = []
+    async with aiohttp.ClientSession() as session:
+        for i in range(0, len(texts), EMBED_BATCH):
+            batch = texts[i:i + EMBED_BATCH]
+            async with session.post(
+                f"{EMBED_URL}/api/embed",
+                json={"model": EMBED_MODEL, "input": batch, "keep_alive": _keep_alive()},
+                timeout=aiohttp.ClientTimeout(total=120),
+            ) as resp:
+                if resp.status == 404:
+                    # Older Ollama without the batch endpoint
+                    out.extend([await _embed_legacy(session, t) for t in batch])
+                    continue
+                resp.raise_for_status()
+                data = await resp.json()
+                out.extend(data["embeddings"])
+    return _normalise(np.asarray(out, dtype=np.float32))
+
+
+async def _embed_legacy(session: aiohttp.ClientSession, text: str) -> list[float]:
+    async with session.post(
+        f"{EMBED_URL}/api/embeddings",
+        json={"model": EMBED_MODEL, "prompt": text, "keep_alive": _keep_alive()},
+        timeout=aiohttp.ClientTimeout(total=120),
+    ) as resp:
+        resp.raise_for_status()
+        return (await resp.json())["embedding"]
+
+
+# ---------------------------------------------------------------------------
+# Matrix maintenance
+# ---------------------------------------------------------------------------
+
+def _append_rows(vecs: np.ndarray, metas: list[dict]) -> list[int]:
+    """Append rows, growing the backing buffer geometrically."""
+    global _vectors, _n
+    count = vecs.shape[0]
+    if count == 0:
+        return []
+    if _vectors is None or _vectors.shape[1] != vecs.shape[1]:
+        if _vectors is not None and _n:
+            raise ValueError(
+                f"Embedding dimension changed ({_vectors.shape[1]} -> {vecs.shape[1]}); "
+                f"delete {VECTOR_INDEX_DIR} to rebuild with the new model")
+        _vectors = np.zeros((max(1024, count), vecs.shape[1]), dtype=np.float32)
+    elif _n + count > _vectors.shape[0] or not _vectors.flags.writeable:
+        # Grow (this also copies a read-only memory map into RAM)
+        capacity = max(_vectors.shape[0], 1024)
+        while capacity < _n + count:
+            capacity *= 2
+        grown = np.zeros((capacity, _vectors.shape[1]), dtype=np.float32)
+        grown[:_n] = _vectors[:_n]
+        _vectors = grown
+    rows = list(range(_n, _n + count))
+    _vectors[_n:_n + count] = vecs
+    _chunks.extend(metas)
+    _n += count
+    _assign_new_rows(rows)
+    return rows
+
+
+def _assign_new_rows(rows: list[int]) -> None:
+    global _assign
+    if _centroids is None or not rows:
+        return
+    sims = _vectors[rows[0]:rows[-1] + 1] @ _centroids.T
+    new = np.argmax(sims, axis=1).astype(np.int32)
+    _assign = np.concatenate([_assign[:rows[0]], new])
+
+
+def _publish() -> None:
+    global _view
+    _view = (_vectors, _n, _chunks, _centroids, _assign)
+
+
+def _remove_path(path: str) -> None:
+    global _dead
+    for row in _rows_by_path.pop(path, []):
+        if _chunks[row] is not None:
+            _chunks[row] = None
+            _dead += 1
+    _note_hashes.pop(path, None)
+
+
+def _compact() -> None:
+    """
+    Drop deleted rows once they make up a large share of the matrix.
+    Runs on the event loop under _index_lock, never from _save's thread.
+    """
+    global _vectors, _n, _chunks, _assign, _dead
+    if _dead < 1000 or _dead < _n // 4:
+        return
+    keep = [i for i in range(_n) if _chunks[i] is not None]
+    _vectors = np.array(_vectors[keep], dtype=np.float32)
+    if _assign is not None:
+        _assign = _assign[keep]
+    _chunks = [_chunks[i] for i in keep]
+    _n = len(keep)
+    _dead = 0
+    _rows_by_path.clear()
+    for row, meta in enumerate(_chunks):
+        _rows_by_path.setdefault(meta["path"], []).append(row)
+    _publish()
+
+
+def _train_ivf() -> None:
+    """Train the IVF quantiser with a few rounds of spherical k-means."""
+    global _centroids, _assign, _trained_rows
+    live = np.array([i for i in range(_n) if _chunks[i] is not None])
+    if len(live) == 0:
+        return
+    k = max(8, int(np.sqrt(len(live))))
+    rng = np.random.default_rng(0)
+    sample = _vectors[rng.choice(live, size=min(len(live), 50 * k), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=min(k, len(sample)), replace=False)].copy()
+    for _ in range(10):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(len(centroids)):
+            members = sample[labels == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids = _normalise(centroids)
+    _centroids = centroids
+    _assign = np.argmax(_vectors[:_n] @ centroids.T, axis=1).astype(np.int32)
+    _trained_rows = len(live)
+    logger.info(f"Vector index: trained IVF with {len(centroids)} lists over {len(live)} rows")
+
+
+def _maybe_train() -> None:
+    live = _n - _dead
+    if ANN_MODE == "exact":
+        return
+    if ANN_MODE != "ivf" and live < ANN_MIN_ROWS:
+        return
+    if _centroids is None or live > 2 * _trained_rows:
+        _train_ivf()
+
+
+# ---------------------------------------------------------------------------
+# Persistence
+# ---------------------------------------------------------------------------
+
+def _save(vectors: Optional[np.ndarray], chunks: list, hashes: dict,
+          centroids: Optional[np.ndarray], assign: Optional[np.ndarray],
+          trained_rows: int) -> None:
+    """Write a snapshot taken by _persist (runs in a worker thread)."""
+    VECTOR_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = VECTOR_INDEX_DIR / "vectors.tmp.npy"
+    np.save(tmp, vectors if vectors is not None else np.zeros((0, 0), np.float32))
+    os.replace(tmp, VECTOR_INDEX_DIR / "vectors.npy")
+    if centroids is not None:
+        tmp = VECTOR_INDEX_DIR / "ivf.tmp.npz"
+        np.savez(tmp, centroids=centroids, assign=assign,
+                 trained_rows=np.array(trained_rows))
+        os.replace(tmp, VECTOR_INDEX_DIR / "ivf.npz")
+    tmp = VECTOR_INDEX_DIR / "chunks.tmp.json"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"model": EMBED_MODEL, "chunks": chunks, "hashes": hashes}, f)
+    os.replace(tmp, VECTOR_INDEX_DIR / "chunks.json")
+
+
+async def _persist() -> None:
+    """Compact on the loop, then save a snapshot off-loop.  Hold _index_lock."""
+    _compact()
+    vectors, n, chunks, centroids, assign = _view
+    await asyncio.to_thread(
+        _save, vectors[:n] if vectors is not None else None, chunks[:n],
+        dict(_note_hashes), centroids, assign[:n] if assign is not None else None,
+        _trained_rows)
+
+
+def _load() -> None:
+    global _vectors, _n, _chunks, _dead, _centroids, _assign, _trained_rows
+    meta_file = VECTOR_INDEX_DIR / "chunks.json"
+    vec_file = VECTOR_INDEX_DIR / "vectors.npy"
+    if not meta_file.exists() or not vec_file.exists():
+        return
+    with open(meta_file, encoding="utf-8") as f:
+        saved = json.load(f)
+    if saved.get("model") != EMBED_MODEL:
+        logger.info("Vector index: embedding model changed, rebuilding from scratch")
+        return
+    vectors = np.load(vec_file, mmap_mode="r")
+    if vectors.shape[0] != len(saved["chunks"]):
+        logger.warning("Vector index: files out of sync, rebuilding from scratch")
+        return
+    _vectors = vectors
+    _n = vectors.shape[0]
+    _chunks = saved["chunks"]
+    _note_hashes.update(saved.get("hashes", {}))
+    _dead = sum(1 for c in _chunks if c is None)
+    for row, meta in enumerate(_chunks):
+        if meta is not None:
+            _rows_by_path.setdefault(meta["path"], []).append(row)
+    ivf_file = VECTOR_INDEX_DIR / "ivf.npz"
+    if ivf_file.exists() and ANN_MODE != "exact":
+        ivf = np.load(ivf_file)
+        if len(ivf["assign"]) == _n:
+            _centroids = ivf["centroids"]
+            _assign = ivf["assign"]
+            _trained_rows = int(ivf["trained_rows"])
+    logger.info(f"Vector index: loaded {_n - _dead} chunks from {VECTOR_INDEX_DIR}")
+
+
+# ---------------------------------------------------------------------------
+# Updates
+# ---------------------------------------------------------------------------
+
+async def _index_notes(notes: dict[str, Optional[dict]]) -> int:
+    """Re-embed the given notes ({path: note or None}). Returns chunks embedded."""
+    texts: list[str] = []
+    metas: list[dict] = []
+    touched: dict[str, str] = {}
+    for path, note in notes.items():
+        if note is None or _excluded(path):
+            _remove_path(path)
+            continue
+        digest = _body_hash(note["body"])
+        if _note_hashes.get(path) == digest:
+            continue
+        touched[path] = digest
+        title = Path(path).stem
+        for chunk in _chunk(note["body"]):
+            texts.append(f"{title}\n\n{chunk}")
+            metas.append({"path": path, "text": chunk, "tokens": estimate_tokens(chunk)})
+    vecs = await _embed(texts) if texts else None
+    # Swap rows only once embedding succeeded so a failed call keeps the old rows
+    for path, digest in touched.items():
+        _remove_path(path)
+        _note_hashes[path] = digest
+    if vecs is not None:
+        rows = _append_rows(vecs, metas)
+        for row, meta in zip(rows, metas):
+            _rows_by_path.setdefault(meta["path"], []).append(row)
+    _maybe_train()
+    _publish()
+    return len(texts)
+
+
+async def _flush_later() -> None:
+    global _flush_task
+    await asyncio.sleep(_FLUSH_DELAY)
+    _flush_task = None
+    await ensure_loaded()
+    batch = dict(_dirty)
+    _dirty.clear()
+    try:
+        async with _index_lock:
+            before = (_n, _dead)
+            await _index_notes(batch)
+            if (_n, _dead) != before:
+                await _persist()
+    except Exception as e:
+        logger.warning(f"Vector index update failed: {e}")
+        # Retry on the next change rather than dropping the notes
+        for path, note in batch.items():
+            _dirty.setdefault(path, note)
+
+
+def on_vault_changes(changes: list[tuple[str, Optional[dict]]]) -> None:
+    """obsidian_service change listener — schedules a debounced re-embed."""
+    global _flush_task
+    for path, note in changes:
+        if not _excluded(path):
+            _dirty[path] = note
+    if _dirty and _flush_task is None:
+        _flush_task = asyncio.ensure_future(_flush_later())
+
+
+async def ensure_loaded() -> None:
+    """Load the persisted index (cheap; does not touch the vault)."""
+    global _loaded
+    if _loaded:
+        return
+    async with _index_lock:
+        if not _loaded:
+            try:
+                await asyncio.to_thread(_load)
+            except Exception as e:
+                logger.warning(f"Vector index: could not load persisted index: {e}")
+            _publish()
+            _loaded = True
+
+
+async def sync_with_vault() -> None:
+    """Reconcile the index with the vault, embedding only changed notes."""
+    global _synced
+    await ensure_loaded()
+    async with _index_lock:
+        notes: dict[str, Optional[dict]] = {}
+        seen = set()
+        for note_meta in await obsidian_service.list_notes():
+            path = note_meta["path"]
+            if _excluded(path):
+                continue
+            seen.add(path)
+            try:
+                note = await obsidian_service.read_note(path)
+            except Exception:
+                continue
+            if note and _note_hashes.get(path) != _body_hash(note["body"]):
+                notes[path] = {"meta": note["meta"], "body": note["body"]}
+        for path in list(_note_hashes):
+            if path not in seen:
+                notes[path] = None
+        if notes:
+            try:
+                embedded = await _index_notes(notes)
+                await _persist()
+                logger.info(f"Vector index: synced {len(notes)} notes ({embedded} chunks)")
+            except Exception as e:
+                logger.warning(f"Vector index sync failed: {e}")
+                return
+        _synced = True
+
+
+# ---------------------------------------------------------------------------
+# Retrieval
+# ---------------------------------------------------------------------------
+
+def _search(vectors: np.ndarray, n: int, centroids: Optional[np.ndarray],
+            assign: Optional[np.ndarray], q: np.ndarray,
+            candidates: int) -> list[tuple[int, float]]:
+    rows: Optional[np.ndarray] = None
+    if centroids is not None and assign is not None and len(assign) >= n:
+        probes = np.argsort(centroids @ q)[::-1][:ANN_NPROBE]
+        rows = np.nonzero(np.isin(assign[:n], probes))[0]
+    if rows is None:
+        scores = vectors[:n] @ q
+        rows = np.arange(n)
+    else:
+        scores = vectors[rows] @ q
+    if len(scores) == 0:
+        return []
+    top = min(candidates, len(scores))
+    idx = np.argpartition(-scores, top - 1)[:top]
+    idx = idx[np.argsort(-scores[idx])]
+    return [(int(rows[i]), float(scores[i])) for i in idx]
+
+
+async def retrieve(query: str, k: int = 5, token_budget: int = 1500,
+                   folder: str = "", min_score: float = 0.0) -> list[dict]:
+    """
+    Return up to k chunks most similar to query whose combined size stays
+    within token_budget.  Each item is {path, text, score, tokens}.
+    """
+    await ensure_loaded()
+    if _vectors is None or _n - _dead == 0:
+        return []
+    q = (await _embed([query]))[0]
+    # One read: a flush may compact or grow the matrix while we search
+    vectors, n, chunks, centroids, assign = _view
+    if vectors is None:
+        return []
+    hits = await asyncio.to_thread(_search, vectors, n, centroids, assign, q, max(k * 4, 20))
+    results: list[dict] = []
+    used = 0
+    for row, score in hits:
+        meta = chunks[row] if row < len(chunks) else None
+        if meta is None or score < min_score:
+            continue
+        if folder and not meta["path"].startswith(folder.rstrip("/") + "/"):
+            continue
+        if used + meta["tokens"] > token_budget:
+            continue
+        results.append({"path": meta["path"], "text": meta["text"],
+                        "score": round(score, 4), "tokens": meta["tokens"]})
+        used += meta["tokens"]
+        if len(results) >= k:
+            break
+    return results
+
+
+def format_context(chunks: list[dict]) -> str:
+    """Render retrieved chunks as a compact prompt section."""
+    if not chunks:
+        return ""
+    parts = ["Relevant notes from the knowledge vault:"]
+    for c in chunks:
+        title = c["path"][:-3] if c["path"].endswith(".md") else c["path"]
+        parts.append(f"--- [[{title}]]\n{c['text']}")
+    return "\n".join(parts)
+
+
+def stats() -> dict:
+    return {
+        "loaded": _loaded,
+        "synced": _synced,
+        "model": EMBED_MODEL,
+        "chunks": _n - _dead,
+        "deleted_rows": _dead,
+        "notes": len(_rows_by_path),
+        "dim": int(_vectors.shape[1]) if _vectors is not None else 0,
+        "ann": "ivf" if _centroids is not None else "exact",
+        "ivf_lists": int(len(_centroids)) if _centroids is not None else 0,
+        "pending": len(_dirty),
+    }
@@ -0,0 +1,173 @@
+"""
+Worker Reaper
+
+Liveness tracking for the worker fleet.  Workers write
+worker_agents.last_heartbeat every 30 s and renew the lease of the task
+they are processing with it; this loop acts on what they stop writing.
+
+  - Workers whose heartbeat is older than WORKER_STALE_SECONDS are marked
+    `offline` (a range scan on idx_worker_agents_last_heartbeat).
+  - In-flight tasks are reclaimed back to `pending` for the dispatcher
+    when their lease has expired, or when they are `processing` on a
+    worker that is offline.  Each reclaim is counted in
+    metadata.reclaimed; after REAPER_MAX_RECLAIMS the task is failed
+    instead, so a task that kills its worker cannot take down the fleet.
+  - Fleet capacity (workers per status) and reclaim counts are exported
+    as Prometheus metrics.
+
+Workers that come back send a heartbeat, which flips them from
+`offline` to `available` again.
+"""
+
+import os
+import asyncio
+import logging
+from typing import Optional
+
+from prometheus_client import Counter, Gauge
+
+from . import db, task_dispatcher
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+REAPER_INTERVAL      = float(os.environ.get("REAPER_INTERVAL", "15"))
+WORKER_STALE_SECONDS = int(os.environ.get("WORKER_STALE_SECONDS", "90"))   # 3 missed heartbeats
+REAPER_MAX_RECLAIMS  = int(os.environ.get("REAPER_MAX_RECLAIMS", "3"))
+
+WORKER_STATUSES = ("available", "busy", "offline")
+
+WORKERS_BY_STATUS = Gauge("worker_agents", "Worker agents by status", ["status"])
+WORKERS_REAPED    = Counter("workers_reaped_total", "Workers marked offline after missing heartbeats")
+TASKS_RECLAIMED   = Counter("tasks_reclaimed_total", "In-flight tasks returned to pending", ["reason"])
+TASKS_ABANDONED   = Counter("tasks_abandoned_total", "Tasks failed after too many reclaims")
+
+
+# ---------------------------------------------------------------------------
+# SQL
+# ---------------------------------------------------------------------------
+
+_MARK_STALE_SQL = """
+UPDATE worker_agents
+SET status = 'offline'
+WHERE last_heartbeat < NOW() - make_interval(secs => %s)
+  AND status <> 'offline'
+RETURNING name
+"""
+
+_RECLAIM_SQL = """
+WITH offline AS (
+    SELECT name FROM worker_agents WHERE status = 'offline'
+),
+lost AS (
+    SELECT t.id,
+           COALESCE((t.metadata->>'reclaimed')::int, 0) + 1 AS reclaimed,
+           CASE WHEN t.status = 'processing' AND t.assigned_agent IN (SELECT name FROM offline)
+                THEN 'worker_offline' ELSE 'lease_expired' END AS reason
+    FROM tasks t
+    WHERE (t.status IN ('dispatched', 'processing') AND t.lease_expires_at < NOW())
+       OR (t.status = 'processing' AND t.assigned_agent IN (SELECT name FROM offline))
+    FOR UPDATE OF t SKIP LOCKED
+)
+UPDATE tasks
+SET status = CASE WHEN lost.reclaimed > %(max_reclaims)s THEN 'failed' ELSE 'pending' END,
+    assigned_agent = NULL,
+    dispatched_at = NULL,
+    lease_expires_at = NULL,
+    metadata = COALESCE(tasks.metadata, '{}'::jsonb) || jsonb_build_object(
+        'reclaimed', lost.reclaimed,
+        'reclaim_reason', lost.reason
+    ) || CASE WHEN lost.reclaimed > %(max_reclaims)s
+              THEN jsonb_build_object('error', 'Abandoned after '
+                                      || (lost.reclaimed - 1) || ' reclaims (' || lost.reason || ')')
+              ELSE '{}'::jsonb END
+FROM lost
+WHERE tasks.id = lost.id
+RETURNING tasks.id, tasks.status, lost.reason
+"""
+
+_FLEET_SQL = "SELECT status, COUNT(*) FROM worker_agents GROUP BY status"
+
+
+_last: dict = {"workers_offlined": [], "reclaimed": 0, "abandoned": 0, "fleet": {}, "error": None}
+_runner: Optional[asyncio.Task] = None
+
+
+def reap_once() -> dict:
+    """One reaper pass (blocking).  Returns a summary of what changed."""
+    with db.transaction() as cur:
+        cur.execute(_MARK_STALE_SQL, (WORKER_STALE_SECONDS,))
+        stale = [row[0] for row in cur.fetchall()]
+    with db.transaction() as cur:
+        cur.execute(_RECLAIM_SQL, {"max_reclaims": REAPER_MAX_RECLAIMS})
+        reclaimed = cur.fetchall()
+    with db.transaction() as cur:
+        cur.execute(_FLEET_SQL)
+        fleet = dict(cur.fetchall())
+
+    if stale:
+        WORKERS_REAPED.inc(len(stale))
+        logger.warning(f"Marked {len(stale)} worker(s) offline after missed heartbeats: {stale}")
+    requeued = [(task_id, reason) for task_id, status, reason in reclaimed if status == "pending"]
+    abandoned = [task_id for task_id, status, _ in reclaimed if status == "failed"]
+    for _, reason in requeued:
+        TASKS_RECLAIMED.labels(reason=reason).inc()
+    if requeued:
+        logger.warning(f"Reclaimed {len(requeued)} in-flight task(s): {requeued}")
+    if abandoned:
+        TASKS_ABANDONED.inc(len(abandoned))
+        logger.error(f"Failed {len(abandoned)} task(s) after {REAPER_MAX_RECLAIMS} reclaims: {abandoned}")
+    for status in set(WORKER_STATUSES) | set(fleet):
+        WORKERS_BY_STATUS.labels(status=status).set(fleet.get(status, 0))
+
+    return {
+        "workers_offlined": stale,
+        "reclaimed": len(requeued),
+        "abandoned": len(abandoned),
+        "fleet": fleet,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Background loop
+# ---------------------------------------------------------------------------
+
+async def _run() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            summary = await loop.run_in_executor(None, reap_once)
+            _last.update(summary, error=None)
+            if summary["reclaimed"]:
+                task_dispatcher.notify()
+        except Exception as e:
+            _last["error"] = str(e)
+            logger.error(f"Worker reaper pass failed: {e}")
+        await asyncio.sleep(REAPER_INTERVAL)
+
+
+def start() -> None:
+    """Start the reaper loop on the running event loop."""
+    global _runner
+    if _runner is None:
+        _runner = asyncio.ensure_future(_run())
+        logger.info(f"Worker reaper started (stale after {WORKER_STALE_SECONDS}s)")
+
+
+def stop() -> None:
+    global _runner
+    if _runner is not None:
+        _runner.cancel()
+        _runner = None
+
+
+def status() -> dict:
+    """Result of the most recent reaper pass."""
+    return {
+        "interval": REAPER_INTERVAL,
+        "stale_after": WORKER_STALE_SECONDS,
+        "max_reclaims": REAPER_MAX_RECLAIMS,
+        **_last,
+    }
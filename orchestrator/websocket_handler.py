@@ -10,7 +10,7 @@ import json
 import logging
 from quart import websocket, Blueprint
 
-from services import agent_manager
+from services import agent_manager, progress_relay
 
 logger = logging.getLogger(__name__)
 
@@ -36,8 +36,9 @@ async def _broadcast(message: dict):
 
 
 def setup_broadcast(app):
-    """Wire the broadcast function into the agent_manager at app startup."""
+    """Wire the broadcast function into the agent_manager and progress relay at app startup."""
     agent_manager.set_broadcast(_broadcast)
+    progress_relay.set_broadcast(_broadcast)
 
 
 @ws_bp.websocket("/ws")
@@ -0,0 +1,417 @@
+"""
+Asyncio worker mode.
+
+Runs several tasks concurrently inside one worker container instead of
+one task per container: RabbitMQ delivers up to WORKER_CONCURRENCY
+unacked messages (prefetch) and each is handled as its own asyncio task
+against an async Ollama client, so Ollama can batch the requests.
+
+  - aio-pika robust connection: reconnects and re-declares the consumer
+    automatically after broker restarts or network blips.
+  - SIGTERM / SIGINT: stop consuming, let in-flight tasks finish (up to
+    WORKER_DRAIN_TIMEOUT seconds), mark the worker offline and exit.
+    Tasks still running after that are cancelled, handed back to
+    'dispatched' in the database and their messages requeued, so another
+    worker picks them up straight away.
+
+Failed tasks follow the same retry policy as the sync worker: they are
+republished to a backoff delay queue and, after TASK_MAX_ATTEMPTS,
+to the dead-letter queue.
+
+Database and task bookkeeping reuse the helpers in worker.py (run in a
+thread so the event loop never blocks on psycopg2).  With
+DB_BATCH_SIZE > 1, completion writes from concurrent tasks are buffered
+and flushed as one statement; a message is only acked once its result
+has been flushed.
+
+Inference is batched the same way: at most OLLAMA_NUM_PARALLEL
+generate requests run at once (WORKER_CONCURRENCY may prefetch more so
+a slot never sits idle waiting on the broker), and embedding tasks
+(type "embed") that arrive together go to Ollama as one /api/embed call
+of up to EMBED_BATCH_SIZE inputs.  Acks remain per message.
+
+Generation is streamed and reported as throttled progress events, as in
+the sync worker.
+
+Enable with WORKER_MODE=async.
+"""
+
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+
+import aio_pika
+import ollama
+from prometheus_client import start_http_server
+
+import worker
+from worker import (
+    TASKS_PROCESSED, TASKS_FAILED, TASK_PROCESSING_TIME, AGENT_STATUS, WORKER_ID,
+)
+
+logger = logging.getLogger("async_worker")
+
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', '4'))
+WORKER_DRAIN_TIMEOUT = float(os.environ.get('WORKER_DRAIN_TIMEOUT', '120'))
+HEARTBEAT_INTERVAL = 30
+# Completion-write batching (1 = write each result immediately)
+DB_BATCH_SIZE = int(os.environ.get('DB_BATCH_SIZE', '1'))
+DB_BATCH_DELAY = float(os.environ.get('DB_BATCH_DELAY_MS', '50')) / 1000
+# Concurrent requests sent to Ollama; match the server's OLLAMA_NUM_PARALLEL
+# so parallel decoding is used without queueing inside Ollama.
+OLLAMA_NUM_PARALLEL = int(os.environ.get('OLLAMA_NUM_PARALLEL', str(WORKER_CONCURRENCY)))
+# Embedding tasks arriving together are sent as one /api/embed call
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '16'))
+EMBED_BATCH_DELAY = float(os.environ.get('EMBED_BATCH_DELAY_MS', '25')) / 1000
+
+# Async Ollama client (honours OLLAMA_HOST like the sync client)
+ollama_async_client = ollama.AsyncClient()
+
+_in_flight: set = set()
+# Bounds concurrent Ollama requests; created in run() on the worker's loop
+_ollama_slots: asyncio.Semaphore = None
+# Retry / dead-letter / progress exchanges by name, filled in by declare_retry_topology
+_exchanges: dict = {}
+# Pending fire-and-forget progress publishes
+_background: set = set()
+
+
+def _update_busy_gauge():
+    AGENT_STATUS.set(2 if _in_flight else 1)
+
+
+class MicroBatcher:
+    """Collects items from concurrent tasks and hands them to run_batch together.
+
+    A batch runs when `size` items are waiting or `delay` seconds after the
+    first one arrived.  run_batch(items) returns one result per item; each
+    caller awaits its own result, so e.g. a message is acked only once its
+    part of the batch is durable.  size <= 1 runs every item on its own.
+    """
+
+    def __init__(self, size: int, delay: float, run_batch):
+        self.size = size
+        self.delay = delay
+        self.run_batch = run_batch
+        self._pending: list = []
+        self._timer = None
+
+    async def submit(self, item):
+        if self.size <= 1:
+            return (await self.run_batch([item]))[0]
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((item, fut))
+        if len(self._pending) >= self.size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.delay, lambda: asyncio.ensure_future(self.flush()))
+        return await fut
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            results = await self.run_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+
+async def _store_results(results):
+    """Write [(task_id, result), ...] in one statement"""
+    await asyncio.to_thread(worker.complete_tasks, results)
+    return [None] * len(results)
+
+
+async def _embed_batch(texts):
+    """One Ollama /api/embed call for a batch of embedding tasks"""
+    async with _ollama_slots:
+        with worker.observe(worker.LLM_REQUEST_TIME, model=worker.EMBED_MODEL):
+            response = await ollama_async_client.embed(
+                model=worker.EMBED_MODEL, input=texts, keep_alive=worker.keep_alive(worker.EMBED_MODEL))
+    worker.record_ollama_stats(worker.EMBED_MODEL, response)
+    return response['embeddings']
+
+
+completions = MicroBatcher(DB_BATCH_SIZE, DB_BATCH_DELAY, _store_results)
+embeddings = MicroBatcher(EMBED_BATCH_SIZE, EMBED_BATCH_DELAY, _embed_batch)
+
+
+def _publish_progress(event):
+    """Fire-and-forget progress event (see worker.publish_progress)"""
+    exchange = _exchanges.get(worker.PROGRESS_EXCHANGE)
+    if exchange is None:
+        return
+    task = asyncio.ensure_future(exchange.publish(
+        aio_pika.Message(json.dumps(event).encode(), content_type='application/json',
+                         delivery_mode=aio_pika.DeliveryMode.NOT_PERSISTENT),
+        routing_key=worker.progress_routing_key(event['task_id'])))
+    _background.add(task)
+    task.add_done_callback(_progress_sent)
+
+
+def _progress_sent(task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"Progress publish failed: {task.exception()}")
+
+
+async def stream_generate(model, prompt, tracker):
+    """Async counterpart of worker.stream_generate"""
+    parts = []
+    final = {}
+    async for chunk in await ollama_async_client.generate(
+            model=model, prompt=prompt, keep_alive=worker.keep_alive(model), stream=True):
+        parts.append(chunk.get('response', ''))
+        tracker.add(chunk.get('response', ''))
+        if chunk.get('done'):
+            final = dict(chunk)
+    tracker.flush()
+    final['response'] = ''.join(parts)
+    return final
+
+
+async def process_task(task_data, attempt=1, tracker=None):
+    """Process a task; returns (outcome, error) like worker.process_task"""
+    task_id = task_data.get('task_id') if isinstance(task_data, dict) else None
+    try:
+        if task_id is None:
+            raise worker.PermanentTaskError("Message has no task_id")
+        logger.info(f"Processing task {task_id} (attempt {attempt}): {task_data['description']}")
+        start_time = time.time()
+
+        if not await asyncio.to_thread(
+                worker.mark_task_processing, task_id, task_data.get('dispatch')):
+            logger.info(f"Skipping stale delivery of task {task_id}")
+            return worker.TASK_SKIPPED, None
+        if worker.is_embedding_task(task_data):
+            result = await embeddings.submit(worker.embedding_input(task_data))
+        else:
+            model = worker.task_model(task_data)
+            async with _ollama_slots:
+                with worker.observe(worker.LLM_REQUEST_TIME, model=model):
+                    response = await stream_generate(
+                        model, worker.build_prompt(task_data),
+                        tracker or worker.ProgressTracker(task_id))
+            worker.record_ollama_stats(model, response)
+            result = response['response']
+        await completions.submit((task_id, result))
+
+        TASKS_PROCESSED.inc()
+        TASK_PROCESSING_TIME.set(time.time() - start_time)
+        logger.info(f"Task {task_id} completed successfully")
+        return worker.TASK_DONE, None
+
+    except Exception as e:
+        outcome = await asyncio.to_thread(worker.record_failure, task_id, e, attempt)
+        return outcome, e
+
+
+def _forward(message: aio_pika.IncomingMessage, headers: dict) -> aio_pika.Message:
+    return aio_pika.Message(
+        message.body,
+        headers=headers,
+        content_type=message.content_type,
+        priority=message.priority,
+        message_id=message.message_id,
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+    )
+
+
+async def requeue_with_backoff(message, queue, attempt):
+    """aio-pika counterpart of worker.requeue_with_backoff"""
+    headers = dict(message.headers or {})
+    headers[worker.ATTEMPT_HEADER] = attempt + 1
+    headers['x-enqueued-at'] = time.time() + worker.retry_delay_ms(attempt) / 1000
+    retry_queue = worker.retry_queue_name(attempt)
+    await _exchanges[retry_queue].publish(_forward(message, headers), routing_key=queue)
+    logger.info(f"Retrying in {retry_queue[len(worker.RETRY_QUEUE_PREFIX):]}ms via {retry_queue}")
+
+
+async def dead_letter(message, queue, attempt, error):
+    """aio-pika counterpart of worker.dead_letter"""
+    headers = dict(message.headers or {})
+    headers.update({
+        worker.ATTEMPT_HEADER: attempt,
+        'x-origin-queue': queue,
+        'x-error': str(error)[:1000],
+    })
+    await _exchanges[worker.DEAD_LETTER_EXCHANGE].publish(_forward(message, headers), routing_key=queue)
+
+
+async def handle_message(message: aio_pika.IncomingMessage):
+    """Consume one delivery: run the task, then retry/dead-letter it if needed and ack"""
+    task = asyncio.current_task()
+    _in_flight.add(task)
+    _update_busy_gauge()
+    try:
+        delivered = time.time()
+        attempt = worker.attempt_of(message.headers)
+        queue = worker.origin_queue(message.exchange, message.routing_key)
+        try:
+            task_data = json.loads(message.body)
+        except json.JSONDecodeError as e:
+            logger.error(f"Dead-lettering malformed message from {queue}: {e}")
+            await dead_letter(message, queue, attempt, e)
+            await message.ack()
+            return
+        logger.info(f"Received task: {task_data}")
+        task_id = task_data.get('task_id') if isinstance(task_data, dict) else None
+        tracker = worker.ProgressTracker(task_id, _publish_progress)
+        try:
+            outcome, error = await process_task(task_data, attempt, tracker)
+        except asyncio.CancelledError:
+            # Cancelled by the shutdown drain: release and requeue the task
+            if task_id is not None:
+                try:
+                    await asyncio.to_thread(worker.release_task, task_id)
+                except Exception as e:
+                    logger.error(f"Could not release task {task_id}: {e}")
+            await message.nack(requeue=True)
+            raise
+        if task_id is not None:
+            tracker.finish(outcome)
+        if outcome == worker.TASK_RETRY:
+            await requeue_with_backoff(message, queue, attempt)
+        elif outcome == worker.TASK_DEAD:
+            await dead_letter(message, queue, attempt, error)
+        # Ack only after any retry/dead-letter copy has been published
+        await message.ack()
+        if isinstance(task_data, dict):
+            timestamp = message.timestamp.timestamp() if message.timestamp else None
+            worker.observe_task(worker.task_model(task_data), outcome,
+                                worker.enqueued_at(message.headers, timestamp), delivered)
+    finally:
+        _in_flight.discard(task)
+        _update_busy_gauge()
+
+
+async def declare_retry_topology(channel):
+    """aio-pika counterpart of worker.declare_retry_topology"""
+    _exchanges[worker.PROGRESS_EXCHANGE] = await channel.declare_exchange(
+        worker.PROGRESS_EXCHANGE, aio_pika.ExchangeType.TOPIC, durable=True)
+    dlx = await channel.declare_exchange(
+        worker.DEAD_LETTER_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True)
+    dead = await channel.declare_queue(worker.DEAD_LETTER_QUEUE, durable=True)
+    await dead.bind(dlx)
+    _exchanges[worker.DEAD_LETTER_EXCHANGE] = dlx
+    for delay in worker.retry_delays():
+        name = f'{worker.RETRY_QUEUE_PREFIX}{delay}'
+        exchange = await channel.declare_exchange(
+            name, aio_pika.ExchangeType.FANOUT, durable=True)
+        queue = await channel.declare_queue(
+            name, durable=True, arguments=worker.retry_queue_args(delay))
+        await queue.bind(exchange)
+        _exchanges[name] = exchange
+
+
+async def declare_shared_topology(channel):
+    """aio-pika counterpart of worker.declare_shared_topology; returns the queues"""
+    exchange = await channel.declare_exchange(
+        worker.TASK_EXCHANGE, aio_pika.ExchangeType.DIRECT, durable=True)
+    queues = []
+    for key in worker.shared_routing_keys():
+        queue = await channel.declare_queue(
+            worker.task_queue_name(key), durable=True, arguments=worker.TASK_QUEUE_ARGS)
+        await queue.bind(exchange, routing_key=key)
+        queues.append(queue)
+    return queues
+
+
+async def heartbeat_loop():
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        await asyncio.to_thread(worker.update_heartbeat)
+
+
+async def connect():
+    """Open a robust connection, retrying until the broker is reachable"""
+    while True:
+        try:
+            connection = await aio_pika.connect_robust(
+                host=os.environ.get('RABBITMQ_HOST', 'message_queue'),
+                login=os.environ.get('RABBITMQ_USER', 'guest'),
+                password=os.environ.get('RABBITMQ_PASS', 'guest'),
+            )
+            connection.reconnect_callbacks.add(
+                lambda *_: logger.info("Reconnected to RabbitMQ"))
+            connection.close_callbacks.add(
+                lambda *args: logger.warning(f"RabbitMQ connection closed: {args[-1] if args else ''}"))
+            return connection
+        except (aio_pika.exceptions.AMQPConnectionError, OSError) as e:
+            logger.error(f"Could not connect to RabbitMQ ({e}). Retrying in 5 seconds...")
+            await asyncio.sleep(5)
+
+
+async def run():
+    """Main coroutine for the asyncio worker"""
+    global _ollama_slots
+    _ollama_slots = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+    start_http_server(8000)
+    agent_id = await asyncio.to_thread(worker.register_agent)
+    await asyncio.to_thread(worker.warm_model)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    connection = await connect()
+    heartbeat = asyncio.ensure_future(heartbeat_loop())
+    try:
+        channel = await connection.channel()
+        await channel.set_qos(prefetch_count=WORKER_CONCURRENCY)
+        await declare_retry_topology(channel)
+        queues = []
+        if worker.consumes_direct():
+            queues.append(await channel.declare_queue(f'agent_{agent_id}', durable=True))
+        if worker.consumes_shared():
+            queues.extend(await declare_shared_topology(channel))
+        consumers = [(queue, await queue.consume(handle_message)) for queue in queues]
+        logger.info(
+            f"Worker {WORKER_ID} waiting for tasks on {[q.name for q in queues]} "
+            f"(async, concurrency={WORKER_CONCURRENCY}, ollama parallel={OLLAMA_NUM_PARALLEL})")
+
+        await stop.wait()
+
+        # Graceful drain: no new deliveries, let in-flight work finish
+        logger.info(f"Shutting down: draining {len(_in_flight)} in-flight task(s)...")
+        for queue, consumer_tag in consumers:
+            await queue.cancel(consumer_tag)
+        if _in_flight:
+            done, pending = await asyncio.wait(set(_in_flight), timeout=WORKER_DRAIN_TIMEOUT)
+            if pending:
+                logger.warning(
+                    f"{len(pending)} task(s) still running after {WORKER_DRAIN_TIMEOUT}s; "
+                    f"releasing them for another worker")
+                for t in pending:
+                    t.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+    finally:
+        heartbeat.cancel()
+        await embeddings.flush()
+        await completions.flush()
+        AGENT_STATUS.set(0)  # Set status to offline
+        try:
+            await asyncio.to_thread(worker.set_worker_status, 'offline')
+        except Exception as e:
+            logger.error(f"Error updating agent status: {str(e)}")
+        await connection.close()
+        logger.info("Worker stopped")
+
+
+if __name__ == '__main__':
+    asyncio.run(run())
@@ -2,11 +2,15 @@ import os
 import json
 import pika
 import psycopg2
-from prometheus_client import start_http_server, Counter, Gauge
+import psycopg2.pool
+import psycopg2.extras
+from prometheus_client import start_http_server, Counter, Gauge, Histogram
 import ollama
 import time
 import uuid
 import logging
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
 # Configure logging
@@ -22,57 +26,212 @@ TASKS_FAILED = Counter('tasks_failed_total', 'Total number of tasks that failed'
 TASK_PROCESSING_TIME = Gauge('task_processing_time_seconds', 'Time taken to process tasks')
 AGENT_STATUS = Gauge('agent_status', 'Current status of the agent (0=offline, 1=available, 2=busy)')
 
+# Latency distributions; status is the task outcome (done/retry/dead/skipped)
+# or ok/error for individual LLM and DB calls
+_TASK_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+_DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+TASK_QUEUE_WAIT = Histogram('task_queue_wait_seconds', 'Time from enqueue to delivery to a worker',
+                            ['model', 'status'], buckets=_TASK_BUCKETS)
+TASK_END_TO_END = Histogram('task_end_to_end_seconds', 'Time from enqueue to ack',
+                            ['model', 'status'], buckets=_TASK_BUCKETS)
+LLM_REQUEST_TIME = Histogram('llm_request_seconds', 'Wall time of Ollama generate/embed requests',
+                             ['model', 'status'], buckets=_TASK_BUCKETS)
+DB_WRITE_TIME = Histogram('db_write_seconds', 'Task bookkeeping write time',
+                          ['operation', 'status'], buckets=_DB_BUCKETS)
+# From Ollama's response stats
+LLM_PROMPT_TOKENS = Counter('llm_prompt_tokens_total', 'Prompt tokens evaluated', ['model'])
+LLM_COMPLETION_TOKENS = Counter('llm_completion_tokens_total', 'Tokens generated', ['model'])
+LLM_TOKENS_PER_SECOND = Histogram('llm_tokens_per_second', 'Generation speed (eval_count / eval_duration)',
+                                  ['model'], buckets=(1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 100, 150, 200, 400))
+LLM_MODEL_LOAD_TIME = Histogram('llm_model_load_seconds', 'Model load time reported by Ollama',
+                                ['model'], buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 20, 40, 80))
+
 # Generate a unique ID for this worker
 WORKER_ID = str(uuid.uuid4())
 
 # Initialize Ollama client
 ollama_client = ollama.Client()
 
-def get_db_connection():
-    """Get database connection"""
-    return psycopg2.connect(
-        host=os.environ.get('DB_HOST', 'database'),
-        database=os.environ.get('DB_NAME', 'project_db'),
-        user=os.environ.get('DB_USER', 'projectuser'),
-        password=os.environ.get('DB_PASSWORD', 'projectpass')
-    )
+# Generation model.  Defaults to the orchestrator's LOCAL_MODEL so workers
+# and the router share one resident model instead of swapping VRAM.  A
+# task's metadata.model (sent by the dispatcher) overrides it per task.
+WORKER_MODEL = os.environ.get('WORKER_MODEL') or os.environ.get('LOCAL_MODEL', 'llama3')
+# Sent with every Ollama request; -1 keeps the model loaded indefinitely
+MODEL_KEEP_ALIVE = os.environ.get('MODEL_KEEP_ALIVE', '30m')
+MODEL_KEEP_ALIVE = int(MODEL_KEEP_ALIVE) if MODEL_KEEP_ALIVE.lstrip('-').isdigit() else MODEL_KEEP_ALIVE
+# The orchestrator's pins ("local:llama3,remote:mistral"); workers use the
+# local backend, whose pinned models must keep keep_alive=-1 (Ollama
+# applies the keep_alive of the latest request, so 30m would un-pin them)
+def _local_pins(spec):
+    pins = set()
+    for item in spec.split(','):
+        backend, sep, model = item.strip().partition(':')
+        if not sep:
+            backend, model = 'local', backend
+        if backend == 'local' and model:
+            pins.add(model if ':' in model else f'{model}:latest')
+    return pins
+
+PINNED_MODELS = _local_pins(os.environ.get('OLLAMA_PINNED_MODELS', ''))
+
+# Capabilities advertised in worker_agents and used as shared-queue routing
+# keys; by default the model the worker actually runs
+WORKER_CAPABILITIES = [
+    c.strip() for c in (os.environ.get('WORKER_CAPABILITIES') or WORKER_MODEL).split(',') if c.strip()
+]
+
+# Dispatch mode: "direct" = only this worker's agent_<id> queue (legacy),
+# "shared" = only the shared work queues, "both" = consume from both.
+DISPATCH_MODE = os.environ.get('DISPATCH_MODE', 'both')
+
+# Shared work-queue topology.  Must stay in sync with the orchestrator's
+# task dispatcher, which declares the same names and arguments.
+TASK_EXCHANGE = 'tasks'
+DEAD_LETTER_EXCHANGE = 'tasks.dlx'
+DEAD_LETTER_QUEUE = 'tasks.dead'
+DEFAULT_ROUTING_KEY = 'default'
+TASK_QUEUE_ARGS = {
+    'x-dead-letter-exchange': DEAD_LETTER_EXCHANGE,
+    'x-max-priority': 10,
+}
+
+# Retry policy.  A failed task is republished to a delay queue whose
+# messages expire after the backoff and dead-letter (via the default
+# exchange) straight back to the queue they came from.  The attempt
+# number travels in the ATTEMPT_HEADER message header; after
+# TASK_MAX_ATTEMPTS the message goes to DEAD_LETTER_EXCHANGE instead.
+TASK_MAX_ATTEMPTS = int(os.environ.get('TASK_MAX_ATTEMPTS', '4'))
+TASK_RETRY_BASE_MS = int(os.environ.get('TASK_RETRY_BASE_MS', '5000'))
+TASK_RETRY_FACTOR = int(os.environ.get('TASK_RETRY_FACTOR', '4'))
+ATTEMPT_HEADER = 'x-attempt'
+RETRY_QUEUE_PREFIX = 'tasks.retry.'
+
+# process_task outcomes
+TASK_DONE = 'done'
+TASK_RETRY = 'retry'
+TASK_DEAD = 'dead'
+TASK_SKIPPED = 'skipped'   # stale duplicate delivery; nothing to do
+
+# Embedding tasks (message type "embed") return a vector instead of text
+EMBED_MODEL = os.environ.get('EMBED_MODEL', 'nomic-embed-text')
+EMBED_TASK_TYPE = 'embed'
+
+# Generation is streamed; progress events (tokens so far + new text) go
+# to PROGRESS_EXCHANGE at most every PROGRESS_INTERVAL seconds per task,
+# routed as task.<id>.  The orchestrator relays them over /ws.
+PROGRESS_EXCHANGE = 'task.progress'
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL_MS', '500')) / 1000
+# Results larger than this (JSON bytes) go to the task_results table and
+# tasks.metadata.result only keeps a stub with a preview
+RESULT_INLINE_MAX_BYTES = int(os.environ.get('RESULT_INLINE_MAX_BYTES', '16384'))
+RESULT_PREVIEW_CHARS = 500
+
+# Lease on a task while this worker processes it; renewed by every
+# heartbeat.  The orchestrator's reaper reclaims tasks whose lease ran
+# out or whose worker stopped heartbeating.
+TASK_LEASE_SECONDS = int(os.environ.get('TASK_LEASE_SECONDS', '900'))
+
+class PermanentTaskError(Exception):
+    """A failure that retrying cannot fix (malformed task, unknown model)"""
+
+# Database connection pool (shared by the sync consumer thread, the
+# heartbeat loop and, in async mode, the thread-pool DB calls)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Create the connection pool on first use"""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = psycopg2.pool.ThreadedConnectionPool(
+                    1, DB_POOL_SIZE,
+                    host=os.environ.get('DB_HOST', 'database'),
+                    database=os.environ.get('DB_NAME', 'project_db'),
+                    user=os.environ.get('DB_USER', 'projectuser'),
+                    password=os.environ.get('DB_PASSWORD', 'projectpass')
+                )
+    return _db_pool
+
+@contextmanager
+def db_cursor():
+    """Borrow a pooled autocommit connection and yield a cursor.
+
+    Every helper below issues a single statement, so autocommit keeps each
+    call to one round trip (no separate COMMIT).
+    """
+    pool = _get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            yield cur
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken or conn.closed != 0)
+
+@contextmanager
+def observe(histogram, **labels):
+    """Time the block into histogram, labelled status=ok/error"""
+    start = time.time()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        histogram.labels(status=status, **labels).observe(time.time() - start)
+
+def record_ollama_stats(model, response):
+    """Token counts, decode speed and load time from an Ollama response"""
+    prompt_tokens = response.get('prompt_eval_count') or 0
+    eval_tokens = response.get('eval_count') or 0
+    eval_ns = response.get('eval_duration') or 0
+    load_ns = response.get('load_duration') or 0
+    LLM_PROMPT_TOKENS.labels(model=model).inc(prompt_tokens)
+    LLM_COMPLETION_TOKENS.labels(model=model).inc(eval_tokens)
+    if eval_tokens and eval_ns:
+        LLM_TOKENS_PER_SECOND.labels(model=model).observe(eval_tokens / (eval_ns / 1e9))
+    if load_ns:
+        LLM_MODEL_LOAD_TIME.labels(model=model).observe(load_ns / 1e9)
+
+def enqueued_at(headers, timestamp=None):
+    """When a delivery became available: x-enqueued-at header, else the AMQP timestamp"""
+    value = (headers or {}).get('x-enqueued-at')
+    try:
+        return float(value) if value is not None else (float(timestamp) if timestamp else None)
+    except (TypeError, ValueError):
+        return None
+
+def observe_task(model, outcome, enqueued, delivered):
+    """Record queue wait and end-to-end time for a finished delivery"""
+    now = time.time()
+    if enqueued is not None:
+        TASK_QUEUE_WAIT.labels(model=model, status=outcome).observe(max(delivered - enqueued, 0))
+    TASK_END_TO_END.labels(model=model, status=outcome).observe(max(now - (enqueued or delivered), 0))
 
 def register_agent():
     """Register this agent in the database"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # First try to update existing agent
-        cur.execute(
-            '''
-            UPDATE worker_agents 
-            SET status = 'available',
-                last_heartbeat = NOW()
-            WHERE name = %s
-            RETURNING id
-            ''',
-            (WORKER_ID,)
-        )
-        
-        result = cur.fetchone()
-        
-        if not result:
-            # If no existing agent, insert new one
+        with db_cursor() as cur:
             cur.execute(
                 '''
                 INSERT INTO worker_agents (name, status, capabilities, last_heartbeat)
                 VALUES (%s, %s, %s, NOW())
+                ON CONFLICT (name) DO UPDATE
+                SET status = 'available',
+                    last_heartbeat = NOW()
                 RETURNING id
                 ''',
-                (WORKER_ID, 'available', json.dumps(['mistral']))
+                (WORKER_ID, 'available', json.dumps(WORKER_CAPABILITIES))
             )
-            result = cur.fetchone()
-        
-        agent_id = result[0]
-        conn.commit()
-        cur.close()
-        conn.close()
+            agent_id = cur.fetchone()[0]
         
         logger.info(f"Agent {WORKER_ID} registered with ID {agent_id}")
         AGENT_STATUS.set(1)  # Set status to available
@@ -83,72 +242,280 @@ def register_agent():
         raise e
 
 def update_heartbeat():
-    """Update agent's last heartbeat timestamp"""
+    """Update agent's last heartbeat timestamp and renew the leases of its tasks.
+
+    The status is re-derived from the tasks it is processing: concurrent
+    completions each see the other's task still running and can leave a
+    worker 'busy' after its last task; the next heartbeat corrects that.
+    """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            'UPDATE worker_agents SET last_heartbeat = NOW() WHERE name = %s',
-            (WORKER_ID,)
-        )
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        
+        with db_cursor() as cur:
+            cur.execute(
+                '''
+                WITH me AS (
+                    UPDATE worker_agents
+                    SET last_heartbeat = NOW(),
+                        status = CASE WHEN EXISTS (
+                            SELECT 1 FROM tasks
+                            WHERE assigned_agent = %(worker)s AND status = 'processing'
+                        ) THEN 'busy' ELSE 'available' END
+                    WHERE name = %(worker)s
+                )
+                UPDATE tasks
+                SET lease_expires_at = NOW() + make_interval(secs => %(lease)s)
+                WHERE assigned_agent = %(worker)s AND status = 'processing'
+                ''',
+                {'worker': WORKER_ID, 'lease': TASK_LEASE_SECONDS}
+            )
     except Exception as e:
         logger.error(f"Error updating heartbeat: {str(e)}")
 
-def process_task(task_data):
-    """Process a task using Mistral"""
+def warm_model():
+    """Load WORKER_MODEL before taking tasks so the first one isn't a cold load"""
     try:
-        # Extract task information
-        task_id = task_data['task_id']
-        description = task_data['description']
-        
-        logger.info(f"Processing task {task_id}: {description}")
-        start_time = time.time()
-        
-        # Update task status to processing
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
+        ollama_client.generate(model=WORKER_MODEL, prompt='', keep_alive=keep_alive(WORKER_MODEL))
+        logger.info(f"Model {WORKER_MODEL} loaded (keep_alive={keep_alive(WORKER_MODEL)})")
+    except Exception as e:
+        logger.warning(f"Could not preload {WORKER_MODEL}: {str(e)}")
+
+def keep_alive(model):
+    """keep_alive to send with a request for model (-1 if the orchestrator pins it)"""
+    return -1 if (model if ':' in model else f'{model}:latest') in PINNED_MODELS else MODEL_KEEP_ALIVE
+
+def build_prompt(task_data):
+    """Build the LLM prompt for a task message"""
+    return f"Execute this task and provide the result:\nTask: {task_data['description']}"
+
+def is_embedding_task(task_data):
+    return task_data.get('type') == EMBED_TASK_TYPE
+
+def task_model(task_data):
+    """Model a task runs on (metric label and Ollama model)"""
+    if is_embedding_task(task_data):
+        return EMBED_MODEL
+    return task_data.get('model') or WORKER_MODEL
+
+def embedding_input(task_data):
+    """Text to embed: an explicit 'input' or else the task description"""
+    return task_data.get('input') or task_data['description']
+
+def mark_task_processing(task_id, dispatch=None):
+    """Claim a task for this worker and mark it as being processed.
+
+    dispatch is the dispatcher's dispatch_count carried in the message.
+    When present it fences out stale deliveries: a message from an earlier
+    dispatch of a task that was since reclaimed and re-dispatched (or is
+    already done) claims nothing.  Returns whether the task was claimed.
+    """
+    with observe(DB_WRITE_TIME, operation='claim'), db_cursor() as cur:
         cur.execute(
-            'UPDATE tasks SET status = %s WHERE id = %s',
-            ('processing', task_id)
+            '''
+            WITH claimed AS (
+                UPDATE tasks
+                SET status = 'processing',
+                    assigned_agent = %(worker)s,
+                    lease_expires_at = NOW() + make_interval(secs => %(lease)s)
+                WHERE id = %(task_id)s
+                  AND (
+                      %(dispatch)s::int IS NULL
+                      OR (dispatch_count = %(dispatch)s::int
+                          AND (status IN ('dispatched', 'retrying')
+                               OR (status = 'processing' AND assigned_agent = %(worker)s)))
+                  )
+                RETURNING id
+            ),
+            busy AS (
+                UPDATE worker_agents SET status = 'busy'
+                WHERE name = %(worker)s AND EXISTS (SELECT 1 FROM claimed)
+            )
+            SELECT COUNT(*) FROM claimed
+            ''',
+            {'worker': WORKER_ID, 'lease': TASK_LEASE_SECONDS,
+             'task_id': task_id, 'dispatch': dispatch}
         )
-        conn.commit()
-        
-        # Use Mistral to process the task
-        prompt = f"Execute this task and provide the result:\nTask: {description}"
-        response = ollama_client.generate(model="mistral", prompt=prompt)
-        
-        # Update task with results
+        return cur.fetchone()[0] > 0
+
+def _result_row(task_id, result):
+    """VALUES row for complete_tasks: large results are split off into task_results"""
+    encoded = json.dumps(result)
+    if len(encoded) <= RESULT_INLINE_MAX_BYTES:
+        return (task_id, encoded, WORKER_ID, None)
+    text = result if isinstance(result, str) else encoded
+    stub = {
+        'stored_in': 'task_results',
+        'bytes': len(text.encode()),
+        'preview': text[:RESULT_PREVIEW_CHARS],
+    }
+    return (task_id, json.dumps(stub), WORKER_ID, text)
+
+def complete_tasks(results):
+    """Store results for [(task_id, result), ...] and mark this worker
+    available if it has no other task still processing (the async worker
+    prefetches several).
+
+    One statement regardless of batch size: the task updates, large-result
+    rows and the worker availability update are combined in a single CTE.
+    """
+    if not results:
+        return
+    with observe(DB_WRITE_TIME, operation='complete'), db_cursor() as cur:
+        psycopg2.extras.execute_values(
+            cur,
+            '''
+            WITH v(id, result, worker, body) AS (VALUES %s),
+            stored AS (
+                INSERT INTO task_results (task_id, result, bytes)
+                SELECT id, body, octet_length(body) FROM v WHERE body IS NOT NULL
+                ON CONFLICT (task_id) DO UPDATE
+                SET result = EXCLUDED.result, bytes = EXCLUDED.bytes, created_at = NOW()
+            ),
+            done AS (
+                UPDATE tasks AS t
+                SET status = 'completed',
+                    completion_percentage = 100,
+                    metadata = jsonb_set(
+                        COALESCE(t.metadata, '{}'::jsonb),
+                        '{result}',
+                        v.result
+                    )
+                FROM v
+                WHERE t.id = v.id
+            )
+            UPDATE worker_agents AS w SET status = 'available'
+            WHERE w.name IN (SELECT worker FROM v)
+              AND NOT EXISTS (
+                  SELECT 1 FROM tasks t
+                  WHERE t.assigned_agent = w.name AND t.status = 'processing'
+                    AND t.id NOT IN (SELECT id FROM v)
+              )
+            ''',
+            [_result_row(task_id, result) for task_id, result in results],
+            template='(%s::int, %s::jsonb, %s, %s::text)',
+            page_size=max(len(results), 1)
+        )
+
+def complete_task(task_id, result):
+    """Store the task result (see complete_tasks)"""
+    complete_tasks([(task_id, result)])
+
+def release_task(task_id):
+    """Hand a task this worker claimed but did not finish back to 'dispatched'.
+
+    Its message is requeued by the caller; without the release the
+    redelivery would be fenced out by mark_task_processing (the task would
+    still be 'processing' under this worker) until the reaper's lease ran out.
+    """
+    with observe(DB_WRITE_TIME, operation='release'), db_cursor() as cur:
         cur.execute(
             '''
-            UPDATE tasks 
-            SET status = %s,
-                completion_percentage = 100,
-                metadata = jsonb_set(
-                    metadata,
-                    '{result}',
-                    %s::jsonb
-                )
-            WHERE id = %s
+            UPDATE tasks
+            SET status = 'dispatched', assigned_agent = NULL
+            WHERE id = %s AND status = 'processing' AND assigned_agent = %s
             ''',
-            ('completed', json.dumps(response['response']), task_id)
+            (task_id, WORKER_ID)
         )
-        
-        # Update agent status to available
+
+def fail_task(task_id, error, attempt=1, final=True):
+    """Record a task failure and mark this worker available again if it
+    has no other task still processing.
+
+    A final failure marks the task 'failed' (its message is dead-lettered);
+    otherwise the task is left 'retrying' until the delayed message returns.
+    """
+    with observe(DB_WRITE_TIME, operation='fail'), db_cursor() as cur:
+        cur.execute(
+            '''
+            WITH failed AS (
+                UPDATE tasks 
+                SET status = %s,
+                    metadata = COALESCE(metadata, '{}'::jsonb) || jsonb_build_object(
+                        'error', %s::text,
+                        'attempts', %s::int,
+                        'dead_lettered', %s::boolean
+                    )
+                WHERE id = %s
+            )
+            UPDATE worker_agents AS w SET status = 'available'
+            WHERE w.name = %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM tasks t
+                  WHERE t.assigned_agent = w.name AND t.status = 'processing' AND t.id <> %s
+              )
+            ''',
+            ('failed' if final else 'retrying', str(error), attempt, final, task_id,
+             WORKER_ID, task_id)
+        )
+
+def set_worker_status(status):
+    """Set this worker's status in the worker_agents table"""
+    with db_cursor() as cur:
         cur.execute(
             'UPDATE worker_agents SET status = %s WHERE name = %s',
-            ('available', WORKER_ID)
+            (status, WORKER_ID)
         )
+
+def is_retryable(error):
+    """Whether a failed task is worth another attempt"""
+    if isinstance(error, (PermanentTaskError, KeyError, TypeError, ValueError)):
+        return False
+    # Unknown model and other client errors will fail the same way again
+    status = getattr(error, 'status_code', None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 429):
+        return False
+    return True
+
+def record_failure(task_id, error, attempt):
+    """Log a failed attempt and decide its fate; returns TASK_RETRY or TASK_DEAD"""
+    TASKS_FAILED.inc()
+    final = attempt >= TASK_MAX_ATTEMPTS or not is_retryable(error)
+    logger.error(
+        f"Task {task_id} attempt {attempt}/{TASK_MAX_ATTEMPTS} failed: {str(error)}"
+        f"{' (giving up)' if final else ''}"
+    )
+    if task_id is not None:
+        try:
+            fail_task(task_id, error, attempt, final)
+        except Exception as db_error:
+            logger.error(f"Error updating task status: {str(db_error)}")
+    return TASK_DEAD if final else TASK_RETRY
+
+def process_task(task_data, attempt=1, tracker=None):
+    """Process a task with its model (task_model); returns (outcome, error).
+
+    Streamed output is reported to tracker (a ProgressTracker), if given.
+    """
+    task_id = task_data.get('task_id') if isinstance(task_data, dict) else None
+    try:
+        # Extract task information
+        if task_id is None:
+            raise PermanentTaskError("Message has no task_id")
+        description = task_data['description']
+        
+        logger.info(f"Processing task {task_id} (attempt {attempt}): {description}")
+        start_time = time.time()
+        
+        # Update task status to processing
+        if not mark_task_processing(task_id, task_data.get('dispatch')):
+            logger.info(f"Skipping stale delivery of task {task_id}")
+            AGENT_STATUS.set(1)
+            return TASK_SKIPPED, None
         
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Use the worker's model to process the task (or embed it)
+        model = task_model(task_data)
+        with observe(LLM_REQUEST_TIME, model=model):
+            if is_embedding_task(task_data):
+                response = ollama_client.embed(
+                    model=model, input=[embedding_input(task_data)],
+                    keep_alive=keep_alive(model))
+                result = response['embeddings'][0]
+            else:
+                response = stream_generate(
+                    model, build_prompt(task_data), tracker or ProgressTracker(task_id))
+                result = response['response']
+        record_ollama_stats(model, response)
+        
+        # Update task with results
+        complete_task(task_id, result)
         
         # Update metrics
         TASKS_PROCESSED.inc()
@@ -157,59 +524,206 @@ def process_task(task_data):
         AGENT_STATUS.set(1)  # Set status back to available
         
         logger.info(f"Task {task_id} completed successfully")
-        return True
+        return TASK_DONE, None
         
     except Exception as e:
-        logger.error(f"Error processing task: {str(e)}")
-        TASKS_FAILED.inc()
         AGENT_STATUS.set(1)  # Set status back to available
-        
-        try:
-            # Update task status to failed
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            cur.execute(
-                '''
-                UPDATE tasks 
-                SET status = %s,
-                    metadata = jsonb_set(
-                        metadata,
-                        '{error}',
-                        %s::jsonb
-                    )
-                WHERE id = %s
-                ''',
-                ('failed', json.dumps(str(e)), task_id)
-            )
-            
-            # Update agent status to available
-            cur.execute(
-                'UPDATE worker_agents SET status = %s WHERE name = %s',
-                ('available', WORKER_ID)
-            )
-            
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-        except Exception as db_error:
-            logger.error(f"Error updating task status: {str(db_error)}")
-        
-        return False
+        return record_failure(task_id, e, attempt), e
+
+def task_queue_name(routing_key):
+    """Name of the shared work queue for a routing key"""
+    return f'tasks.{routing_key}'
+
+def shared_routing_keys():
+    """Routing keys this worker competes for: the default queue plus one per capability"""
+    return [DEFAULT_ROUTING_KEY] + [c for c in WORKER_CAPABILITIES if c != DEFAULT_ROUTING_KEY]
+
+def consumes_direct():
+    return DISPATCH_MODE in ('direct', 'both')
+
+def consumes_shared():
+    return DISPATCH_MODE in ('shared', 'both')
+
+def declare_shared_topology(channel):
+    """Declare the work exchange and shared queues; returns queue names"""
+    channel.exchange_declare(TASK_EXCHANGE, exchange_type='direct', durable=True)
+    queues = []
+    for key in shared_routing_keys():
+        queue_name = task_queue_name(key)
+        channel.queue_declare(queue_name, durable=True, arguments=TASK_QUEUE_ARGS)
+        channel.queue_bind(queue_name, TASK_EXCHANGE, routing_key=key)
+        queues.append(queue_name)
+    return queues
+
+class ProgressTracker:
+    """Throttles streamed output for one task into progress events.
+
+    Events go to emit(event) at most every PROGRESS_INTERVAL and carry the
+    text generated since the previous event, so consumers append deltas.
+    finish() sends the closing event with the task outcome.
+    """
+
+    def __init__(self, task_id, emit=None, interval=None):
+        self.task_id = task_id
+        self.emit = emit or (lambda event: None)
+        self.interval = PROGRESS_INTERVAL if interval is None else interval
+        self.tokens = 0
+        self.seq = 0
+        self._pending = []
+        self._started = time.time()
+        self._last = self._started
+
+    def _send(self, **extra):
+        self.seq += 1
+        delta, self._pending = ''.join(self._pending), []
+        self._last = time.time()
+        self.emit({'task_id': self.task_id, 'seq': self.seq, 'tokens': self.tokens,
+                   'delta': delta, 'elapsed': round(self._last - self._started, 3), **extra})
+
+    def add(self, text):
+        self.tokens += 1
+        self._pending.append(text)
+        if time.time() - self._last >= self.interval:
+            self._send()
+
+    def flush(self):
+        if self._pending:
+            self._send()
+
+    def finish(self, outcome):
+        self._send(done=True, status=outcome)
+
+def progress_routing_key(task_id):
+    return f'task.{task_id}'
+
+def publish_progress(ch, event):
+    """Best-effort progress event (transient; losing one only skips a UI update)"""
+    try:
+        ch.basic_publish(
+            PROGRESS_EXCHANGE, progress_routing_key(event['task_id']), json.dumps(event),
+            pika.BasicProperties(content_type='application/json', delivery_mode=1))
+    except Exception as e:
+        logger.debug(f"Progress publish failed: {str(e)}")
+
+def stream_generate(model, prompt, tracker):
+    """Streamed generate reporting to tracker; returns the final chunk with the full text"""
+    parts = []
+    final = {}
+    for chunk in ollama_client.generate(model=model, prompt=prompt,
+                                        keep_alive=keep_alive(model), stream=True):
+        parts.append(chunk.get('response', ''))
+        tracker.add(chunk.get('response', ''))
+        if chunk.get('done'):
+            final = dict(chunk)
+    tracker.flush()
+    final['response'] = ''.join(parts)
+    return final
+
+def retry_delays():
+    """Backoff before each retry, in ms: base, base*factor, base*factor^2, ..."""
+    return [TASK_RETRY_BASE_MS * TASK_RETRY_FACTOR ** i for i in range(max(TASK_MAX_ATTEMPTS - 1, 0))]
+
+def retry_delay_ms(attempt):
+    """Backoff after failing the given attempt"""
+    delays = retry_delays()
+    return delays[min(attempt, len(delays)) - 1]
+
+def retry_queue_name(attempt):
+    """Delay queue a message goes to after failing the given attempt"""
+    return f'{RETRY_QUEUE_PREFIX}{retry_delay_ms(attempt)}'
+
+def origin_queue(exchange, routing_key):
+    """Queue a delivery was consumed from, given its exchange and routing key"""
+    if exchange == TASK_EXCHANGE:
+        return task_queue_name(routing_key)
+    # Direct agent_<id> publishes and returning retries use the default exchange
+    return routing_key
+
+def attempt_of(headers):
+    """Attempt number carried in the message headers (first delivery = 1)"""
+    try:
+        return max(int((headers or {}).get(ATTEMPT_HEADER, 1)), 1)
+    except (TypeError, ValueError):
+        return 1
+
+def retry_queue_args(delay):
+    """Expired messages go back through the default exchange to their origin queue"""
+    return {'x-message-ttl': delay, 'x-dead-letter-exchange': ''}
+
+def declare_retry_topology(channel):
+    """Declare the dead-letter queue, one delay queue per backoff step and the progress exchange"""
+    channel.exchange_declare(PROGRESS_EXCHANGE, exchange_type='topic', durable=True)
+    channel.exchange_declare(DEAD_LETTER_EXCHANGE, exchange_type='fanout', durable=True)
+    channel.queue_declare(DEAD_LETTER_QUEUE, durable=True)
+    channel.queue_bind(DEAD_LETTER_QUEUE, DEAD_LETTER_EXCHANGE)
+    for delay in retry_delays():
+        name = f'{RETRY_QUEUE_PREFIX}{delay}'
+        channel.exchange_declare(name, exchange_type='fanout', durable=True)
+        channel.queue_declare(name, durable=True, arguments=retry_queue_args(delay))
+        channel.queue_bind(name, name)
+
+def _forward_properties(properties, headers):
+    return pika.BasicProperties(
+        delivery_mode=2,
+        content_type=properties.content_type,
+        priority=properties.priority,
+        message_id=properties.message_id,
+        headers=headers,
+    )
+
+def requeue_with_backoff(ch, properties, body, queue, attempt):
+    """Park a failed message in a delay queue; it returns to queue afterwards"""
+    # Delay exchanges are fanout, so the routing key (the origin queue) is
+    # carried untouched and reused when the expired message is dead-lettered
+    # to the default exchange.
+    headers = dict(properties.headers or {})
+    headers[ATTEMPT_HEADER] = attempt + 1
+    # Queue wait of the retry is measured from when the backoff ends
+    headers['x-enqueued-at'] = time.time() + retry_delay_ms(attempt) / 1000
+    retry_queue = retry_queue_name(attempt)
+    ch.basic_publish(retry_queue, queue, body, _forward_properties(properties, headers))
+    logger.info(f"Retrying in {retry_queue[len(RETRY_QUEUE_PREFIX):]}ms via {retry_queue}")
+
+def dead_letter(ch, properties, body, queue, attempt, error):
+    """Publish a message that exhausted its attempts to the dead-letter queue"""
+    headers = dict(properties.headers or {})
+    headers.update({
+        ATTEMPT_HEADER: attempt,
+        'x-origin-queue': queue,
+        'x-error': str(error)[:1000],
+    })
+    ch.basic_publish(DEAD_LETTER_EXCHANGE, queue, body, _forward_properties(properties, headers))
 
 def callback(ch, method, properties, body):
     """Callback function for processing messages from RabbitMQ"""
-    task_data = json.loads(body)
+    delivered = time.time()
+    attempt = attempt_of(properties.headers)
+    queue = origin_queue(method.exchange, method.routing_key)
+    try:
+        task_data = json.loads(body)
+    except ValueError as e:
+        logger.error(f"Dead-lettering malformed message from {queue}: {e}")
+        dead_letter(ch, properties, body, queue, attempt, e)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
     logger.info(f"Received task: {task_data}")
     
     AGENT_STATUS.set(2)  # Set status to busy
     
-    if process_task(task_data):
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-    else:
-        # Requeue the message if processing failed
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+    task_id = task_data.get('task_id') if isinstance(task_data, dict) else None
+    tracker = ProgressTracker(task_id, lambda event: publish_progress(ch, event))
+    outcome, error = process_task(task_data, attempt, tracker)
+    if task_id is not None:
+        tracker.finish(outcome)
+    if outcome == TASK_RETRY:
+        requeue_with_backoff(ch, properties, body, queue, attempt)
+    elif outcome == TASK_DEAD:
+        dead_letter(ch, properties, body, queue, attempt, error)
+    # Ack only after any retry/dead-letter copy has been published
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+    if isinstance(task_data, dict):
+        observe_task(task_model(task_data), outcome,
+                     enqueued_at(properties.headers, properties.timestamp), delivered)
 
 def main():
     """Main function to run the worker agent"""
@@ -219,6 +733,7 @@ def main():
         
         # Register agent
         agent_id = register_agent()
+        warm_model()
         
         # Set up heartbeat timer
         last_heartbeat = time.time()
@@ -239,32 +754,40 @@ def main():
                 )
                 channel = connection.channel()
                 
-                # Declare queue
-                queue_name = f'agent_{agent_id}'
-                channel.queue_declare(queue=queue_name, durable=True)
+                # Declare queues
+                declare_retry_topology(channel)
+                queue_names = []
+                if consumes_direct():
+                    queue_name = f'agent_{agent_id}'
+                    channel.queue_declare(queue=queue_name, durable=True)
+                    queue_names.append(queue_name)
+                if consumes_shared():
+                    queue_names.extend(declare_shared_topology(channel))
                 
-                # Set up consumer
+                # Set up consumers
                 channel.basic_qos(prefetch_count=1)
-                channel.basic_consume(
-                    queue=queue_name,
-                    on_message_callback=callback
-                )
+                for queue_name in queue_names:
+                    channel.basic_consume(
+                        queue=queue_name,
+                        on_message_callback=callback
+                    )
                 
-                logger.info(f"Worker {WORKER_ID} waiting for tasks. To exit press CTRL+C")
+                logger.info(f"Worker {WORKER_ID} waiting for tasks on {queue_names}. To exit press CTRL+C")
                 
                 # Start consuming in a separate thread
-                import threading
                 consumer_thread = threading.Thread(target=channel.start_consuming)
                 consumer_thread.daemon = True
                 consumer_thread.start()
                 
-                # Main loop for heartbeat
-                while True:
+                # Main loop for heartbeat; reconnect if the consumer dies
+                while consumer_thread.is_alive():
                     current_time = time.time()
                     if current_time - last_heartbeat >= 30:  # Send heartbeat every 30 seconds
                         update_heartbeat()
                         last_heartbeat = current_time
                     time.sleep(1)
+                logger.error("Consumer thread stopped. Reconnecting in 5 seconds...")
+                time.sleep(5)
                 
             except pika.exceptions.AMQPConnectionError:
                 logger.error("Lost connection to RabbitMQ. Retrying in 5 seconds...")
@@ -277,15 +800,7 @@ def main():
         logger.info("Shutting down worker agent...")
         AGENT_STATUS.set(0)  # Set status to offline
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute(
-                'UPDATE worker_agents SET status = %s WHERE name = %s',
-                ('offline', WORKER_ID)
-            )
-            conn.commit()
-            cur.close()
-            conn.close()
+            set_worker_status('offline')
         except Exception as e:
             logger.error(f"Error updating agent status: {str(e)}")
     except Exception as e: